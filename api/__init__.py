@@ -0,0 +1,3 @@
+from .server import app, serve
+
+__all__ = ['app', 'serve']
\ No newline at end of file
@@ -0,0 +1,341 @@
+import os
+import json
+import math
+import asyncio
+import uvicorn
+from functools import partial
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.routing import Route
+from config import Config, get_catalog
+from rag_chain.async_chain import arun_rag_chain, arun_rag_chain_stream
+from vector_db.add_documents import add_to_db
+from vector_db.chroma_db import delete_documents_by_file_id
+from utils.metrics import metrics
+from utils.admission import admission_controller
+
+# Worker processes are started fresh by uvicorn, so the parent passes its
+# (command line adjusted) configuration through the environment
+CONFIG_ENV = "PHARMAQUERY_CONFIG"
+
+
+def export_config():
+    """Serialize the ``Config`` attributes for worker processes.
+
+    Scalars, lists and dicts (e.g. ``COLLECTION_INDEX_SETTINGS``) are exported;
+    attributes that cannot be represented as JSON are left at their defaults.
+
+    Returns:
+        str: JSON object of attribute names and values.
+    """
+    values = {}
+    for name, value in vars(Config).items():
+        if not name.isupper() or not isinstance(value, (str, int, float, bool, type(None), list, tuple, dict)):
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        values[name] = value
+    return json.dumps(values)
+
+
+def import_config():
+    """Apply the configuration exported by the parent process, if any."""
+    values = os.environ.get(CONFIG_ENV)
+    if values:
+        for name, value in json.loads(values).items():
+            setattr(Config, name, value)
+
+
+class Overloaded(Exception):
+    """Raised when an endpoint has no free slot within the queue timeout."""
+
+
+class EndpointLimiter:
+    """Limit the number of requests an endpoint processes at once.
+
+    Requests beyond the limit wait up to ``queue_timeout`` seconds for a free
+    slot and are rejected afterwards, so a burst cannot pile up unbounded work
+    on the model servers.
+    """
+    def __init__(self, name, limit, queue_timeout):
+        """Initialize the limiter.
+
+        Args:
+            name (str): Endpoint name used in statistics.
+            limit (int): Maximum concurrent requests.
+            queue_timeout (float): Seconds a request may wait for a slot.
+        """
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        """Wait for a free slot, raising ``Overloaded`` after the queue timeout."""
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(self.name)
+        self.active += 1
+
+    def release(self):
+        """Free the slot taken by ``acquire``."""
+        self.active -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class LimitedStreamingResponse(StreamingResponse):
+    """Streaming response holding a slot of its endpoint limiter until it ends.
+
+    The slot is freed when the response is finished, fails or is cancelled,
+    including when the client disconnects before the body generator starts.
+    """
+    def __init__(self, content, limiter, **kwargs):
+        """Wrap the body generator.
+
+        Args:
+            content: Async iterable of the body.
+            limiter (EndpointLimiter): Limiter whose slot was acquired for this response.
+            **kwargs: Arguments of ``StreamingResponse``.
+        """
+        super().__init__(content, **kwargs)
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+
+class UploadedPDF:
+    """In-memory upload with the interface ``add_to_db`` expects from Streamlit uploads."""
+    def __init__(self, name, data):
+        """Wrap uploaded bytes.
+
+        Args:
+            name (str): File name.
+            data (bytes): File content.
+        """
+        self.name = name
+        self.size = len(data)
+        self._data = data
+
+    def getbuffer(self):
+        """Return the file content as a memoryview."""
+        return memoryview(self._data)
+
+
+limiters = {}
+
+
+def get_limiter(name):
+    """Return the limiter of an endpoint, created on first use in the worker's event loop."""
+    if name not in limiters:
+        limit = {
+            "query": Config.SERVE_QUERY_CONCURRENCY,
+            "stream": Config.SERVE_STREAM_CONCURRENCY,
+            "ingest": Config.SERVE_INGEST_CONCURRENCY,
+        }[name]
+        limiters[name] = EndpointLimiter(name, limit, Config.SERVE_QUEUE_TIMEOUT)
+    return limiters[name]
+
+
+def overloaded_response(name):
+    """Return the response for a request rejected by its endpoint limiter."""
+    return JSONResponse({"error": f"Too many concurrent {name} requests"}, status_code=503,
+                        headers={"Retry-After": "1"})
+
+
+def read_only_response():
+    """Return the response for a write request to a read-only worker."""
+    return JSONResponse({"error": "Server is read-only (multiple workers share the vector store); "
+                                  "ingest with a single worker"}, status_code=403)
+
+
+async def read_query(request):
+    """Parse the JSON body of a query request.
+
+    Generation requests queue fairly per session: the ``session_id`` of the
+    body, or the client address if none is given.
+
+    Returns:
+        tuple: Query text, chat history, timeout (seconds or None) and session.
+
+    Raises:
+        ValueError: If the body is not JSON, the query is missing or the timeout is invalid.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ValueError("Request body must be JSON")
+    query = body.get("query") if isinstance(body, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("Missing 'query'")
+    timeout = body.get("timeout")
+    if timeout is not None:
+        try:
+            timeout = float(timeout)
+        except (TypeError, ValueError):
+            timeout = float("nan")
+        if not (math.isfinite(timeout) and timeout > 0):
+            raise ValueError("'timeout' must be a positive number of seconds")
+    session_id = body.get("session_id") or (request.client.host if request.client else None)
+    return query, body.get("chat_history") or [], timeout, session_id
+
+
+async def health(request):
+    """Report liveness, the endpoint limiter state and the LLM admission queue."""
+    return JSONResponse({
+        "status": "ok",
+        "read_only": Config.SERVE_READ_ONLY,
+        "endpoints": {name: {"active": limiter.active, "limit": limiter.limit, "rejected": limiter.rejected}
+                      for name, limiter in limiters.items()},
+        "generation": admission_controller.stats()
+    })
+
+
+async def metrics_endpoint(request):
+    """Export the metrics of this worker in the Prometheus text format."""
+    lines = []
+    for field, help_text in (("active", "Requests in progress"), ("rejected", "Requests rejected with a 503")):
+        name = f"pharmaquery_endpoint_{field}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {'gauge' if field == 'active' else 'counter'}")
+        for endpoint, limiter in limiters.items():
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(limiter, field)}')
+    return PlainTextResponse(metrics.render() + "\n".join(lines) + "\n",
+                             media_type="text/plain; version=0.0.4")
+
+
+async def query(request):
+    """Answer a question: ``{"query": str, "timeout": float, "session_id": str}`` -> ``{"answer": str}``."""
+    try:
+        text, _, timeout, session_id = await read_query(request)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        async with get_limiter("query"):
+            answer = await arun_rag_chain(text, timeout=timeout, session_id=session_id)
+    except Overloaded:
+        return overloaded_response("query")
+    return JSONResponse({"answer": answer, "error": answer.startswith("Error generating response:")})
+
+
+async def query_stream(request):
+    """Stream an answer as Server-Sent Events.
+
+    The body is ``{"query": str, "chat_history": list, "timeout": float,
+    "session_id": str}``. Each
+    piece of the answer is sent as a ``data: {"delta": str}`` event, followed by
+    a final ``done`` event. A client disconnect closes the generation stream.
+    """
+    try:
+        text, chat_history, timeout, session_id = await read_query(request)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    limiter = get_limiter("stream")
+    try:
+        await limiter.acquire()
+    except Overloaded:
+        return overloaded_response("stream")
+
+    async def events():
+        async for piece in arun_rag_chain_stream(text, chat_history, timeout=timeout, session_id=session_id):
+            yield f"data: {json.dumps({'delta': piece}, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    # The slot is held until the stream is finished or the client went away
+    return LimitedStreamingResponse(events(), limiter, media_type="text/event-stream",
+                                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def list_documents(request):
+    """List the ingested files."""
+    return JSONResponse({"files": get_catalog().list_files()})
+
+
+async def add_documents(request):
+    """Ingest the PDF files of a multipart upload (field ``files``).
+
+    Files named like an ingested file with a different content are skipped and
+    listed in the ``conflicts`` of the stats, unless the form field ``replace``
+    is ``true``.
+    """
+    if Config.SERVE_READ_ONLY:
+        return read_only_response()
+    form = await request.form()
+    uploads = [UploadedPDF(upload.filename, await upload.read())
+               for upload in form.getlist("files") if getattr(upload, "filename", None)]
+    if not uploads:
+        return JSONResponse({"error": "No files uploaded in field 'files'"}, status_code=400)
+    replace = str(form.get("replace", "")).lower() in ("1", "true", "yes")
+    try:
+        async with get_limiter("ingest"):
+            # Ingestion is synchronous (process pool and blocking I/O)
+            loop = asyncio.get_running_loop()
+            stats = await asyncio.wait_for(loop.run_in_executor(None, partial(add_to_db, uploads, replace=replace)),
+                                           Config.SERVE_INGEST_TIMEOUT)
+    except Overloaded:
+        return overloaded_response("ingest")
+    except asyncio.TimeoutError:
+        return JSONResponse({"error": "Ingestion timed out, it continues in the background"}, status_code=504)
+    return JSONResponse({"stats": stats.as_dict() if stats is not None else None})
+
+
+async def delete_document(request):
+    """Delete a file and its chunks by file ID."""
+    if Config.SERVE_READ_ONLY:
+        return read_only_response()
+    file_id = request.path_params["file_id"]
+    loop = asyncio.get_running_loop()
+    deleted = await loop.run_in_executor(None, delete_documents_by_file_id, file_id)
+    return JSONResponse({"deleted": deleted}, status_code=200 if deleted else 404)
+
+
+import_config()
+
+app = Starlette(routes=[
+    Route("/health", health, methods=["GET"]),
+    Route("/metrics", metrics_endpoint, methods=["GET"]),
+    Route("/query", query, methods=["POST"]),
+    Route("/query/stream", query_stream, methods=["POST"]),
+    Route("/documents", list_documents, methods=["GET"]),
+    Route("/documents", add_documents, methods=["POST"]),
+    Route("/documents/{file_id}", delete_document, methods=["DELETE"]),
+])
+
+
+def serve(host=None, port=None, workers=None):
+    """Run the HTTP API with uvicorn.
+
+    With more than one worker process the vector store is shared read-only:
+    Chroma's persistent store does not support concurrent writers, so the
+    ingest and delete endpoints are disabled.
+
+    Args:
+        host (str, optional): Bind address, defaults to ``Config.SERVE_HOST``.
+        port (int, optional): Port, defaults to ``Config.SERVE_PORT``.
+        workers (int, optional): Worker processes, defaults to ``Config.SERVE_WORKERS``.
+    """
+    host = host or Config.SERVE_HOST
+    port = port or Config.SERVE_PORT
+    workers = workers or Config.SERVE_WORKERS
+    if workers > 1:
+        Config.SERVE_READ_ONLY = True
+        os.environ[CONFIG_ENV] = export_config()
+        uvicorn.run("api.server:app", host=host, port=port, workers=workers)
+    else:
+        uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,267 @@
+import sys
+import os
+
+# Add project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from benchmarks.stubs import StubServer, StubSettings
+from benchmarks.pdfs import make_corpus
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Metrics compared by --compare: (section, key, higher is better)
+KEY_METRICS = [
+    ("ingest", "chunks_per_second", True),
+    ("query", "p50", False),
+    ("query", "p95", False),
+    ("query", "p99", False),
+    ("query", "ttft_p50", False),
+    ("query", "ttft_p95", False),
+    ("query", "queries_per_second", True),
+]
+
+
+def percentile(values, p):
+    """Return the nearest-rank percentile of a list of numbers (0.0 if empty)."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def make_queries(texts, count, seed):
+    """Build questions from random fragments of the corpus.
+
+    Args:
+        texts (list): Page texts of the corpus.
+        count (int): Number of questions.
+        seed (int): Seed of the fragment choice.
+
+    Returns:
+        list: Question strings.
+    """
+    rng = random.Random(seed)
+    sentences = [sentence for text in texts for sentence in text.split("\n")]
+    queries = []
+    for _ in range(count):
+        words = rng.choice(sentences).rstrip(".").split()
+        start = rng.randrange(0, max(1, len(words) - 6))
+        queries.append("What is known about " + " ".join(words[start:start + 6]).lower() + "?")
+    return queries
+
+
+def run_ingest(uploads):
+    """Ingest the synthetic corpus and return throughput figures."""
+    from vector_db.add_documents import add_to_db
+
+    started = time.perf_counter()
+    stats = add_to_db(uploads)
+    elapsed = time.perf_counter() - started
+    result = stats.as_dict() if stats is not None else {}
+    result["wall_seconds"] = elapsed
+    result["chunks_per_second"] = result.get("chunks_written", 0) / elapsed if elapsed else 0.0
+    return result
+
+
+def run_queries(queries, concurrency, stream):
+    """Run the RAG chain over the queries with a fixed number of concurrent users.
+
+    Args:
+        queries (list): Questions to ask.
+        concurrency (int): Concurrent users.
+        stream (bool): Use ``run_rag_chain_stream`` and measure time to first token.
+
+    Returns:
+        dict: Latency percentiles, time to first token and throughput.
+    """
+    from rag_chain.chain import run_rag_chain, run_rag_chain_stream
+
+    def ask(query):
+        started = time.perf_counter()
+        first_token = None
+        if stream:
+            for piece in run_rag_chain_stream(query):
+                if first_token is None and piece:
+                    first_token = time.perf_counter() - started
+            error = False
+        else:
+            error = run_rag_chain(query).startswith("Error generating response")
+        return time.perf_counter() - started, first_token, error
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(ask, queries))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, _, _ in results]
+    first_tokens = [first_token for _, first_token, _ in results if first_token is not None]
+    decode = [latency - first_token for latency, first_token, _ in results if first_token is not None]
+    return {
+        "queries": len(results),
+        "errors": sum(1 for _, _, error in results if error),
+        "concurrency": concurrency,
+        "stream": stream,
+        "wall_seconds": elapsed,
+        "queries_per_second": len(results) / elapsed if elapsed else 0.0,
+        "avg": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "ttft_p50": percentile(first_tokens, 0.50),
+        "ttft_p95": percentile(first_tokens, 0.95),
+        "ttft_p99": percentile(first_tokens, 0.99),
+        "decode_avg": sum(decode) / len(decode) if decode else 0.0,
+    }
+
+
+def stage_breakdown(query_result):
+    """Split the average query latency into stages.
+
+    Upstream stages come from the per-endpoint latency statistics of the query
+    phase (for streamed answers the ``vllm`` latency is the time until the
+    response starts). ``decode`` is the time from the first token to the end of
+    the answer and ``local`` is the rest: vector search, prompt assembly and
+    queueing inside the application.
+
+    Args:
+        query_result (dict): Result of ``run_queries``.
+
+    Returns:
+        dict: Average seconds per query for every stage, and the endpoint statistics.
+    """
+    from utils.http_client import latency_stats
+
+    endpoints = latency_stats.snapshot()
+    queries = query_result["queries"] or 1
+    stages = {name: stats["avg"] * stats["count"] / queries for name, stats in endpoints.items()}
+    stages["decode"] = query_result["decode_avg"]
+    stages["local"] = max(query_result["avg"] - sum(stages.values()), 0.0)
+    return {"per_query_avg": stages, "endpoints": endpoints}
+
+
+def compare(result, baseline_path):
+    """Print the relative change of the key metrics against a saved result."""
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"\nCompared with {baseline_path}:")
+    for section, key, higher_is_better in KEY_METRICS:
+        old = baseline.get(section, {}).get(key)
+        new = result.get(section, {}).get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        better = change > 0 if higher_is_better else change < 0
+        verdict = "better" if better else ("worse" if change else "same")
+        print(f"  {section}.{key:<20} {old:10.4f} -> {new:10.4f}  {change:+7.1%}  {verdict}")
+
+
+def print_report(result):
+    """Print a human readable summary of a benchmark result."""
+    ingest, query = result["ingest"], result["query"]
+    print(f"Ingest: {ingest.get('files_parsed', 0)} files, {ingest.get('pages_parsed', 0)} pages, "
+          f"{ingest.get('chunks_written', 0)} chunks in {ingest['wall_seconds']:.2f} s "
+          f"({ingest['chunks_per_second']:.1f} chunks/s, embed {ingest.get('embed_chunks_per_second', 0):.1f} "
+          f"chunks/s, avg embed request {ingest.get('avg_embed_latency', 0) * 1000:.1f} ms)")
+    print(f"Query:  {query['queries']} queries ({query['errors']} errors), concurrency {query['concurrency']}, "
+          f"{query['queries_per_second']:.1f} queries/s")
+    print(f"        latency p50 {query['p50'] * 1000:.0f} ms · p95 {query['p95'] * 1000:.0f} ms · "
+          f"p99 {query['p99'] * 1000:.0f} ms")
+    if query["stream"]:
+        print(f"        time to first token p50 {query['ttft_p50'] * 1000:.0f} ms · "
+              f"p95 {query['ttft_p95'] * 1000:.0f} ms · p99 {query['ttft_p99'] * 1000:.0f} ms")
+    print("Stages (average per query):")
+    endpoints = result["stages"]["endpoints"]
+    for stage, seconds in result["stages"]["per_query_avg"].items():
+        line = f"  {stage:<10} {seconds * 1000:8.1f} ms"
+        if stage in endpoints:
+            line += (f"  ({endpoints[stage]['count']} requests, p95 {endpoints[stage]['p95'] * 1000:.1f} ms)")
+        print(line)
+
+
+def main():
+    """Run the end-to-end benchmark against local stub servers."""
+    parser = argparse.ArgumentParser(description="End-to-end ingestion and query benchmark with stub model servers")
+    parser.add_argument("--files", type=int, default=20, help="Synthetic PDF files to ingest")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per file")
+    parser.add_argument("--queries", type=int, default=200, help="Queries to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent users")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured queries run before the measurement")
+    parser.add_argument("--no-stream", action="store_true", help="Use run_rag_chain instead of run_rag_chain_stream")
+    parser.add_argument("--query-cache", action="store_true", help="Keep the query and answer caches enabled")
+    parser.add_argument("--embed-latency", type=float, default=0.005, help="Embedding request latency (s)")
+    parser.add_argument("--embed-item-latency", type=float, default=0.0005, help="Embedding latency per text (s)")
+    parser.add_argument("--rerank-latency", type=float, default=0.01, help="Rerank request latency (s)")
+    parser.add_argument("--rerank-item-latency", type=float, default=0.0005, help="Rerank latency per document (s)")
+    parser.add_argument("--first-token-latency", type=float, default=0.05, help="Chat time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Chat decode speed per request")
+    parser.add_argument("--capacity", type=int, default=16, help="Concurrent requests each stub endpoint processes")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus and queries")
+    parser.add_argument("--output", type=str, help="Result JSON path (default: benchmarks/results/e2e-<time>.json)")
+    parser.add_argument("--compare", type=str, help="Previous result JSON to compare against")
+    args = parser.parse_args()
+
+    # Isolated stores, so runs neither touch nor benefit from local data
+    workdir = tempfile.mkdtemp(prefix="pharmaquery-benchmark-")
+    Config.PHARMA_DB_PATH = os.path.join(workdir, "pharma_db")
+    Config.CATALOG_PATH = os.path.join(workdir, "catalog.sqlite3")
+    Config.EMBEDDING_CACHE_PATH = os.path.join(workdir, "embeddings.sqlite3")
+    Config.QUERY_CACHE_ENABLED = Config.SEMANTIC_CACHE_ENABLED = args.query_cache
+
+    stub = StubServer(
+        embedding=StubSettings(args.embed_latency, args.embed_item_latency, args.capacity),
+        rerank=StubSettings(args.rerank_latency, args.rerank_item_latency, args.capacity),
+        chat=StubSettings(0.0, 0.0, args.capacity),
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=Config.MAX_TOKENS // 4
+    ).start()
+    Config.EMBEDDING_API_BASE = Config.VLLM_API_BASE = Config.RERANK_API_BASE = stub.base_url
+
+    from utils.http_client import latency_stats
+
+    uploads, texts = make_corpus(args.files, args.pages, args.seed)
+    ingest = run_ingest(uploads)
+    queries = make_queries(texts, args.queries + args.warmup, args.seed)
+    # Warm up (vector index load, client pools, batcher threads) outside the measurement
+    run_queries(queries[:args.warmup], args.concurrency, not args.no_stream)
+    latency_stats.reset()
+    query = run_queries(queries[args.warmup:], args.concurrency, not args.no_stream)
+    stub.stop()
+
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "arguments": vars(args),
+        "settings": {
+            "chunk_size": Config.CHUNK_SIZE,
+            "search_k": Config.SEARCH_K,
+            "rerank_enabled": Config.RERANK_ENABLED,
+            "micro_batch_enabled": Config.MICRO_BATCH_ENABLED,
+            "adaptive_retrieval": Config.ADAPTIVE_RETRIEVAL,
+        },
+        "ingest": ingest,
+        "query": query,
+        "stages": stage_breakdown(query),
+    }
+    print_report(result)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"e2e-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(result, output_file, indent=2)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
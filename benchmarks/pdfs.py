@@ -0,0 +1,99 @@
+import random
+
+WORDS = ("aspirin ibuprofen paracetamol dosage tablet capsule clinical trial patient placebo efficacy "
+         "plasma half-life metabolism hepatic renal adverse event formulation bioavailability receptor "
+         "inhibitor excipient stability solubility toxicity pharmacokinetics clearance interaction "
+         "warfarin contraindication indication pediatric geriatric infusion injection").split()
+
+
+def make_page_text(rng, lines=40, words_per_line=12):
+    """Return the text of one synthetic page.
+
+    Args:
+        rng (random.Random): Random source.
+        lines (int): Lines per page.
+        words_per_line (int): Words per line.
+
+    Returns:
+        str: Page text with one sentence per line.
+    """
+    return "\n".join(
+        " ".join(rng.choice(WORDS) for _ in range(words_per_line)).capitalize() + "."
+        for _ in range(lines)
+    )
+
+
+def make_pdf(pages):
+    """Build a minimal PDF with one text page per entry.
+
+    Args:
+        pages (list): Page texts (latin-1 characters, one line per ``\\n``).
+
+    Returns:
+        bytes: PDF file content readable by pypdf.
+    """
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    # Object numbers: 1 font, then content/page pairs, then the page tree and catalog
+    pages_ref = 2 + 2 * len(pages)
+    page_refs = []
+    for text in pages:
+        lines = [line.replace("\\", "").replace("(", "").replace(")", "") for line in text.split("\n")]
+        stream = b"BT /F1 9 Tf 40 760 Td 11 TL " + b" ".join(
+            b"(" + line.encode("latin-1", "replace") + b") '" for line in lines
+        ) + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 1 0 R >> >> >>" % (pages_ref, len(objects)))
+        page_refs.append(len(objects))
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>"
+                   % (b" ".join(b"%d 0 R" % ref for ref in page_refs), len(page_refs)))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_ref)
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+    return output
+
+
+class SyntheticPDF:
+    """In-memory PDF with the interface ``add_to_db`` expects from Streamlit uploads."""
+    def __init__(self, name, data):
+        """Wrap PDF bytes.
+
+        Args:
+            name (str): File name.
+            data (bytes): PDF content.
+        """
+        self.name = name
+        self.size = len(data)
+        self._data = data
+
+    def getbuffer(self):
+        """Return the file content as a memoryview."""
+        return memoryview(self._data)
+
+
+def make_corpus(files, pages, seed=0):
+    """Generate synthetic PDF uploads.
+
+    Args:
+        files (int): Number of files.
+        pages (int): Pages per file.
+        seed (int): Seed of the generated text.
+
+    Returns:
+        tuple: The uploads and the page texts (for building queries).
+    """
+    rng = random.Random(seed)
+    uploads, texts = [], []
+    for index in range(files):
+        page_texts = [make_page_text(rng) for _ in range(pages)]
+        texts.extend(page_texts)
+        uploads.append(SyntheticPDF(f"synthetic_{index:04d}.pdf", make_pdf(page_texts)))
+    return uploads, texts
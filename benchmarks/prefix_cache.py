@@ -0,0 +1,245 @@
+import sys
+import os
+
+# Add project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import Config, get_llm_client
+from rag_chain.prompt import build_messages
+from utils.tokens import count_tokens
+
+WORDS = ("aspirin ibuprofen dosage tablet clinical trial patient placebo efficacy "
+         "plasma half-life metabolism hepatic renal adverse event formulation "
+         "bioavailability receptor inhibitor excipient stability").split()
+
+
+def render_chat(messages):
+    """Render messages with the ChatML template used by Qwen models.
+
+    Args:
+        messages (list): Message dicts.
+
+    Returns:
+        str: Prompt text as seen by the model server.
+    """
+    text = "".join(f"<|im_start|>{msg['role']}\n{msg['content']}<|im_end|>\n" for msg in messages)
+    return text + "<|im_start|>assistant\n"
+
+
+def common_prefix_length(left, right):
+    """Return the length of the common prefix of two strings."""
+    size = min(len(left), len(right))
+    for index in range(size):
+        if left[index] != right[index]:
+            return index
+    return size
+
+
+class PrefixCacheStub(ThreadingHTTPServer):
+    """Local chat completions server that measures prefix cache reuse.
+
+    Every prompt is rendered with the chat template and compared with all
+    earlier prompts. Like vLLM's automatic prefix caching, only whole blocks of
+    the longest shared prefix count as cacheable.
+    """
+    def __init__(self, block_size=16, answer="This is a benchmark answer."):
+        """Start listening on a free local port.
+
+        Args:
+            block_size (int): KV cache block size in tokens.
+            answer (str): Answer returned for every request.
+        """
+        super().__init__(("127.0.0.1", 0), PrefixCacheHandler)
+        self.block_size = block_size
+        self.answer = answer
+        self.prompts = []
+        self.records = []
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        """Return the OpenAI-compatible base URL of the stub."""
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def measure(self, messages):
+        """Record a prompt and return its token count and cacheable prefix.
+
+        Args:
+            messages (list): Message dicts of the request.
+
+        Returns:
+            dict: ``prompt_tokens`` and ``cached_tokens`` of the request.
+        """
+        prompt = render_chat(messages)
+        with self.lock:
+            shared = max((common_prefix_length(prompt, earlier) for earlier in self.prompts), default=0)
+            self.prompts.append(prompt)
+            prompt_tokens = count_tokens(prompt)
+            shared_tokens = min(count_tokens(prompt[:shared]), prompt_tokens - 1) if shared else 0
+            record = {
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": max(shared_tokens, 0) // self.block_size * self.block_size,
+            }
+            self.records.append(record)
+        return record
+
+    def reset(self):
+        """Forget all prompts, like restarting the model server."""
+        with self.lock:
+            self.prompts = []
+            self.records = []
+
+
+class PrefixCacheHandler(BaseHTTPRequestHandler):
+    """Request handler of ``PrefixCacheStub``."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.path.endswith("/chat/completions"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        record = self.server.measure(body["messages"])
+        usage = {
+            "prompt_tokens": record["prompt_tokens"],
+            "completion_tokens": 1,
+            "total_tokens": record["prompt_tokens"] + 1,
+            "prompt_tokens_details": {"cached_tokens": record["cached_tokens"]},
+        }
+        payload = {
+            "id": "benchmark",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.server.answer},
+                         "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def legacy_messages(query, context, chat_history):
+    """Build messages with the previous layout, for comparison.
+
+    The system message was followed by the full history (including the current
+    turn) and a final user message with the no-think prefix, the context and
+    the question.
+    """
+    messages = [{"role": "system", "content": "You are a highly knowledgeable assistant."}]
+    messages.extend(chat_history)
+    if context:
+        prompt = f"""Answer the question based on the following context if relevant:
+{context}
+
+Question: {query}
+
+If the context provides relevant information, use it to answer accurately. If not, you can use your own knowledge."""
+    else:
+        prompt = query
+    no_think_prefix = "/no_think\n" if Config.NO_THINK_MODE else ""
+    messages.append({"role": "user", "content": no_think_prefix + prompt})
+    return messages
+
+
+def make_sentence(rng, words=12):
+    """Return a random sentence of benchmark vocabulary."""
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def run_layout(name, build, stub, users, turns, seed):
+    """Send synthetic conversations built with one layout to the stub.
+
+    Args:
+        name (str): Layout name used in the report.
+        build (callable): Takes ``(query, context, chat_history)`` and returns messages.
+        stub (PrefixCacheStub): Stub server, reset before the run.
+        users (int): Number of conversations.
+        turns (int): Questions per conversation.
+        seed (int): Seed of the synthetic questions and contexts.
+
+    Returns:
+        list: One record per request.
+    """
+    stub.reset()
+    rng = random.Random(seed)
+    client = get_llm_client()
+    histories = [[] for _ in range(users)]
+    results = []
+    # Interleave the conversations like concurrent users
+    for turn in range(turns):
+        for user, history in enumerate(histories):
+            query = make_sentence(rng, 8)
+            context = "\n\n".join(make_sentence(rng, 30) for _ in range(Config.RERANK_TOP_K))
+            history.append({"role": "user", "content": query})
+            response = client.chat.completions.create(
+                model=Config.VLLM_MODEL_NAME,
+                messages=build(query, context, history),
+                max_tokens=1
+            )
+            history.append({"role": "assistant", "content": response.choices[0].message.content})
+            results.append(dict(stub.records[-1], layout=name, user=user, turn=turn))
+    return results
+
+
+def main():
+    """Compare the cacheable prompt prefix of the previous and current layouts."""
+    parser = argparse.ArgumentParser(description="Prefix cache benchmark of the prompt layout")
+    parser.add_argument("--users", type=int, default=4, help="Number of concurrent conversations")
+    parser.add_argument("--turns", type=int, default=5, help="Questions per conversation")
+    parser.add_argument("--block-size", type=int, default=16, help="KV cache block size in tokens")
+    parser.add_argument("--no-think", action="store_true", help="Enable no-think mode")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic conversations")
+    parser.add_argument("--json", action="store_true", help="Print the per-request records as JSON")
+    args = parser.parse_args()
+
+    Config.NO_THINK_MODE = args.no_think
+    # Summaries would be requested from the stub as well; the window still applies
+    Config.HISTORY_SUMMARY_ENABLED = False
+
+    stub = PrefixCacheStub(block_size=args.block_size)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    Config.VLLM_API_BASE = stub.base_url
+
+    layouts = [
+        ("legacy", legacy_messages),
+        ("current", lambda query, context, history: build_messages(query, context, history)),
+    ]
+    records = []
+    for name, build in layouts:
+        records.extend(run_layout(name, build, stub, args.users, args.turns, args.seed))
+    stub.shutdown()
+
+    if args.json:
+        print(json.dumps(records, indent=2))
+        return
+    print(f"{'layout':<8} {'user':>4} {'turn':>4} {'prompt':>7} {'cached':>7} {'ratio':>6}")
+    for record in records:
+        ratio = record["cached_tokens"] / record["prompt_tokens"]
+        print(f"{record['layout']:<8} {record['user']:>4} {record['turn']:>4} "
+              f"{record['prompt_tokens']:>7} {record['cached_tokens']:>7} {ratio:>6.1%}")
+    print()
+    for name, _ in layouts:
+        selected = [record for record in records if record["layout"] == name]
+        prompt = sum(record["prompt_tokens"] for record in selected)
+        cached = sum(record["cached_tokens"] for record in selected)
+        print(f"{name}: {cached}/{prompt} prompt tokens cacheable ({cached / prompt:.1%}), "
+              f"{prompt - cached} tokens to prefill")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import sys
+import os
+
+# Add project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import random
+import argparse
+import numpy as np
+from langchain_core.documents import Document
+from config import Config
+from text_splitter.splitter import create_recursive_splitter, split_documents, get_length_function
+from utils.tokens import get_tokenizer
+from benchmarks.stubs import StubServer, StubSettings
+from benchmarks.pdfs import WORDS
+
+ZH_WORDS = ("阿司匹林 布洛芬 对乙酰氨基酚 剂量 片剂 胶囊 临床试验 患者 安慰剂 疗效 血浆 半衰期 代谢 肝脏 肾脏 "
+            "不良事件 制剂 生物利用度 受体 抑制剂 辅料 稳定性 溶解度 毒性 药代动力学 清除率 相互作用 华法林 "
+            "禁忌症 适应症 儿童 老年 输液 注射").split()
+
+
+def make_mixed_page(rng, lines=40):
+    """Return a page of alternating English and Chinese sentences.
+
+    Args:
+        rng (random.Random): Random source.
+        lines (int): Sentences per page.
+
+    Returns:
+        str: Page text with one sentence per line.
+    """
+    sentences = []
+    for _ in range(lines):
+        if rng.random() < 0.5:
+            sentences.append(" ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + ".")
+        else:
+            sentences.append("".join(rng.choice(ZH_WORDS) for _ in range(10)) + "。")
+    return "\n".join(sentences)
+
+
+def make_queries(pages, count, rng):
+    """Take random sentence fragments as queries.
+
+    Args:
+        pages (list): Page texts.
+        count (int): Number of queries.
+        rng (random.Random): Random source.
+
+    Returns:
+        list: Fragments, each occurring verbatim in the corpus.
+    """
+    sentences = [sentence for page in pages for sentence in page.split("\n")]
+    queries = []
+    for _ in range(count):
+        sentence = rng.choice(sentences).rstrip(".。")
+        if " " in sentence:
+            words = sentence.split()
+            start = rng.randrange(0, len(words) - 5)
+            queries.append(" ".join(words[start:start + 6]))
+        else:
+            start = rng.randrange(0, len(sentence) - 12)
+            queries.append(sentence[start:start + 12])
+    return queries
+
+
+def embed_all(client, texts, batch_size):
+    """Embed texts in batches, returning the vectors, seconds and request count."""
+    started = time.perf_counter()
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(client.embed_documents(texts[start:start + batch_size]))
+    return np.array(vectors, dtype=np.float32), time.perf_counter() - started, -(-len(texts) // batch_size)
+
+
+def evaluate(mode, documents, queries, query_vectors, client, args):
+    """Split, embed and search with one splitter mode.
+
+    A query counts as found at rank ``r`` if the ``r``-th retrieved chunk
+    contains the query fragment verbatim.
+
+    Returns:
+        dict: Chunk statistics, split and embed time, hit rate at k and MRR.
+    """
+    splitter = create_recursive_splitter(unit=mode)
+    started = time.perf_counter()
+    chunks = [chunk.page_content for chunk in split_documents(splitter, documents)]
+    split_seconds = time.perf_counter() - started
+
+    count_tokens = get_length_function("tokens")
+    tokens = np.array([count_tokens(chunk) for chunk in chunks])
+    vectors, embed_seconds, requests = embed_all(client, chunks, args.batch_size)
+
+    hits, reciprocal_ranks = 0, []
+    for query, query_vector in zip(queries, query_vectors):
+        top = np.argsort(-(vectors @ query_vector))[:args.k]
+        rank = next((position + 1 for position, index in enumerate(top) if query in chunks[index]), None)
+        hits += rank is not None
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    return {
+        "mode": mode,
+        "chunks": len(chunks),
+        "tokens_mean": float(tokens.mean()),
+        "tokens_std": float(tokens.std()),
+        "tokens_min": int(tokens.min()),
+        "tokens_max": int(tokens.max()),
+        "over_limit": int((tokens > args.max_tokens).sum()),
+        "split_seconds": split_seconds,
+        "embed_seconds": embed_seconds,
+        "embed_requests": requests,
+        f"hit_at_{args.k}": hits / len(queries),
+        "mrr": float(np.mean(reciprocal_ranks)),
+    }
+
+
+def main():
+    """Compare the character and token splitters on a mixed Chinese/English corpus."""
+    parser = argparse.ArgumentParser(description="Character vs. token splitter: chunks, embed time, retrieval")
+    parser.add_argument("--pages", type=int, default=100, help="Pages of the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200, help="Queries for the retrieval check")
+    parser.add_argument("--k", type=int, default=Config.SEARCH_K, help="Retrieved chunks per query")
+    parser.add_argument("--batch-size", type=int, default=Config.EMBED_BATCH_SIZE, help="Texts per embedding request")
+    parser.add_argument("--chunk-tokens", type=int, default=Config.CHUNK_TOKENS, help="Chunk size in tokens mode")
+    parser.add_argument("--chunk-overlap-tokens", type=int, default=Config.CHUNK_OVERLAP_TOKENS,
+                        help="Chunk overlap in tokens mode")
+    parser.add_argument("--max-tokens", type=int, default=256, help="Context length of the embedding model")
+    parser.add_argument("--embedding-api-base", type=str,
+                        help="Use a real embedding server instead of the lexical stub")
+    parser.add_argument("--token-latency", type=float, default=0.00005, help="Stub embedding latency per token (s)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and queries")
+    parser.add_argument("--output", type=str, help="Also save the results as JSON")
+    args = parser.parse_args()
+    Config.CHUNK_TOKENS, Config.CHUNK_OVERLAP_TOKENS = args.chunk_tokens, args.chunk_overlap_tokens
+
+    rng = random.Random(args.seed)
+    pages = [make_mixed_page(rng) for _ in range(args.pages)]
+    documents = [Document(page_content=page, metadata={"page": index}) for index, page in enumerate(pages)]
+    queries = make_queries(pages, args.queries, rng)
+
+    stub = None
+    if args.embedding_api_base:
+        Config.EMBEDDING_API_BASE = args.embedding_api_base
+    else:
+        stub = StubServer(embedding=StubSettings(0.005, 0.0, 16, args.token_latency), dimensions=1024,
+                          lexical=True).start()
+        Config.EMBEDDING_API_BASE = stub.base_url
+    # Uncached client, so both splitters pay for every chunk
+    from langchain_openai import OpenAIEmbeddings
+    client = OpenAIEmbeddings(model=Config.EMBEDDING_MODEL_NAME, base_url=Config.EMBEDDING_API_BASE,
+                              api_key=Config.EMBEDDING_API_KEY, check_embedding_ctx_length=False)
+    query_vectors, _, _ = embed_all(client, queries, args.batch_size)
+
+    results = [evaluate(mode, documents, queries, query_vectors, client, args) for mode in ("chars", "tokens")]
+    if stub is not None:
+        stub.stop()
+
+    # Counts are estimated whenever the tokenizer is not configured or could not be loaded
+    tokenizer_path = Config.EMBEDDING_TOKENIZER_PATH or Config.TOKENIZER_PATH
+    counted_with = tokenizer_path if get_tokenizer(tokenizer_path) is not None else "the estimate"
+    print(f"{args.pages} pages, {args.queries} queries, token counts from {counted_with}")
+    print(f"{'mode':<8} {'chunks':>7} {'tokens (mean ± std, min-max)':>30} {'>limit':>7} "
+          f"{'split':>8} {'embed':>8} {'requests':>9} {'hit@' + str(args.k):>7} {'MRR':>6}")
+    for result in results:
+        spread = (f"{result['tokens_mean']:.0f} ± {result['tokens_std']:.0f}, "
+                  f"{result['tokens_min']}-{result['tokens_max']}")
+        print(f"{result['mode']:<8} {result['chunks']:7d} {spread:>30} {result['over_limit']:7d} "
+              f"{result['split_seconds']:7.2f}s {result['embed_seconds']:7.2f}s {result['embed_requests']:9d} "
+              f"{result[f'hit_at_{args.k}']:7.1%} {result['mrr']:6.3f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"arguments": vars(args), "token_counts": counted_with, "results": results}, output_file,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import re
+import sys
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.tokens import estimate_tokens
+
+# Latin words and single CJK characters, the features of lexical stub embeddings
+_FEATURE_PATTERN = re.compile(r"[a-z0-9\-]+|[\u3400-\u4dbf\u4e00-\u9fff]")
+
+
+class StubSettings:
+    """Latency and throughput model of one stub endpoint.
+
+    A request waits ``base_latency`` plus ``per_item_latency`` for every input
+    item (texts to embed, documents to score, prompt characters / 4) plus
+    ``per_token_latency`` for every (estimated) input token of embedded texts.
+    At most ``capacity`` requests are processed at once, further ones queue
+    like on a saturated GPU server.
+    """
+    def __init__(self, base_latency=0.0, per_item_latency=0.0, capacity=64, per_token_latency=0.0):
+        """Initialize the settings.
+
+        Args:
+            base_latency (float): Fixed seconds per request.
+            per_item_latency (float): Additional seconds per input item.
+            capacity (int): Requests processed concurrently.
+            per_token_latency (float): Additional seconds per embedded token.
+        """
+        self.base_latency = base_latency
+        self.per_item_latency = per_item_latency
+        self.capacity = capacity
+        self.per_token_latency = per_token_latency
+
+
+class StubServer(ThreadingHTTPServer):
+    """In-process OpenAI-compatible server standing in for the vLLM containers.
+
+    Serves ``/v1/embeddings``, ``/v1/chat/completions`` (streaming and not),
+    ``/v1/rerank`` and ``/v1/score``. Embeddings are deterministic pseudo-random
+    unit vectors derived from the input text, so similarity search behaves
+    consistently across runs; lexical embeddings (hashed word and CJK character
+    features) make texts sharing words similar, for measuring retrieval
+    quality. Generated answers are streamed at ``tokens_per_second`` after
+    ``first_token_latency``.
+    """
+    daemon_threads = True
+
+    def __init__(self, embedding=None, rerank=None, chat=None, dimensions=256, first_token_latency=0.05,
+                 tokens_per_second=200.0, answer_tokens=60, lexical=False):
+        """Start listening on a free local port (call ``start`` to serve).
+
+        Args:
+            embedding (StubSettings, optional): Embedding endpoint model.
+            rerank (StubSettings, optional): Rerank and score endpoint model.
+            chat (StubSettings, optional): Chat completions endpoint model (prefill).
+            dimensions (int): Embedding dimensions.
+            first_token_latency (float): Seconds until the first generated token.
+            tokens_per_second (float): Decode speed per request.
+            answer_tokens (int): Tokens per generated answer (capped by ``max_tokens``).
+            lexical (bool): Derive embeddings from the words of the text instead of its hash.
+        """
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.settings = {
+            "embeddings": embedding or StubSettings(0.005, 0.0005),
+            "rerank": rerank or StubSettings(0.01, 0.0005),
+            "chat": chat or StubSettings(0.0, 0.0),
+        }
+        self.slots = {name: threading.BoundedSemaphore(settings.capacity) for name, settings in self.settings.items()}
+        self.dimensions = dimensions
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.lexical = lexical
+        self.counts = {name: 0 for name in self.settings}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        """Return the OpenAI-compatible base URL of the stub."""
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        """Serve requests in a background thread.
+
+        Returns:
+            StubServer: The server itself.
+        """
+        threading.Thread(target=self.serve_forever, name="benchmark-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+    def work(self, name, items, tokens=0):
+        """Hold a processing slot of an endpoint for the modelled latency.
+
+        Args:
+            name (str): Endpoint name.
+            items (int): Number of input items of the request.
+            tokens (int): Number of input tokens of the request.
+        """
+        settings = self.settings[name]
+        with self.slots[name]:
+            with self._lock:
+                self.counts[name] += 1
+            time.sleep(settings.base_latency + settings.per_item_latency * items + settings.per_token_latency * tokens)
+
+    def embed(self, text):
+        """Return the deterministic unit vector of a text."""
+        if self.lexical and isinstance(text, str):
+            vector = np.zeros(self.dimensions)
+            for feature in _FEATURE_PATTERN.findall(text.lower()):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+            norm = np.linalg.norm(vector)
+            if norm:
+                return (vector / norm).tolist()
+        seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def handle_error(self, request, client_address):
+        # Clients closing keep-alive connections are expected, not errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler of ``StubServer``."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.endswith("/embeddings"):
+            return self.embeddings(body)
+        if self.path.endswith("/chat/completions"):
+            return self.chat_completions(body)
+        if self.path.endswith("/rerank"):
+            return self.rerank(body)
+        if self.path.endswith("/score"):
+            return self.score(body)
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_json(self, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def embeddings(self, body):
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        # Token ID lists (sent when the client checks the context length) count as one text
+        if inputs and isinstance(inputs[0], int):
+            inputs = [inputs]
+        tokens = sum(estimate_tokens(text) if isinstance(text, str) else len(text) for text in inputs)
+        self.server.work("embeddings", len(inputs), tokens)
+        self.send_json({
+            "object": "list",
+            "model": body.get("model", "stub"),
+            "data": [{"object": "embedding", "index": index, "embedding": self.server.embed(text)}
+                     for index, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        })
+
+    def rerank(self, body):
+        documents = body["documents"]
+        self.server.work("rerank", len(documents))
+        query = set(body["query"].lower().split())
+        scores = [len(query & set(document.lower().split())) / (len(query) or 1) for document in documents]
+        order = sorted(range(len(documents)), key=lambda index: -scores[index])
+        self.send_json({"results": [{"index": index, "relevance_score": scores[index]}
+                                    for index in order[:body.get("top_n", len(documents))]]})
+
+    def score(self, body):
+        queries, documents = body["text_1"], body["text_2"]
+        self.server.work("rerank", len(documents))
+        data = []
+        for index, (query, document) in enumerate(zip(queries, documents)):
+            words = set(query.lower().split())
+            data.append({"index": index, "score": len(words & set(document.lower().split())) / (len(words) or 1)})
+        self.send_json({"data": data})
+
+    def chat_completions(self, body):
+        prompt_chars = sum(len(message.get("content") or "") for message in body["messages"])
+        self.server.work("chat", prompt_chars // 4)
+        tokens = min(self.server.answer_tokens, body.get("max_tokens") or self.server.answer_tokens)
+        pieces = [f" word{index}" for index in range(tokens)]
+        interval = 1.0 / self.server.tokens_per_second
+        time.sleep(self.server.first_token_latency)
+        if not body.get("stream"):
+            time.sleep(interval * tokens)
+            return self.send_json({
+                "id": "stub", "object": "chat.completion", "created": 0, "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces).strip()},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": tokens,
+                          "total_tokens": prompt_chars // 4 + tokens},
+            })
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for index, piece in enumerate(pieces):
+                if index:
+                    time.sleep(interval)
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0,
+                         "model": body.get("model", "stub"),
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early
+            pass
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
@@ -0,0 +1,196 @@
+import sys
+import os
+
+# Add project root directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from benchmarks.e2e import percentile
+
+BACKENDS = ("chroma", "numpy-float16", "numpy-int8")
+
+
+def make_vectors(count, dimensions, seed, clusters=256):
+    """Return clustered unit vectors, like embeddings of chunks about a few topics."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.8 * rng.standard_normal((count, dimensions)).astype(
+        np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_neighbors(vectors, queries, k):
+    """Return the row indices of the ``k`` nearest vectors (squared L2) of every query."""
+    neighbors = []
+    for query in queries:
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        top = np.argpartition(distances, k)[:k]
+        neighbors.append(top[np.argsort(distances[top])])
+    return np.array(neighbors)
+
+
+def resident_mb():
+    """Return the private (heap) and file-backed resident memory of this process in MB (Linux).
+
+    File-backed pages, like a memory-mapped matrix, live in the page cache and
+    are shared by every process mapping the same file.
+    """
+    with open("/proc/self/status") as status:
+        fields = dict(line.split(":", 1) for line in status)
+    return tuple(int(fields[name].split()[0]) / 1024 for name in ("RssAnon", "RssFile"))
+
+
+def directory_mb(path):
+    """Return the size of the files below a directory in MB."""
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names) / 2 ** 20
+
+
+def store_factory(backend, path):
+    """Import a backend and return a function opening its store.
+
+    Returns:
+        callable: Returns the LangChain store and its record-level collection.
+    """
+    if backend == "chroma":
+        from langchain_chroma import Chroma
+
+        def open_chroma():
+            store = Chroma(collection_name="benchmark", persist_directory=path)
+            return store, store._collection
+        return open_chroma
+    # Keep the file catalog created on import out of the working directory
+    from config import Config
+    Config.CATALOG_PATH = os.path.join(os.path.dirname(path), "catalog.sqlite3")
+    from vector_db.numpy_store import NumpyVectorStore
+
+    def open_numpy():
+        store = NumpyVectorStore(path, dtype=backend.split("-")[1])
+        return store, store
+    return open_numpy
+
+
+def build_backend(backend, data_path, path, write_batch):
+    """Write the vectors into a new store of a backend.
+
+    Returns:
+        float: Seconds taken.
+    """
+    vectors = np.load(data_path)["vectors"]
+    open_store = store_factory(backend, path)
+    started = time.perf_counter()
+    _, collection = open_store()
+    for start in range(0, len(vectors), write_batch):
+        rows = range(start, min(start + write_batch, len(vectors)))
+        collection.upsert(ids=[str(row) for row in rows], embeddings=vectors[start:rows.stop].tolist(),
+                          documents=[f"chunk {row}" for row in rows],
+                          metadatas=[{"file_id": str(row % 50), "page": row} for row in rows])
+    return time.perf_counter() - started
+
+
+def query_backend(backend, data_path, path, k, batch_size):
+    """Open a built store like a restarted server would and query it.
+
+    Returns:
+        dict: Open time, memory use, query latencies and the retrieved IDs.
+    """
+    queries = np.load(data_path)["queries"]
+    open_store = store_factory(backend, path)
+    private_before, shared_before = resident_mb()
+    started = time.perf_counter()
+    store, _ = open_store()
+    store.similarity_search_by_vector_with_relevance_scores(queries[0].tolist(), k=k)
+    open_seconds = time.perf_counter() - started
+
+    latencies, retrieved = [], []
+    for query in queries:
+        started = time.perf_counter()
+        hits = store.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=k)
+        latencies.append(time.perf_counter() - started)
+        retrieved.append([int(doc.id) for doc, _ in hits])
+
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size].tolist()
+        if backend == "chroma":
+            store._collection.query(query_embeddings=batch, n_results=k)
+        else:
+            store.search_by_vectors(batch, k=k)
+    batch_seconds = time.perf_counter() - started
+
+    private, shared = resident_mb()
+    return {
+        "open_seconds": open_seconds,
+        "private_mb": private - private_before,
+        "shared_mb": shared - shared_before,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "batch_queries_per_second": len(queries) / batch_seconds if batch_seconds else 0.0,
+        "retrieved": retrieved,
+    }
+
+
+def run_isolated(function, *args):
+    """Run a function in a fresh process, so each measurement starts with clean memory."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
+def main():
+    """Compare Chroma and the numpy backend on latency, memory and recall."""
+    parser = argparse.ArgumentParser(description="Chroma vs. memory-mapped numpy vector store")
+    parser.add_argument("--vectors", type=int, default=50000, help="Stored vectors")
+    parser.add_argument("--dimensions", type=int, default=1024, help="Embedding dimensions")
+    parser.add_argument("--queries", type=int, default=200, help="Queries (perturbed stored vectors)")
+    parser.add_argument("--k", type=int, default=5, help="Results per query")
+    parser.add_argument("--batch-size", type=int, default=16, help="Queries per batched search")
+    parser.add_argument("--write-batch", type=int, default=1000, help="Vectors per upsert")
+    parser.add_argument("--backends", type=str, default=",".join(BACKENDS), help="Comma separated backends to run")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the vectors and queries")
+    parser.add_argument("--output", type=str, help="Also save the results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pharmaquery-vector-store-")
+    vectors = make_vectors(args.vectors, args.dimensions, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.integers(0, len(vectors), args.queries)] + 0.05 * rng.standard_normal(
+        (args.queries, args.dimensions)).astype(np.float32)
+    truth = exact_neighbors(vectors, queries, args.k)
+    data_path = os.path.join(workdir, "data.npz")
+    np.savez(data_path, vectors=vectors, queries=queries)
+
+    results = []
+    for backend in args.backends.split(","):
+        path = os.path.join(workdir, backend)
+        result = {"backend": backend, "build_seconds": run_isolated(build_backend, backend, data_path, path,
+                                                                    args.write_batch)}
+        result["disk_mb"] = directory_mb(path)
+        result.update(run_isolated(query_backend, backend, data_path, path, args.k, args.batch_size))
+        retrieved = result.pop("retrieved")
+        result[f"recall_at_{args.k}"] = float(np.mean([len(set(found) & set(expected)) / args.k
+                                                       for found, expected in zip(retrieved, truth.tolist())]))
+        results.append(result)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.vectors} vectors x {args.dimensions} dimensions, {args.queries} queries, k={args.k}")
+    print(f"{'backend':<14} {'build':>8} {'disk':>9} {'open':>8} {'private':>9} {'shared':>9} {'p50':>8} {'p95':>8} "
+          f"{'batched':>10} {'recall':>7}")
+    for result in results:
+        print(f"{result['backend']:<14} {result['build_seconds']:7.1f}s {result['disk_mb']:6.0f} MB "
+              f"{result['open_seconds']:7.2f}s {result['private_mb']:6.0f} MB {result['shared_mb']:6.0f} MB {result['p50'] * 1000:6.1f}ms "
+              f"{result['p95'] * 1000:6.1f}ms {result['batch_queries_per_second']:7.0f} q/s "
+              f"{result[f'recall_at_{args.k}']:7.1%}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"arguments": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import os
-import chromadb
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
+import asyncio
+import threading
+import weakref
+from utils.http_client import create_http_client, create_async_http_client, create_session
 
 # Configuration parameters
 class Config:
@@ -10,6 +11,11 @@ class Config:
     EMBEDDING_API_KEY = "sk123456"
     EMBEDDING_MODEL_NAME = "qwen3-ebd-0d6"
     
+    # Embedding Cache Configuration
+    EMBEDDING_CACHE_ENABLED = True
+    EMBEDDING_CACHE_PATH = "./embedding_cache/embeddings.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES = 200000  # LRU eviction beyond this many vectors
+    
     # vLLM Configuration
     VLLM_API_BASE = "http://host.docker.internal:8800/v1"
     VLLM_API_KEY = "sk-123456"
@@ -21,44 +27,358 @@ class Config:
     RERANK_API_KEY = "sk123456"
     RERANK_MODEL_NAME = "qwen3-reranker-0d6"
     RERANK_TOP_K = 3  # Number of documents to keep after reranking
+    RERANK_SCORE_PATH = "/score"  # Pairwise scoring endpoint used for batched reranking
+    
+    # HTTP Client Configuration (shared by the vLLM, embedding and rerank clients)
+    HTTP_CONNECT_TIMEOUT = 5.0  # Seconds to establish a connection
+    HTTP_READ_TIMEOUT = 60.0  # Seconds to wait for response data
+    HTTP_MAX_RETRIES = 2  # Retries on connection errors and 429/5xx responses
+    HTTP_BACKOFF_FACTOR = 0.5  # Base retry backoff in seconds, doubled on every retry
+    HTTP_POOL_SIZE = 20  # Keep-alive connections per endpoint
     
     # Database Configuration
-    CHROMA_DB_PATH = "./chroma_db"
     PHARMA_DB_PATH = "./pharma_db"
     COLLECTION_NAME = "pharma_database"
+    CATALOG_PATH = "./pharma_catalog.sqlite3"  # File catalog and chunk references
+    VECTOR_BACKEND = "chroma"  # "chroma" or "numpy" (memory-mapped matrix in PHARMA_DB_PATH/numpy/COLLECTION_NAME)
+    NUMPY_STORE_DTYPE = "float16"  # Matrix type of new numpy stores: "float16" or "int8" (quantized, half the size)
+    NUMPY_SEARCH_BLOCK = 1024  # Rows scored per matrix product by the numpy backend (kept cache-sized)
+    
+    # Snapshot Configuration (python main.py export-snapshot / import-snapshot)
+    SNAPSHOT_DTYPE = "float32"  # Embedding precision of exported snapshots: "float32" (exact) or "float16" (half the size)
+    SNAPSHOT_BATCH_SIZE = 5000  # Records read, written and bulk-loaded per batch
+    
+    # Vector Index Configuration (space, M and construction_ef apply to new collections: run "reindex" after changing)
+    INDEX_SPACE = "l2"  # Distance: "l2", "cosine" or "ip" (same ranking for the normalized Qwen3 embeddings)
+    HNSW_M = 16  # Graph links per vector: more raises recall, memory and build time
+    HNSW_CONSTRUCTION_EF = 100  # Candidates kept while building: more raises recall and build time
+    HNSW_SEARCH_EF = 10  # Candidates kept while searching (applied on open): more raises recall and latency
+    COLLECTION_INDEX_SETTINGS = {}  # Per-collection overrides, e.g. {"pharma_database": {"space": "cosine", "search_ef": 64}}
     
     # Text Splitting Configuration - Adjusted for embedding model context length
     CHUNK_SIZE = 200
     CHUNK_OVERLAP = 20
+    SPLIT_UNIT = "chars"  # "chars" (CHUNK_SIZE) or "tokens" (CHUNK_TOKENS, measured with the embedding tokenizer)
+    CHUNK_TOKENS = 128  # Chunk size in "tokens" mode (the embedding server has --max-model-len 256)
+    CHUNK_OVERLAP_TOKENS = 16
+    EMBEDDING_TOKENIZER_PATH = None  # Tokenizer of the embedding model, defaults to TOKENIZER_PATH (estimated if unset)
+    
+    # Ingestion Pipeline Configuration
+    INGEST_WORKERS = 4  # Processes used for PDF parsing and splitting
+    EMBED_BATCH_SIZE = 64  # Chunks per embedding request
+    EMBED_CONCURRENCY = 4  # Embedding requests in flight at once
+    DB_WRITE_BATCH_SIZE = 256  # Chunks per vector database write
+    INGEST_QUEUE_SIZE = 8  # Batches buffered between pipeline stages
+    INGEST_PAGE_BATCH = 16  # Pages parsed and split per batch; chunks reach the embedder while later pages parse
+    INGEST_SEGMENT_PAGES = 64  # Files with more pages are parsed and split as page ranges on several processes
+    
+    # Bulk Ingestion Configuration (python main.py ingest)
+    BULK_INGEST_GROUP_FILES = 32  # Files committed to the catalog and checkpoint together
+    BULK_INGEST_GROUP_MB = 512  # A group is also closed once its files reach this size
+    BULK_INGEST_CHECKPOINT_PATH = "./ingest_checkpoint.jsonl"  # Files already ingested, skipped on a rerun
     
     # Retrieval Configuration
     SEARCH_K = 5
     MAX_TOKENS = 300  # Adjusted for small model context length
     TEMPERATURE = 0.7
     
+    # Context Compaction Configuration
+    CONTEXT_COMPACTION = True  # Merge overlapping/adjacent chunks of a page before prompting
+    CONTEXT_TOKEN_BUDGET = 512  # Maximum tokens of retrieved context per prompt
+    TOKENIZER_PATH = "Qwen/Qwen3-0.6B"  # Hugging Face tokenizer for exact token counts (estimated if unset or unavailable)
+    
+    # Chat History Configuration (the served model has --max-model-len 1024)
+    HISTORY_TOKEN_BUDGET = 160  # Maximum tokens of chat history per prompt
+    HISTORY_SUMMARY_ENABLED = True  # Fold turns outside the budget into a rolling summary
+    HISTORY_SUMMARY_MAX_TOKENS = 64  # Maximum length of the summary
+    
+    # Adaptive Retrieval Configuration
+    # Distances are in the collection's distance space (squared L2 by default, lower is closer)
+    ADAPTIVE_RETRIEVAL = False  # Decide per query whether to rerank, widen the search or drop context
+    ADAPTIVE_MAX_DISTANCE = 1.2  # Hits farther than this are not relevant
+    ADAPTIVE_RERANK_SKIP_GAP = 0.15  # Skip reranking if the top hit leads the second by this much
+    ADAPTIVE_FLAT_SPREAD = 0.05  # Widen the search if all hits are within this spread
+    ADAPTIVE_WIDEN_FACTOR = 3  # Multiplier applied to SEARCH_K when widening
+    
+    # Query Cache Configuration (invalidated whenever the collection changes)
+    QUERY_CACHE_ENABLED = True  # Exact-match cache of query embeddings and retrieved chunk IDs
+    QUERY_CACHE_MAX_ENTRIES = 10000
+    SEMANTIC_CACHE_ENABLED = True  # Reuse answers of semantically equivalent questions
+    SEMANTIC_CACHE_THRESHOLD = 0.95  # Minimum cosine similarity to reuse an answer
+    SEMANTIC_CACHE_MAX_ENTRIES = 2000
+    SEMANTIC_CACHE_STANDALONE_ONLY = True  # Only reuse answers for the first question of a conversation (otherwise only after an identical earlier conversation)
+    
+    # Micro-batching Configuration (coalesces concurrent query embeddings and rerank calls)
+    MICRO_BATCH_ENABLED = True
+    MICRO_BATCH_WINDOW_MS = 5  # Max time a request waits for others to join its batch
+    MICRO_BATCH_MAX_SIZE = 32  # Max requests per batched call
+    
+    # LLM Admission Control (process-wide limit on concurrent generation requests)
+    ADMISSION_MAX_IN_FLIGHT = 8  # Generation requests sent to vLLM at once; the rest wait in a fair queue (None disables)
+    ADMISSION_QUEUE_TIMEOUT = 30.0  # Seconds a request waits for a slot before it fails
+    ADMISSION_DEGRADE_QUEUE_DEPTH = 8  # From this many waiting requests, admitted answers are shortened (None disables)
+    ADMISSION_DEGRADED_MAX_TOKENS = 150  # MAX_TOKENS of answers admitted while the queue is deep
+    ADMISSION_DEGRADE_NO_THINK = True  # Also answer in no-think mode while the queue is deep
+    
+    # Async Pipeline Configuration
+    REQUEST_DEADLINE = 120.0  # Seconds an async query may take end to end
+    
+    # Batch Query Configuration (python main.py batch)
+    BATCH_QUERY_SIZE = 64  # Questions per embedding request and vector search
+    BATCH_CONCURRENCY = 8  # Questions reranked and answered at once
+    
+    # HTTP API Configuration (python main.py serve)
+    SERVE_HOST = "localhost"
+    SERVE_PORT = 8000
+    SERVE_WORKERS = 1  # With more than one worker the vector store is served read-only
+    SERVE_READ_ONLY = False  # Disable the ingest and delete endpoints
+    SERVE_QUERY_CONCURRENCY = 32  # Concurrent /query requests per worker
+    SERVE_STREAM_CONCURRENCY = 32  # Concurrent /query/stream requests per worker
+    SERVE_INGEST_CONCURRENCY = 1  # Concurrent uploads per worker
+    SERVE_QUEUE_TIMEOUT = 2.0  # Seconds a request waits for a free slot before a 503
+    SERVE_INGEST_TIMEOUT = 600.0  # Seconds an upload may take
+    
+    # UI Configuration
+    UI_REFRESH_RATE = 10  # Max repaints per second of a streaming answer
+    
     # No-Think Mode Configuration
     NO_THINK_MODE = False
     
-    # Create temporary directory
-    os.makedirs("./temp", exist_ok=True)
-
-# Initialize local embedding model
-# Pointing to local vLLM service, model name matches served-model-name
-embedding_model = OpenAIEmbeddings(
-    openai_api_base=Config.EMBEDDING_API_BASE,
-    openai_api_key=Config.EMBEDDING_API_KEY,
-    model=Config.EMBEDDING_MODEL_NAME
-)
-
-# Initialize Chroma client
-client = chromadb.PersistentClient(
-    path=Config.CHROMA_DB_PATH,
-    settings=chromadb.Settings(allow_reset=True),
-    tenant=chromadb.DEFAULT_TENANT,
-    database=chromadb.DEFAULT_DATABASE,
-)
-
-# Initialize pharma database
-db = Chroma(collection_name=Config.COLLECTION_NAME,
-            embedding_function=embedding_model,
-            persist_directory=Config.PHARMA_DB_PATH)
\ No newline at end of file
+    # Metrics Configuration (Prometheus text format at /metrics of the HTTP API)
+    METRICS_ENABLED = True  # Record per-stage timings and token counts of queries and ingestion
+    METRICS_HOST = "localhost"
+    METRICS_PORT = None  # Serve /metrics from the Streamlit UI process on this port
+    SLOW_QUERY_THRESHOLD = 10.0  # Seconds; slower queries are logged with their stages (None disables)
+    SLOW_QUERY_LOG_PATH = "./slow_queries.jsonl"
+    SLOW_QUERY_MAX_CHARS = 500  # Characters of the query text kept in the log
+
+# Service handles are built on first use rather than at import time, so importing
+# Config stays cheap and command line overrides applied before the first query
+# take effect. Each handle is memoized per relevant configuration values and
+# rebuilt only if those change.
+_services = {}
+_services_lock = threading.RLock()
+
+
+def get_embedding_model():
+    """Return the process-wide embedding model.
+
+    Points to the local vLLM embedding service (the model name matches its
+    served-model-name). With ``EMBEDDING_CACHE_ENABLED`` a persistent cache sits
+    in front of it so repeated content (re-uploads, shared boilerplate pages,
+    repeated questions) is embedded once.
+
+    Returns:
+        Embeddings: The (cached) embedding model.
+    """
+    key = ("embedding", Config.EMBEDDING_API_BASE, Config.EMBEDDING_API_KEY, Config.EMBEDDING_MODEL_NAME,
+           Config.EMBEDDING_CACHE_ENABLED, Config.EMBEDDING_CACHE_PATH)
+    with _services_lock:
+        if key not in _services:
+            # Imported here: langchain_openai pulls in the whole OpenAI SDK and
+            # the embedding cache langchain_core
+            from langchain_openai import OpenAIEmbeddings
+            from embedding.embedder import EmbeddingCache, CachedEmbeddings
+            embedding_model = OpenAIEmbeddings(
+                openai_api_base=Config.EMBEDDING_API_BASE,
+                openai_api_key=Config.EMBEDDING_API_KEY,
+                model=Config.EMBEDDING_MODEL_NAME,
+                # Send raw text: pre-tokenizing with tiktoken produces OpenAI token IDs,
+                # which mean nothing to the Qwen embedding model
+                check_embedding_ctx_length=False,
+                http_client=create_http_client(
+                    "embedding", Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT, Config.HTTP_POOL_SIZE
+                ),
+                max_retries=Config.HTTP_MAX_RETRIES
+            )
+            if Config.EMBEDDING_CACHE_ENABLED:
+                embedding_model = CachedEmbeddings(
+                    embedding_model,
+                    EmbeddingCache(Config.EMBEDDING_CACHE_PATH, max_entries=Config.EMBEDDING_CACHE_MAX_ENTRIES),
+                    model_name=Config.EMBEDDING_MODEL_NAME
+                )
+            _services[key] = embedding_model
+        return _services[key]
+
+
+def get_catalog():
+    """Return the process-wide file catalog.
+
+    The SQLite database at ``Config.CATALOG_PATH`` is opened on first use
+    rather than on import, and a changed ``CATALOG_PATH`` gets its own catalog.
+
+    Returns:
+        FileCatalog: The catalog of ingested files and their chunk references.
+    """
+    key = ("catalog", Config.CATALOG_PATH)
+    with _services_lock:
+        if key not in _services:
+            from vector_db.catalog import FileCatalog
+            _services[key] = FileCatalog(Config.CATALOG_PATH)
+        return _services[key]
+
+
+def get_index_settings(collection_name=None):
+    """Return the configured vector index settings of a collection.
+
+    Args:
+        collection_name (str, optional): Collection, defaults to ``Config.COLLECTION_NAME``.
+
+    Returns:
+        dict: ``space``, ``M``, ``construction_ef`` and ``search_ef``, with the
+        collection's entry of ``COLLECTION_INDEX_SETTINGS`` applied.
+    """
+    settings = {"space": Config.INDEX_SPACE, "M": Config.HNSW_M,
+                "construction_ef": Config.HNSW_CONSTRUCTION_EF, "search_ef": Config.HNSW_SEARCH_EF}
+    settings.update(Config.COLLECTION_INDEX_SETTINGS.get(collection_name or Config.COLLECTION_NAME, {}))
+    return settings
+
+
+def get_db():
+    """Return the process-wide pharma vector database.
+
+    ``Config.VECTOR_BACKEND`` selects the Chroma collection or the memory-mapped
+    ``NumpyVectorStore``; both offer the same add, search, get and delete calls.
+
+    Returns:
+        VectorStore: The vector store, using the embedding model of ``get_embedding_model``.
+    """
+    embedding_model = get_embedding_model()
+    settings = get_index_settings()
+    key = ("db", Config.VECTOR_BACKEND, Config.PHARMA_DB_PATH, Config.COLLECTION_NAME, id(embedding_model),
+           tuple(sorted(settings.items())))
+    with _services_lock:
+        if key not in _services:
+            from vector_db.index import hnsw_metadata, sync_index_settings
+            if Config.VECTOR_BACKEND == "numpy":
+                from vector_db.numpy_store import NumpyVectorStore
+                db = NumpyVectorStore(get_numpy_store_path(),
+                                      embedding_function=embedding_model,
+                                      dtype=Config.NUMPY_STORE_DTYPE,
+                                      space=settings["space"],
+                                      search_block=Config.NUMPY_SEARCH_BLOCK)
+            else:
+                # Imported here: chromadb is the slowest import of the application
+                from langchain_chroma import Chroma
+                db = Chroma(collection_name=Config.COLLECTION_NAME,
+                            embedding_function=embedding_model,
+                            persist_directory=Config.PHARMA_DB_PATH,
+                            collection_metadata=hnsw_metadata(settings))
+            # An existing store keeps the settings it was built with
+            sync_index_settings(db, settings)
+            _services[key] = db
+        return _services[key]
+
+
+def get_numpy_store_path():
+    """Return the directory of the numpy backend's store for ``Config.COLLECTION_NAME``."""
+    return os.path.join(Config.PHARMA_DB_PATH, "numpy", Config.COLLECTION_NAME)
+
+
+def reset_db():
+    """Forget the open vector database, so the next ``get_db`` reopens it (after a reindex)."""
+    with _services_lock:
+        for key in [key for key in _services if key[0] == "db"]:
+            del _services[key]
+
+
+def __getattr__(name):
+    # Backward compatibility for ``config.embedding_model`` and ``config.db``
+    if name == "embedding_model":
+        return get_embedding_model()
+    if name == "db":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Shared clients for the vLLM and rerank servers. They are created on first use
+# (after any command line overrides) and rebuilt only if the endpoint changes.
+_clients = {}
+_clients_lock = threading.Lock()
+# Async clients are bound to the event loop they were created in
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_llm_client():
+    """Return the process-wide OpenAI client for the vLLM server.
+
+    Returns:
+        OpenAI: Client with a keep-alive connection pool, timeouts and retries.
+    """
+    key = ("vllm", Config.VLLM_API_BASE, Config.VLLM_API_KEY)
+    with _clients_lock:
+        if key not in _clients:
+            # Imported here to keep importing config cheap
+            from openai import OpenAI
+            _clients[key] = OpenAI(
+                base_url=Config.VLLM_API_BASE,
+                api_key=Config.VLLM_API_KEY,
+                max_retries=Config.HTTP_MAX_RETRIES,
+                http_client=create_http_client(
+                    "vllm", Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT, Config.HTTP_POOL_SIZE
+                )
+            )
+        return _clients[key]
+
+
+def get_rerank_session():
+    """Return the process-wide HTTP session for the rerank server.
+
+    Returns:
+        requests.Session: Session with a keep-alive connection pool, timeouts and retries.
+    """
+    key = ("rerank", Config.RERANK_API_BASE)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = create_session(
+                "rerank",
+                Config.HTTP_CONNECT_TIMEOUT,
+                Config.HTTP_READ_TIMEOUT,
+                Config.HTTP_MAX_RETRIES,
+                Config.HTTP_BACKOFF_FACTOR,
+                Config.HTTP_POOL_SIZE
+            )
+        return _clients[key]
+
+
+def _get_async_client(key, factory):
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = factory()
+        return clients[key]
+
+
+def get_async_llm_client():
+    """Return the AsyncOpenAI client for the vLLM server bound to the running event loop.
+
+    Returns:
+        AsyncOpenAI: Client with a keep-alive connection pool, timeouts and retries.
+    """
+    def factory():
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(
+            base_url=Config.VLLM_API_BASE,
+            api_key=Config.VLLM_API_KEY,
+            max_retries=Config.HTTP_MAX_RETRIES,
+            http_client=create_async_http_client(
+                "vllm", Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT, Config.HTTP_POOL_SIZE
+            )
+        )
+
+    return _get_async_client(("vllm", Config.VLLM_API_BASE, Config.VLLM_API_KEY), factory)
+
+
+def get_async_rerank_client():
+    """Return the httpx AsyncClient for the rerank server bound to the running event loop.
+
+    Returns:
+        httpx.AsyncClient: Client with a keep-alive connection pool and timeouts.
+    """
+    return _get_async_client(
+        ("rerank", Config.RERANK_API_BASE),
+        lambda: create_async_http_client(
+            "rerank", Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT, Config.HTTP_POOL_SIZE
+        )
+    )
\ No newline at end of file
@@ -1,3 +1,3 @@
-from .pdf_loader import load_pdf_document, save_temp_file, remove_temp_file
+from .pdf_loader import load_pdf_document, iter_pdf_pages, count_pdf_pages
 
-__all__ = ['load_pdf_document', 'save_temp_file', 'remove_temp_file']
\ No newline at end of file
+__all__ = ['load_pdf_document', 'iter_pdf_pages', 'count_pdf_pages']
\ No newline at end of file
@@ -1,40 +1,70 @@
+import io
 import os
-from langchain_community.document_loaders import PyPDFLoader
+from pypdf import PdfReader
+from langchain_core.documents import Document
 
 
-def save_temp_file(uploaded_file):
-    """Save uploaded file to a temporary location.
-    
+def _open_pdf(source):
+    """Open a PDF from a path, bytes or a buffer."""
+    if isinstance(source, (str, os.PathLike)):
+        return PdfReader(source)
+    return PdfReader(io.BytesIO(source))
+
+
+def count_pdf_pages(source):
+    """Return the number of pages of a PDF without extracting any text.
+
     Args:
-        uploaded_file: The uploaded file object.
-        
+        source: Path to the PDF file, or its content as bytes or a buffer.
+
     Returns:
-        str: Path to the temporary file.
+        int: Number of pages.
     """
-    temp_file_path = os.path.join("./temp", uploaded_file.name)
-    with open(temp_file_path, "wb") as temp_file:
-        temp_file.write(uploaded_file.getbuffer())
-    return temp_file_path
+    return len(_open_pdf(source).pages)
 
 
-def remove_temp_file(temp_file_path):
-    """Remove temporary file.
-    
+def iter_pdf_pages(source, name=None, start=0, stop=None):
+    """Lazily yield the pages of a PDF document.
+
+    The PDF is read directly from a path or from an in-memory buffer (e.g. the
+    ``getbuffer()`` of an upload), without a temporary file. Only the page being
+    extracted is held in memory, so the text of large documents is never
+    materialized at once.
+
     Args:
-        temp_file_path (str): Path to the temporary file.
+        source: Path to the PDF file, or its content as bytes or a buffer.
+        name (str, optional): Value of the ``source`` metadata, defaults to the
+            path (or ``"upload.pdf"`` for buffers).
+        start (int): Index of the first page to yield.
+        stop (int, optional): Index after the last page to yield, defaults to the end.
+
+    Yields:
+        Document: One document per page with ``source``, ``page``, ``page_label``
+        and ``total_pages`` metadata.
     """
-    if os.path.exists(temp_file_path):
-        os.remove(temp_file_path)
+    reader = _open_pdf(source)
+    if name is None:
+        name = str(source) if isinstance(source, (str, os.PathLike)) else "upload.pdf"
+    total_pages = len(reader.pages)
+    try:
+        page_labels = reader.page_labels
+    except Exception:
+        # Malformed label trees fall back to page numbers
+        page_labels = [str(index + 1) for index in range(total_pages)]
+    for index in range(start, total_pages if stop is None else min(stop, total_pages)):
+        yield Document(
+            page_content=reader.pages[index].extract_text(),
+            metadata={"source": name, "total_pages": total_pages, "page": index, "page_label": page_labels[index]}
+        )
 
 
-def load_pdf_document(temp_file_path):
-    """Load PDF document using PyPDFLoader.
+def load_pdf_document(source):
+    """Load all pages of a PDF document at once.
     
     Args:
-        temp_file_path (str): Path to the PDF file.
+        source: Path to the PDF file, or its content as bytes or a buffer.
         
     Returns:
         list: List of document objects loaded from the PDF.
     """
-    loader = PyPDFLoader(temp_file_path)
-    return loader.load()
\ No newline at end of file
+    return list(iter_pdf_pages(source))
\ No newline at end of file
@@ -0,0 +1,3 @@
+from .embedder import EmbeddingCache, CachedEmbeddings
+
+__all__ = ['EmbeddingCache', 'CachedEmbeddings']
\ No newline at end of file
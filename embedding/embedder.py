@@ -0,0 +1,258 @@
+import os
+import array
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text):
+    """Normalize text before hashing so trivially different inputs share a cache entry.
+
+    Args:
+        text (str): Raw text to be embedded.
+
+    Returns:
+        str: Unicode-normalized text with collapsed whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_cache_key(model_name, text):
+    """Build the content-addressed cache key for a piece of text.
+
+    Args:
+        model_name (str): Name of the embedding model.
+        text (str): Text to be embedded.
+
+    Returns:
+        str: Hex digest of the model name and normalized text.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed, size-bounded store of embedding vectors.
+
+    Entries are evicted in least-recently-used order once the number of stored
+    vectors exceeds ``max_entries``. Vectors are stored as packed float32 blobs.
+    """
+    def __init__(self, path, max_entries=200000):
+        """Open (or create) the cache database.
+
+        Args:
+            path (str): Path to the SQLite database file.
+            max_entries (int): Maximum number of vectors to keep.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()
+        self._clock = row[0]
+        # Counting the table scans the whole index, so the size is tracked here
+        # and only recounted by stats()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys):
+        """Look up vectors for a list of keys and mark them as recently used.
+
+        Args:
+            keys (list): Cache keys to look up.
+
+        Returns:
+            dict: Mapping of key to vector (list of float) for every key found.
+        """
+        found = {}
+        if not keys:
+            return found
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array.array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                self._clock += 1
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(self._clock, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """Store vectors and evict the least recently used entries if over capacity.
+
+        Args:
+            items (dict): Mapping of cache key to vector.
+        """
+        if not items:
+            return
+        keys = list(items)
+        with self._lock:
+            self._clock += 1
+            stored = 0
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                stored += self._conn.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array.array("f", vector).tobytes(), self._clock) for key, vector in items.items()]
+            )
+            self._entries += len(keys) - stored
+            overflow = self._entries - self.max_entries
+            if overflow > 0:
+                evicted = self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+                self._entries -= evicted
+                self.evictions += evicted
+            self._conn.commit()
+
+    def stats(self):
+        """Return cache counters.
+
+        Returns:
+            dict: Hits, misses, hit rate, evictions and current number of entries.
+        """
+        with self._lock:
+            entries = self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self):
+        """Remove every cached vector and reset the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._entries = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from a persistent cache.
+
+    Only texts missing from the cache are sent to the wrapped embedding model,
+    so re-uploading a document or asking the same question again never costs a
+    round trip to the embedding server.
+    """
+    def __init__(self, embeddings, cache, model_name):
+        """Initialize the wrapper.
+
+        Args:
+            embeddings (Embeddings): The underlying embedding model.
+            cache (EmbeddingCache): Persistent vector cache.
+            model_name (str): Model name used as part of the cache key.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def _lookup(self, texts):
+        keys = [make_cache_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        return keys, found, missing
+
+    def embed_documents(self, texts):
+        """Embed a list of texts, calling the model only for cache misses.
+
+        Args:
+            texts (list): Texts to embed.
+
+        Returns:
+            list: One embedding vector per input text.
+        """
+        texts = list(texts)
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        """Embed a single query text through the cache.
+
+        Args:
+            text (str): Query text.
+
+        Returns:
+            list: Embedding vector.
+        """
+        key = make_cache_key(self.model_name, text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many({key: vector})
+        return vector
+
+    async def aembed_documents(self, texts):
+        """Asynchronously embed a list of texts, calling the model only for cache misses."""
+        texts = list(texts)
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text):
+        """Asynchronously embed a single query text through the cache."""
+        key = make_cache_key(self.model_name, text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = await self.embeddings.aembed_query(text)
+        self.cache.put_many({key: vector})
+        return vector
+
+    def stats(self):
+        """Return the hit/miss counters of the underlying cache."""
+        return self.cache.stats()
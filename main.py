@@ -1,10 +1,17 @@
+import os
 import sys
 import sys
 import argparse
-from ui.interface import render_main_page, render_sidebar
 from config import Config
 
 
+def comma_list(value_type):
+    """Return an argparse type parsing comma separated values."""
+    def parse(text):
+        return [value_type(value) for value in text.split(",")]
+    return parse
+
+
 def main(host="localhost", port=8501):
     """Initialize and manage the PharmaQuery application interface.
 
@@ -25,25 +32,60 @@ def main(host="localhost", port=8501):
 
     Returns:
         None"""
+    # Imported here so the other modes do not load Streamlit
+    from ui.interface import render_main_page, render_sidebar
+    from utils.metrics import start_metrics_server
+    # Prometheus metrics of the UI process, if a port is configured (started once)
+    if Config.METRICS_PORT:
+        start_metrics_server()
     render_main_page()
     render_sidebar()
 
 
 if __name__ == "__main__":
-    # Check if we're running in Streamlit
+    # Check if we're running in Streamlit (nothing else imports it at this point)
     if "streamlit" in sys.modules or any("streamlit" in arg for arg in sys.argv):
         main()
     else:
         # Parse command line arguments
         parser = argparse.ArgumentParser(description="PharmaQuery - Pharmaceutical Insight Retrieval System")
-        parser.add_argument("--host", type=str, default="localhost", help="Host address to run the application on")
-        parser.add_argument("--port", type=int, default=8501, help="Port number to run the application on")
+        parser.add_argument("mode", nargs="?", choices=["ui", "serve", "profile-imports", "reindex", "calibrate-index",
+                                                     "batch", "ingest", "export-snapshot", "import-snapshot"],
+                            default="ui", help="Run the Streamlit UI, the headless HTTP API, report the import time "
+                                               "per module, rebuild the vector index, calibrate its settings, "
+                                               "answer a file of questions, ingest PDFs from disk or export/import "
+                                               "a snapshot of the collection")
+        parser.add_argument("paths", nargs="*", help="Directories, glob patterns or PDF files of ingest mode; "
+                                                     "the snapshot file of export-snapshot and import-snapshot")
+        parser.add_argument("--host", type=str, help="Host address to run the application on "
+                            "(default: localhost, serve: SERVE_HOST)")
+        parser.add_argument("--port", type=int, help="Port number to run the application on (default: 8501, serve: 8000)")
+        parser.add_argument("--workers", type=int, help="Worker processes of the HTTP API (more than one serves read-only) "
+                                                                 "or PDF parsing processes of ingest mode")
         parser.add_argument("--embedding-api-base", type=str, help="Embedding API base URL")
         parser.add_argument("--vllm-api-base", type=str, help="vLLM API base URL")
         parser.add_argument("--chunk-size", type=int, help="Text chunk size for document splitting")
         parser.add_argument("--chunk-overlap", type=int, help="Text chunk overlap for document splitting")
         parser.add_argument("--search-k", type=int, help="Number of documents to retrieve in similarity search")
         parser.add_argument("--no-think", action="store_true", help="Enable no-think mode to remove thought blocks from responses")
+        parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics of the UI on this port")
+        parser.add_argument("--slow-query-threshold", type=float, help="Log queries slower than this many seconds")
+        parser.add_argument("--space", type=comma_list(str), help="Index distance space(s): l2, cosine, ip")
+        parser.add_argument("--hnsw-m", type=comma_list(int), help="HNSW M value(s)")
+        parser.add_argument("--construction-ef", type=comma_list(int), help="HNSW construction_ef value(s)")
+        parser.add_argument("--search-ef", type=comma_list(int), help="HNSW search_ef value(s)")
+        parser.add_argument("--calibration-queries", type=int, default=200, help="Held-out queries of calibrate-index")
+        parser.add_argument("--max-vectors", type=int, default=20000, help="Stored vectors sampled by calibrate-index")
+        parser.add_argument("--input", type=str, help="Questions of batch mode (.txt, one per line, or .jsonl)")
+        parser.add_argument("--output", type=str, help="Answers of batch mode as JSON Lines, resumed if it exists "
+                                                        "(default: <input>.answers.jsonl)")
+        parser.add_argument("--batch-concurrency", type=int, help="Questions answered at once in batch mode")
+        parser.add_argument("--checkpoint", type=str, help="Checkpoint file of ingest mode, resumed if it exists")
+        parser.add_argument("--replace", action="store_true", help="In ingest mode, replace ingested files that "
+                            "have the same name but a different content")
+        parser.add_argument("--since", type=str, help="Export only what was ingested at or after this time "
+                                                      "(YYYY-MM-DD[ HH:MM:SS]), a delta snapshot")
+        parser.add_argument("--snapshot-dtype", choices=["float32", "float16"], help="Embedding precision of the snapshot")
         
         args = parser.parse_args()
         
@@ -60,7 +102,89 @@ if __name__ == "__main__":
             Config.SEARCH_K = args.search_k
         if args.no_think:
             Config.NO_THINK_MODE = True
+        if args.metrics_port:
+            Config.METRICS_PORT = args.metrics_port
+        if args.slow_query_threshold is not None:
+            Config.SLOW_QUERY_THRESHOLD = args.slow_query_threshold
+        if args.batch_concurrency:
+            Config.BATCH_CONCURRENCY = args.batch_concurrency
+        # Single index settings apply to every mode; lists are the grid of calibrate-index
+        if args.mode != "calibrate-index":
+            for name, values in (("INDEX_SPACE", args.space), ("HNSW_M", args.hnsw_m),
+                                 ("HNSW_CONSTRUCTION_EF", args.construction_ef), ("HNSW_SEARCH_EF", args.search_ef)):
+                if values:
+                    setattr(Config, name, values[0])
             
-        # Run the Streamlit app
-        import streamlit.web.bootstrap
-        streamlit.web.bootstrap.run(__file__, command_line=None, args=[f"--server.port={args.port}", f"--server.address={args.host}"])
\ No newline at end of file
+        if args.mode == "serve":
+            # Run the HTTP API
+            from api.server import serve
+            serve(host=args.host, port=args.port, workers=args.workers)
+        elif args.mode == "profile-imports":
+            # Report the startup cost of the application modules
+            from utils.import_profile import profile_imports
+            profile_imports()
+        elif args.mode == "reindex":
+            # Rebuild the collection with the configured index settings
+            from config import get_index_settings
+            from vector_db.index import reindex
+            print(f"Reindexing {Config.COLLECTION_NAME} with {get_index_settings()}")
+            copied = reindex(progress_callback=lambda copied, total: print(f"\r{copied}/{total} records", end=""))
+            print(f"\nReindexed {copied} records")
+        elif args.mode == "calibrate-index":
+            # Recall and latency of a grid of index settings on the stored vectors
+            from vector_db.index import calibrate_index
+            calibrate_index(spaces=args.space, m_values=args.hnsw_m, construction_efs=args.construction_ef,
+                            search_efs=args.search_ef, queries=args.calibration_queries, max_vectors=args.max_vectors)
+        elif args.mode == "batch":
+            # Answer a file of questions, appending each answer as soon as it is ready
+            if not args.input:
+                parser.error("batch mode requires --input")
+            import time
+            from rag_chain.batch import load_questions, run_rag_chain_batch
+            output_path = args.output or os.path.splitext(args.input)[0] + ".answers.jsonl"
+            started = time.perf_counter()
+            records = run_rag_chain_batch(load_questions(args.input), output_path,
+                                          progress_callback=lambda done, total: print(f"\r{done}/{total} questions",
+                                                                                      end=""))
+            seconds = time.perf_counter() - started
+            errors = sum(1 for record in records if record["error"])
+            print(f"\nAnswered {len(records) - errors} questions ({errors} errors) in {seconds:.1f}s, "
+                  f"written to {output_path}")
+        elif args.mode == "ingest":
+            # Ingest PDFs from disk, skipping the files finished by an earlier run
+            if not args.paths:
+                parser.error("ingest mode requires at least one directory, glob pattern or PDF file")
+            if args.workers:
+                Config.INGEST_WORKERS = args.workers
+            from vector_db.bulk_ingest import ingest_paths
+
+            def print_progress(stats):
+                print(f"\r{stats.summary()} · {stats.as_dict()['avg_embed_latency'] * 1000:.0f} ms/embed request",
+                      end="", flush=True)
+
+            result = ingest_paths(args.paths, checkpoint_path=args.checkpoint, progress_callback=print_progress,
+                                  replace=args.replace)
+            stats = result["stats"].as_dict()
+            print(f"\nIngested {result['ingested']} files ({result['unchanged']} unchanged, {result['resumed']} "
+                  f"already in the checkpoint, {len(result['failed'])} failed): {stats['pages_parsed']} pages, "
+                  f"{stats['chunks_written']} chunks written in {stats['elapsed']:.1f}s")
+        elif args.mode in ("export-snapshot", "import-snapshot"):
+            # Copy the collection and file catalog between nodes without re-embedding
+            if len(args.paths) != 1:
+                parser.error(f"{args.mode} requires the snapshot file")
+            from vector_db.snapshot import export_snapshot, import_snapshot
+            if args.mode == "export-snapshot":
+                written = export_snapshot(args.paths[0], since=args.since, dtype=args.snapshot_dtype,
+                                          progress_callback=lambda scanned, total: print(
+                                              f"\r{scanned}/{total} records scanned", end=""))
+                print(f"\nExported {written['records']} records and {written['files']} files to {args.paths[0]} "
+                      f"({os.path.getsize(args.paths[0]) / 2 ** 20:.1f} MB)")
+            else:
+                loaded = import_snapshot(args.paths[0], progress_callback=lambda records: print(
+                    f"\r{records} records loaded", end=""))
+                print(f"\nImported {loaded['records']} records and {loaded['files']} files "
+                      f"({loaded['deleted']} replaced chunks deleted) from {args.paths[0]}")
+        else:
+            # Run the Streamlit app
+            import streamlit.web.bootstrap
+            streamlit.web.bootstrap.run(__file__, command_line=None, args=[f"--server.port={args.port or 8501}", f"--server.address={args.host or 'localhost'}"])
\ No newline at end of file
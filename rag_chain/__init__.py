@@ -1,3 +1,5 @@
-from .chain import run_rag_chain
+from .chain import run_rag_chain, run_rag_chain_stream
+from .async_chain import arun_rag_chain, arun_rag_chain_stream
+from .batch import run_rag_chain_batch
 
-__all__ = ['run_rag_chain']
\ No newline at end of file
+__all__ = ['run_rag_chain', 'run_rag_chain_stream', 'arun_rag_chain', 'arun_rag_chain_stream', 'run_rag_chain_batch']
\ No newline at end of file
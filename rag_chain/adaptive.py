@@ -0,0 +1,123 @@
+import threading
+from config import Config, get_db, get_index_settings
+from utils.http_client import latency_stats
+
+# Decisions taken by the adaptive retrieval mode
+NO_CONTEXT = "no_context"  # Nothing relevant: answer as plain chat without context
+SKIP_RERANK = "skip_rerank"  # Top hit clearly ahead: keep the similarity order
+WIDEN = "widen"  # Flat scores: search wider before reranking
+RERANK = "rerank"  # Ambiguous order: rerank the retrieved documents
+DIRECT = "direct"  # Reranking disabled: use the relevant hits as they are
+
+
+class AdaptiveStats:
+    """Counts how often each adaptive retrieval decision is taken."""
+    def __init__(self):
+        """Initialize the counters."""
+        self.decisions = {NO_CONTEXT: 0, SKIP_RERANK: 0, WIDEN: 0, RERANK: 0, DIRECT: 0}
+        self.rerank_seconds_saved = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, decision):
+        """Record a decision and estimate the rerank time it saved.
+
+        Args:
+            decision (str): The decision taken.
+        """
+        with self._lock:
+            self.decisions[decision] += 1
+            if decision in (NO_CONTEXT, SKIP_RERANK) and Config.RERANK_ENABLED:
+                # Skipped rerank round trips are valued at the observed average latency
+                self.rerank_seconds_saved += latency_stats.snapshot().get("rerank", {}).get("avg", 0.0)
+
+    def snapshot(self):
+        """Return decision counts and the estimated rerank time saved in seconds."""
+        with self._lock:
+            total = sum(self.decisions.values())
+            return {
+                "decisions": dict(self.decisions),
+                "rates": {name: count / total if total else 0.0 for name, count in self.decisions.items()},
+                "rerank_seconds_saved": self.rerank_seconds_saved,
+            }
+
+
+adaptive_stats = AdaptiveStats()
+
+
+def choose_retrieval(scored):
+    """Decide how to continue from the score distribution of a similarity search.
+
+    Scores are squared L2 distances of unit vectors (lower is closer), which
+    ``adaptive_search`` derives from cosine and inner product distances.
+
+    Args:
+        scored (list): ``(document, distance)`` pairs, closest first.
+
+    Returns:
+        str: One of ``NO_CONTEXT``, ``DIRECT``, ``SKIP_RERANK``, ``WIDEN`` or ``RERANK``.
+    """
+    distances = [distance for _, distance in scored]
+    if not distances or distances[0] > Config.ADAPTIVE_MAX_DISTANCE:
+        return NO_CONTEXT
+    if not Config.RERANK_ENABLED:
+        return DIRECT
+    if len(distances) == 1 or distances[1] - distances[0] >= Config.ADAPTIVE_RERANK_SKIP_GAP:
+        return SKIP_RERANK
+    if len(distances) >= Config.SEARCH_K and distances[-1] - distances[0] <= Config.ADAPTIVE_FLAT_SPREAD:
+        return WIDEN
+    return RERANK
+
+
+def distance_scale():
+    """Return the factor converting distances of the index space to squared L2.
+
+    Cosine and inner product distances of unit vectors are half their squared
+    L2 distance, which the thresholds are expressed in.
+    """
+    return 1.0 if get_index_settings()["space"] == "l2" else 2.0
+
+
+def select_documents(scored, widen):
+    """Apply the adaptive decision to the result of a similarity search.
+
+    Args:
+        scored (list): ``(document, squared L2 distance)`` pairs of a ``SEARCH_K`` search.
+        widen (callable): Returns the pairs of a search with ``SEARCH_K * ADAPTIVE_WIDEN_FACTOR`` hits.
+
+    Returns:
+        tuple: The documents and whether they still need to be reranked.
+    """
+    decision = choose_retrieval(scored)
+    adaptive_stats.record(decision)
+    if decision == NO_CONTEXT:
+        return [], False
+    if decision == WIDEN:
+        scored = widen()
+    docs = [doc for doc, distance in scored if distance <= Config.ADAPTIVE_MAX_DISTANCE]
+    if decision == SKIP_RERANK:
+        return docs[:Config.RERANK_TOP_K], False
+    return docs, decision in (WIDEN, RERANK)
+
+
+def adaptive_search(embedding):
+    """Run a similarity search and decide whether its result needs reranking.
+
+    Hits farther than ``ADAPTIVE_MAX_DISTANCE`` are dropped. When the top hit is
+    clearly ahead only the ``RERANK_TOP_K`` closest hits are kept and the rerank
+    call is skipped; when the scores are flat the search is repeated with a
+    larger ``k`` so the reranker has more candidates to choose from.
+
+    Args:
+        embedding (list): Query embedding.
+
+    Returns:
+        tuple: The documents and whether they still need to be reranked.
+    """
+    db = get_db()
+    scale = distance_scale()
+
+    def search(k):
+        scored = db.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+        return [(doc, distance * scale) for doc, distance in scored]
+
+    return select_documents(search(Config.SEARCH_K), lambda: search(Config.SEARCH_K * Config.ADAPTIVE_WIDEN_FACTOR))
@@ -0,0 +1,283 @@
+import time
+import asyncio
+from functools import partial
+from config import Config, get_db, get_embedding_model, get_async_llm_client
+from rag_chain.context import assemble_context
+from utils.reranker import arerank_documents
+from utils.batcher import embed_batcher
+from vector_db.chroma_db import get_documents_by_ids
+from rag_chain.cache import query_cache, replay_answer
+from rag_chain.adaptive import adaptive_search
+from rag_chain.history import history_manager
+from utils.stream_filter import ThinkFilter, stream_stats
+from rag_chain.prompt import build_messages, build_history_messages, build_user_message, with_no_think
+from rag_chain.chain import (clean_response, lookup_cached_query, lookup_cached_answer, answer_scope,
+                             record_generation, record_admission)
+from utils.metrics import Trace
+from utils.admission import admission_controller
+
+
+class Deadline:
+    """Absolute deadline shared by every upstream call of one query."""
+    def __init__(self, timeout=None):
+        """Start the deadline clock.
+
+        Args:
+            timeout (float, optional): Seconds until the deadline, defaults to
+                ``Config.REQUEST_DEADLINE``.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.expires = self.loop.time() + (Config.REQUEST_DEADLINE if timeout is None else timeout)
+
+    def remaining(self):
+        """Return the seconds left, raising ``asyncio.TimeoutError`` once expired."""
+        remaining = self.expires - self.loop.time()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return remaining
+
+    async def run(self, awaitable):
+        """Await ``awaitable``, cancelling it if the deadline passes first."""
+        return await asyncio.wait_for(awaitable, self.remaining())
+
+    def admit(self, session_id):
+        """Wait for a generation slot for at most the queue timeout or the time left."""
+        return admission_controller.aadmit(session_id, min(Config.ADMISSION_QUEUE_TIMEOUT, self.remaining()))
+
+
+async def aembed_query(query, deadline, cached=None):
+    """Embed a query, reusing the cached embedding of a repeated question.
+
+    With micro-batching enabled the query joins the shared embedding batch;
+    otherwise the (synchronous) embedding cache runs in the default executor.
+
+    Args:
+        query (str): The user's question.
+        deadline (Deadline): Deadline of the current query.
+        cached (dict, optional): Exact-match cache entry for the query.
+
+    Returns:
+        list: Query embedding.
+    """
+    if cached is not None:
+        return cached["embedding"]
+    if Config.MICRO_BATCH_ENABLED:
+        return await deadline.run(asyncio.wrap_future(embed_batcher.submit(query)))
+    loop = asyncio.get_running_loop()
+    return await deadline.run(loop.run_in_executor(None, get_embedding_model().embed_query, query))
+
+
+async def aretrieve(query, embedding, deadline, cached=None, version=None, trace=None):
+    """Retrieve (and optionally rerank) documents for a query.
+
+    Chroma is synchronous, so the search runs in the default executor; the
+    rerank call goes through ``arerank_documents``.
+
+    Args:
+        query (str): The user's question.
+        embedding (list): Query embedding.
+        deadline (Deadline): Deadline of the current query.
+        cached (dict, optional): Exact-match cache entry for the query.
+        version (int, optional): Collection version for storing the result.
+        trace (Trace, optional): Trace receiving the retrieval and rerank timings.
+
+    Returns:
+        list: Retrieved documents.
+    """
+    trace = trace or Trace("query")
+    loop = asyncio.get_running_loop()
+    if cached is not None and cached["chunk_ids"] is not None:
+        with trace.span("retrieval"):
+            return await deadline.run(loop.run_in_executor(None, get_documents_by_ids, cached["chunk_ids"]))
+
+    with trace.span("retrieval"):
+        if Config.ADAPTIVE_RETRIEVAL:
+            docs, needs_rerank = await deadline.run(loop.run_in_executor(None, adaptive_search, embedding))
+        else:
+            docs = await deadline.run(loop.run_in_executor(
+                None, partial(get_db().similarity_search_by_vector, embedding, k=Config.SEARCH_K)
+            ))
+            needs_rerank = Config.RERANK_ENABLED
+
+    # Apply reranking if enabled
+    if needs_rerank:
+        with trace.span("rerank"):
+            docs = await deadline.run(arerank_documents(query, docs))
+
+    if Config.QUERY_CACHE_ENABLED and version is not None:
+        chunk_ids = [doc.id for doc in docs] if all(getattr(doc, "id", None) for doc in docs) else None
+        query_cache.put_query(query, embedding, chunk_ids, version)
+    return docs
+
+
+async def arun_rag_chain(query, timeout=None, session_id=None):
+    """Asynchronously process a query using the RAG chain.
+
+    Async counterpart of ``run_rag_chain``: many queries can share one event loop,
+    and every upstream call is cancelled once the query deadline passes or the
+    calling task is cancelled.
+
+    Args:
+        query (str): The user's question that needs to be answered.
+        timeout (float, optional): Seconds the whole query may take, defaults to
+            ``Config.REQUEST_DEADLINE``.
+        session_id (str, optional): Session of the caller, the unit of fairness
+            when generation requests queue for the model.
+
+    Returns:
+        str: A response generated by the chat model, based on the retrieved context."""
+    trace = Trace("query", query)
+    try:
+        deadline = Deadline(timeout)
+        with trace.span("embedding"):
+            version, cached = lookup_cached_query(query)
+            embedding = await aembed_query(query, deadline, cached)
+        cached_answer = lookup_cached_answer(query, embedding, strict=True)
+        if cached_answer is not None:
+            trace.finish("cached")
+            return cached_answer
+
+        docs = await aretrieve(query, embedding, deadline, cached, version, trace)
+        with trace.span("context"):
+            messages = build_messages(query, assemble_context(docs), strict=True)
+            history_manager.record_turn(messages)
+        async with deadline.admit(session_id) as admission:
+            record_admission(trace, admission)
+            if admission.no_think:
+                messages = with_no_think(messages)
+            with trace.span("generation"):
+                response = await deadline.run(get_async_llm_client().chat.completions.create(
+                    model=Config.VLLM_MODEL_NAME,
+                    messages=messages,
+                    max_tokens=admission.max_tokens,
+                    temperature=Config.TEMPERATURE
+                ))
+        record_generation(trace, response.usage, 0, trace.spans["generation"])
+        answer = clean_response(response.choices[0].message.content)
+        if Config.SEMANTIC_CACHE_ENABLED and answer and not admission.degraded:
+            query_cache.put_answer(embedding, answer, version, answer_scope(query, strict=True))
+        trace.finish()
+        return answer
+    except asyncio.TimeoutError:
+        trace.finish("error")
+        return "Error generating response: request deadline exceeded"
+    except Exception as e:
+        trace.finish("error")
+        return f"Error generating response: {str(e)}"
+
+
+async def arun_rag_chain_stream(query, chat_history=None, timeout=None, session_id=None):
+    """Asynchronously process a query using the RAG chain with streaming output.
+
+    Async counterpart of ``run_rag_chain_stream``. The query embedding starts
+    while the history part of the prompt is assembled. Closing the generator
+    (e.g. when the client disconnects), cancelling the consuming task or passing
+    the deadline closes the upstream generation stream.
+
+    Args:
+        query (str): The user's question that needs to be answered.
+        chat_history (list, optional): List of previous messages in the conversation.
+        timeout (float, optional): Seconds the whole query may take, defaults to
+            ``Config.REQUEST_DEADLINE``.
+        session_id (str, optional): Session of the caller, the unit of fairness
+            when generation requests queue for the model.
+
+    Yields:
+        str: Chunks of response generated by the chat model, without think blocks."""
+    trace = Trace("query", query)
+    started = trace.started
+    try:
+        deadline = Deadline(timeout)
+        # Embed the query while the history part of the prompt is assembled
+        version, cached = lookup_cached_query(query)
+        embedding_task = asyncio.ensure_future(aembed_query(query, deadline, cached))
+        try:
+            # Summarizing folded turns calls the model, so it runs in the executor
+            loop = asyncio.get_running_loop()
+            with trace.span("history"):
+                messages = await deadline.run(loop.run_in_executor(
+                    None, partial(build_history_messages, chat_history, query, session_id=session_id)
+                ))
+            embedding = await embedding_task
+        finally:
+            # Do not leave the embedding running if the history failed
+            embedding_task.cancel()
+        trace.mark("embedding")
+
+        # Replay the stored answer of a semantically equivalent question
+        cached_answer = lookup_cached_answer(query, embedding, chat_history)
+        if cached_answer is not None:
+            trace.finish("cached")
+            for piece in replay_answer(cached_answer):
+                yield piece
+            return
+
+        docs = await aretrieve(query, embedding, deadline, cached, version, trace)
+        with trace.span("context"):
+            messages.append(build_user_message(query, assemble_context(docs)))
+            history_manager.record_turn(messages)
+
+        # The generation slot is held until the stream is finished
+        async with deadline.admit(session_id) as admission:
+            record_admission(trace, admission)
+            if admission.no_think:
+                messages = with_no_think(messages)
+
+            # The last chunk of the stream reports the token usage
+            generation_started = time.perf_counter()
+            stream = await deadline.run(get_async_llm_client().chat.completions.create(
+                model=Config.VLLM_MODEL_NAME,
+                messages=messages,
+                max_tokens=admission.max_tokens,
+                temperature=Config.TEMPERATURE,
+                stream=True,
+                stream_options={"include_usage": True}
+            ))
+            think_filter = ThinkFilter()
+            full_response = ""
+            first_token = first_visible = None
+            usage = None
+            generated_chunks = 0
+            try:
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await deadline.run(chunks.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        generated_chunks += 1
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                            trace.mark("first_token")
+                        visible = think_filter.feed(chunk.choices[0].delta.content)
+                        if visible:
+                            if first_visible is None:
+                                first_visible = time.perf_counter() - started
+                            full_response += visible
+                            yield visible
+            finally:
+                # Release the upstream connection, also when the consumer went away
+                await stream.close()
+            visible = think_filter.flush()
+            if visible:
+                full_response += visible
+                yield visible
+        stream_stats.record(first_token, first_visible)
+        finished = time.perf_counter()
+        trace.add_span("generation", finished - generation_started)
+        if first_token is not None:
+            record_generation(trace, usage, generated_chunks, finished - started - first_token)
+
+        # Only complete, non-degraded answers are cached
+        if Config.SEMANTIC_CACHE_ENABLED and full_response and not admission.degraded:
+            query_cache.put_answer(embedding, full_response, version, answer_scope(query, chat_history))
+        trace.finish()
+    except asyncio.TimeoutError:
+        trace.finish("error")
+        yield "Error generating response: request deadline exceeded"
+    except Exception as e:
+        trace.finish("error")
+        yield f"Error generating response: {str(e)}"
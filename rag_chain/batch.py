@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Config, get_embedding_model, get_llm_client
+from vector_db.chroma_db import search_by_vectors
+from rag_chain.adaptive import distance_scale, select_documents
+from rag_chain.context import assemble_context
+from rag_chain.prompt import build_messages, with_no_think
+from rag_chain.chain import clean_response, record_generation, record_admission
+from utils.reranker import rerank_documents
+from utils.metrics import Trace
+from utils.admission import admission_controller
+
+
+def is_valid_query(query):
+    """Return True if ``query`` is a non-empty question string."""
+    return isinstance(query, str) and bool(query.strip())
+
+
+def load_questions(path):
+    """Read the questions of a batch run.
+
+    Plain text files hold one question per line. JSON Lines files hold objects
+    with a ``query`` (or ``question``) and an optional ``id``; the line number
+    is the ID otherwise, so the IDs stay stable across resumed runs. Lines
+    that are not valid JSON or have no question are kept with an ``error``, so
+    they fail on their own instead of failing their whole batch.
+
+    Args:
+        path (str): ``.txt`` or ``.jsonl`` file.
+
+    Returns:
+        list: ``{"id": ..., "query": ...}`` dicts in file order.
+    """
+    questions = []
+    with open(path, encoding="utf-8") as input_file:
+        for number, line in enumerate(input_file):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    questions.append({"id": number, "query": None, "error": f"Invalid JSON: {e}"})
+                    continue
+                if not isinstance(item, dict):
+                    item = {"query": item}
+                query = item.get("query") or item.get("question")
+                question = {**item, "id": item.get("id", number), "query": query}
+                if not is_valid_query(query):
+                    question["error"] = "Missing query"
+                questions.append(question)
+            else:
+                questions.append({"id": number, "query": line})
+    return questions
+
+
+def load_checkpoint(path):
+    """Return the IDs already answered in an output file, preparing it for appending.
+
+    The output file is the checkpoint: every finished question is one line.
+    Questions that failed are not counted, so a resumed run retries them. The
+    file is compacted to the last successful record of every ID: the records
+    of failed questions are dropped, since the retry appends a new one, and so
+    is a line cut off by an interrupted run.
+
+    Args:
+        path (str): Output JSON Lines file (may not exist yet).
+
+    Returns:
+        set: IDs with a successful answer.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb") as output_file:
+        data = output_file.read()
+    complete = data.rfind(b"\n") + 1
+    lines = data[:complete].splitlines()
+    latest = {}
+    for line in lines:
+        record = json.loads(line)
+        # Re-inserted, so the order follows the last record of each ID
+        latest.pop(record["id"], None)
+        latest[record["id"]] = (record, line)
+    kept = [line for record, line in latest.values() if not record.get("error")]
+    if len(kept) < len(lines) or complete < len(data):
+        # Write a new file and swap it in, so an interruption cannot lose records
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as output_file:
+            output_file.writelines(line + b"\n" for line in kept)
+        os.replace(temporary_path, path)
+    return {record["id"] for record, _ in latest.values() if not record.get("error")}
+
+
+def retrieve_batch(embeddings):
+    """Search the context documents of many questions with one vector search.
+
+    With adaptive retrieval the search fetches the widened number of hits at
+    once and the decision is taken on the closest ``SEARCH_K`` of them.
+
+    Args:
+        embeddings (list): Query embeddings.
+
+    Returns:
+        list: ``(documents, needs_rerank)`` per question.
+    """
+    if not Config.ADAPTIVE_RETRIEVAL:
+        results = search_by_vectors(embeddings, Config.SEARCH_K)
+        return [([doc for doc, _ in scored], Config.RERANK_ENABLED) for scored in results]
+    scale = distance_scale()
+    results = search_by_vectors(embeddings, Config.SEARCH_K * Config.ADAPTIVE_WIDEN_FACTOR)
+    selected = []
+    for scored in results:
+        scored = [(doc, distance * scale) for doc, distance in scored]
+        selected.append(select_documents(scored[:Config.SEARCH_K], lambda scored=scored: scored))
+    return selected
+
+
+def answer_question(question, docs, needs_rerank, trace):
+    """Rerank the documents of one question and generate its answer.
+
+    Args:
+        question (dict): ``id`` and ``query`` of the question.
+        docs (list): Retrieved documents.
+        needs_rerank (bool): Whether the documents still need to be reranked.
+        trace (Trace): Trace of the question.
+
+    Returns:
+        dict: The output record of the question.
+    """
+    query = question["query"]
+    record = {**question, "answer": None, "sources": [], "error": None}
+    try:
+        if needs_rerank:
+            with trace.span("rerank"):
+                docs = rerank_documents(query, docs)
+        with trace.span("context"):
+            messages = build_messages(query, assemble_context(docs), strict=True)
+        # All batch questions share one session, so interactive sessions get
+        # free slots first; they wait without a queue timeout
+        with admission_controller.admit("batch", timeout=float("inf")) as admission:
+            record_admission(trace, admission)
+            if admission.no_think:
+                messages = with_no_think(messages)
+            with trace.span("generation"):
+                response = get_llm_client().chat.completions.create(
+                    model=Config.VLLM_MODEL_NAME,
+                    messages=messages,
+                    max_tokens=admission.max_tokens,
+                    temperature=Config.TEMPERATURE
+                )
+        record_generation(trace, response.usage, 0, trace.spans["generation"])
+        record["answer"] = clean_response(response.choices[0].message.content)
+        record["sources"] = [{"id": doc.id, "source": doc.metadata.get("source"), "page": doc.metadata.get("page")}
+                             for doc in docs]
+        record["seconds"] = trace.finish()
+    except Exception as e:
+        record["error"] = str(e)
+        record["seconds"] = trace.finish("error")
+    record["stages"] = {stage: round(seconds, 4) for stage, seconds in trace.spans.items()}
+    record.update({key: value for key, value in trace.values.items() if value is not None})
+    return record
+
+
+def run_rag_chain_batch(queries, output_path=None, batch_size=None, concurrency=None, progress_callback=None):
+    """Answer many questions, sharing the embedding and search requests.
+
+    Questions are processed in batches of ``batch_size``: one embedding
+    request and one vector search per batch, then reranking and generation of
+    up to ``concurrency`` questions at once (concurrent rerank calls are
+    coalesced further by the micro-batcher). Each result is appended to
+    ``output_path`` as soon as it is ready, and a run with the same output
+    skips the questions already answered there. The query and answer caches
+    are bypassed, so evaluation runs always measure fresh answers.
+
+    Args:
+        queries (list): Question strings or ``{"id": ..., "query": ...}`` dicts.
+        output_path (str, optional): JSON Lines file receiving one record per question.
+        batch_size (int, optional): Questions per embedding request and search,
+            defaults to ``Config.BATCH_QUERY_SIZE``.
+        concurrency (int, optional): Questions reranked and answered at once,
+            defaults to ``Config.BATCH_CONCURRENCY``.
+        progress_callback (callable, optional): Called with ``(finished, total)``.
+
+    Returns:
+        list: The records of the questions answered in this run, in input order.
+    """
+    batch_size = batch_size or Config.BATCH_QUERY_SIZE
+    questions = [query if isinstance(query, dict) else {"id": index, "query": query}
+                 for index, query in enumerate(queries)]
+    if output_path:
+        done = load_checkpoint(output_path)
+        questions = [question for question in questions if question["id"] not in done]
+
+    output_file = open(output_path, "a", encoding="utf-8") if output_path else None
+    write_lock = threading.Lock()
+    records, finished = {}, 0
+
+    def finish(record):
+        nonlocal finished
+        with write_lock:
+            records[record["id"]] = record
+            finished += 1
+            if output_file:
+                output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output_file.flush()
+        if progress_callback:
+            progress_callback(finished, len(questions))
+
+    try:
+        # Questions without a query fail on their own, not with their batch
+        valid = []
+        for question in questions:
+            if is_valid_query(question["query"]):
+                valid.append(question)
+            else:
+                finish({**question, "answer": None, "sources": [], "error": question.get("error") or "Missing query"})
+
+        with ThreadPoolExecutor(max_workers=concurrency or Config.BATCH_CONCURRENCY,
+                                thread_name_prefix="rag-batch") as executor:
+            for start in range(0, len(valid), batch_size):
+                batch = valid[start:start + batch_size]
+                texts = [question["query"] for question in batch]
+                traces = [Trace("batch", text) for text in texts]
+                try:
+                    started = time.perf_counter()
+                    embeddings = get_embedding_model().embed_documents(texts)
+                    embed_seconds = time.perf_counter() - started
+                    started = time.perf_counter()
+                    retrieved = retrieve_batch(embeddings)
+                    search_seconds = time.perf_counter() - started
+                except Exception as e:
+                    print(f"Error retrieving batch: {e}")
+                    for question, trace in zip(batch, traces):
+                        trace.finish("error")
+                        finish({**question, "answer": None, "sources": [], "error": str(e)})
+                    continue
+
+                futures = []
+                for question, trace, (docs, needs_rerank) in zip(batch, traces, retrieved):
+                    # The shared requests count fully for every question of the batch
+                    trace.add_span("embedding", embed_seconds)
+                    trace.add_span("retrieval", search_seconds)
+                    futures.append(executor.submit(answer_question, question, docs, needs_rerank, trace))
+                # The next batch is embedded once this one's questions are answered, which
+                # bounds the documents held in memory
+                for future in as_completed(futures):
+                    finish(future.result())
+    finally:
+        if output_file:
+            output_file.close()
+    return [records[question["id"]] for question in questions if question["id"] in records]
@@ -0,0 +1,203 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from embedding.embedder import normalize_text
+from config import Config, get_catalog, get_index_settings
+
+
+class QueryCache:
+    """Two-tier cache in front of the RAG chain.
+
+    Tier one maps the exact (normalized) query text to its embedding and the IDs
+    of the chunks finally used as context, skipping the embedding call, the
+    vector search and the rerank call. Tier two stores generated answers by query
+    embedding and returns one when a new query is within a cosine similarity
+    threshold of a cached query and was answered in the same scope: the same
+    prompt mode and the same earlier conversation (see ``answer_scope``).
+
+    Both tiers are tagged with the collection version from the file catalog and
+    are cleared as soon as the collection changes.
+    """
+    def __init__(self, max_queries=10000, max_answers=2000):
+        """Initialize an empty cache.
+
+        Args:
+            max_queries (int): Maximum number of exact-match entries.
+            max_answers (int): Maximum number of cached answers.
+        """
+        self.max_queries = max_queries
+        self.max_answers = max_answers
+        self._queries = OrderedDict()
+        self._answer_keys = []
+        self._answer_vectors = np.zeros((0, 0), dtype=np.float32)
+        self._answers = []
+        self._version = None
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.exact_misses = 0
+        self.semantic_hits = 0
+        self.semantic_misses = 0
+        self.invalidations = 0
+
+    def sync(self):
+        """Clear the cache if the collection changed since it was filled.
+
+        Returns:
+            int: The current collection version, to be passed back to the ``put`` methods.
+        """
+        version = get_catalog().get_collection_version()
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self.invalidations += 1
+                self._queries.clear()
+                self._answer_keys = []
+                self._answer_vectors = np.zeros((0, 0), dtype=np.float32)
+                self._answers = []
+                self._version = version
+        return version
+
+    @staticmethod
+    def _retrieval_key():
+        # Retrieved chunks depend on the retrieval settings, not only on the query
+        return (Config.SEARCH_K, Config.RERANK_ENABLED, Config.RERANK_TOP_K, Config.ADAPTIVE_RETRIEVAL,
+                Config.VECTOR_BACKEND, tuple(sorted(get_index_settings().items())))
+
+    @classmethod
+    def _query_key(cls, query):
+        return (normalize_text(query),) + cls._retrieval_key()
+
+    @classmethod
+    def _settings_key(cls, scope):
+        # Answers depend on the generation settings and the prompt, not only on the query
+        return (Config.VLLM_MODEL_NAME, Config.NO_THINK_MODE, Config.MAX_TOKENS, scope) + cls._retrieval_key()
+
+    def get_query(self, query):
+        """Look up the exact-match tier.
+
+        Args:
+            query (str): The user's question.
+
+        Returns:
+            dict: ``{"embedding": list, "chunk_ids": list or None}``, or None on a miss.
+        """
+        key = self._query_key(query)
+        with self._lock:
+            entry = self._queries.get(key)
+            if entry is not None:
+                self._queries.move_to_end(key)
+                self.exact_hits += 1
+            else:
+                self.exact_misses += 1
+            return entry
+
+    def put_query(self, query, embedding, chunk_ids, version):
+        """Store the embedding and retrieved chunk IDs of a query.
+
+        Args:
+            query (str): The user's question.
+            embedding (list): Query embedding.
+            chunk_ids (list): IDs of the chunks used as context, None if unknown.
+            version (int): Collection version the result was computed against.
+        """
+        key = self._query_key(query)
+        with self._lock:
+            if version != self._version:
+                return
+            self._queries[key] = {"embedding": embedding, "chunk_ids": chunk_ids}
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+
+    def get_answer(self, embedding, threshold=None, scope=None):
+        """Look up the semantic tier.
+
+        Args:
+            embedding (list): Query embedding.
+            threshold (float, optional): Minimum cosine similarity, defaults to
+                ``Config.SEMANTIC_CACHE_THRESHOLD``.
+            scope (tuple, optional): Prompt mode and conversation of the question;
+                only answers stored with the same scope are returned.
+
+        Returns:
+            str: The cached answer of the most similar query, or None on a miss.
+        """
+        threshold = Config.SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        settings = self._settings_key(scope)
+        with self._lock:
+            if self._answers and self._answer_vectors.shape[1] == vector.shape[0]:
+                similarities = self._answer_vectors @ vector
+                for index in np.argsort(-similarities):
+                    if similarities[index] < threshold:
+                        break
+                    if self._answer_keys[index] == settings:
+                        self.semantic_hits += 1
+                        return self._answers[index]
+            self.semantic_misses += 1
+            return None
+
+    def put_answer(self, embedding, answer, version, scope=None):
+        """Store a generated answer for the semantic tier.
+
+        Args:
+            embedding (list): Query embedding.
+            answer (str): Generated answer.
+            version (int): Collection version the answer was computed against.
+            scope (tuple, optional): Prompt mode and conversation of the question.
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            if version != self._version:
+                return
+            if not self._answers or self._answer_vectors.shape[1] != vector.shape[0]:
+                self._answer_vectors = np.zeros((0, vector.shape[0]), dtype=np.float32)
+                self._answer_keys, self._answers = [], []
+            # Oldest answers are dropped first
+            overflow = len(self._answers) + 1 - self.max_answers
+            if overflow > 0:
+                self._answer_vectors = self._answer_vectors[overflow:]
+                self._answer_keys = self._answer_keys[overflow:]
+                self._answers = self._answers[overflow:]
+            self._answer_vectors = np.vstack([self._answer_vectors, vector[None, :]])
+            self._answer_keys.append(self._settings_key(scope))
+            self._answers.append(answer)
+
+    def stats(self):
+        """Return cache counters.
+
+        Returns:
+            dict: Hit/miss counters and current sizes of both tiers.
+        """
+        with self._lock:
+            return {
+                "exact_hits": self.exact_hits,
+                "exact_misses": self.exact_misses,
+                "semantic_hits": self.semantic_hits,
+                "semantic_misses": self.semantic_misses,
+                "invalidations": self.invalidations,
+                "queries": len(self._queries),
+                "answers": len(self._answers),
+                "version": self._version,
+            }
+
+
+def replay_answer(answer, chunk_size=16):
+    """Yield a cached answer in small pieces, like a streamed generation.
+
+    Args:
+        answer (str): Cached answer.
+        chunk_size (int): Characters per yielded piece.
+
+    Yields:
+        str: Consecutive pieces of the answer.
+    """
+    for start in range(0, len(answer), chunk_size):
+        yield answer[start:start + chunk_size]
+
+
+# Create global query cache instance
+query_cache = QueryCache(max_queries=Config.QUERY_CACHE_MAX_ENTRIES,
+                         max_answers=Config.SEMANTIC_CACHE_MAX_ENTRIES)
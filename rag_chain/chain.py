@@ -1,12 +1,169 @@
-from config import Config
-from vector_db.chroma_db import get_retriever
-from utils.helpers import format_docs
+from config import Config, get_db, get_llm_client
+from vector_db.chroma_db import get_documents_by_ids
+from rag_chain.context import assemble_context
 from utils.reranker import rerank_documents
-import re
-from openai import OpenAI
+from utils.batcher import embed_query
+from rag_chain.cache import query_cache, replay_answer
+from rag_chain.adaptive import adaptive_search
+from rag_chain.history import history_manager
+from rag_chain.prompt import build_messages, with_no_think
+from utils.stream_filter import ThinkFilter, strip_think, stream_stats
+from utils.metrics import Trace
+from utils.admission import admission_controller
+import time
+import json
+import hashlib
 
 
-def run_rag_chain(query):
+def clean_response(text):
+    """Remove thought blocks from a complete model response.
+
+    Args:
+        text (str): Raw model response.
+
+    Returns:
+        str: Response without thought blocks.
+    """
+    return strip_think(text).strip()
+
+
+def lookup_cached_query(query):
+    """Look up a query in the exact-match tier of the query cache.
+
+    Args:
+        query (str): The user's question.
+
+    Returns:
+        tuple: Collection version and the cached entry (None on a miss or if disabled).
+    """
+    version = query_cache.sync()
+    cached = query_cache.get_query(query) if Config.QUERY_CACHE_ENABLED else None
+    return version, cached
+
+
+def answer_scope(query, chat_history=None, strict=False):
+    """Return the scope a generated answer is cached under.
+
+    An answer depends on the prompt it was generated with: the instructions of
+    the single-question chain (``strict``) or of the conversation, and the
+    earlier turns of the conversation. Follow-up questions are therefore only
+    matched with answers given after the same earlier conversation.
+
+    Args:
+        query (str): The user's question.
+        chat_history (list, optional): List of previous messages in the conversation.
+        strict (bool): Whether the answer comes from the single-question chain.
+
+    Returns:
+        tuple: Prompt mode and a digest of the earlier turns ("" if there are none).
+    """
+    turns = prior_turns(query, chat_history)
+    digest = hashlib.sha256(json.dumps(
+        [(turn.get("role"), turn.get("content")) for turn in turns], ensure_ascii=False
+    ).encode("utf-8")).hexdigest() if turns else ""
+    return ("strict" if strict else "chat", digest)
+
+
+def lookup_cached_answer(query, embedding, chat_history=None, strict=False):
+    """Look up a stored answer for a semantically equivalent question.
+
+    Args:
+        query (str): The user's question.
+        embedding (list): Query embedding.
+        chat_history (list, optional): List of previous messages in the conversation.
+        strict (bool): Whether the answer is for the single-question chain.
+
+    Returns:
+        str: Cached answer, or None.
+    """
+    if not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+    if Config.SEMANTIC_CACHE_STANDALONE_ONLY and has_prior_turns(query, chat_history):
+        return None
+    return query_cache.get_answer(embedding, scope=answer_scope(query, chat_history, strict))
+
+
+def prior_turns(query, chat_history=None):
+    """Return the turns of the conversation before the current question."""
+    if not chat_history:
+        return []
+    last = chat_history[-1]
+    if isinstance(last, dict) and last.get("role") == "user" and last.get("content") == query:
+        return chat_history[:-1]
+    return chat_history
+
+
+def has_prior_turns(query, chat_history=None):
+    """Return whether the conversation has turns before the current question."""
+    return bool(prior_turns(query, chat_history))
+
+
+def record_generation(trace, usage, generated_chunks, decode_seconds):
+    """Attach the token counts and decode speed of an answer to a trace.
+
+    Args:
+        trace (Trace): Trace of the query.
+        usage: Usage reported by the server, None if it reported none.
+        generated_chunks (int): Content chunks received, the fallback completion token count.
+        decode_seconds (float): Seconds spent generating the completion tokens.
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None) or generated_chunks
+    trace.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    if completion_tokens and decode_seconds > 0:
+        trace.set(tokens_per_second=round(completion_tokens / decode_seconds, 1))
+
+
+def retrieve_documents(query, embedding, cached=None, version=None, trace=None):
+    """Retrieve and rerank the context documents for a query.
+
+    Documents of an exact query cache hit are fetched by ID, skipping the vector
+    search and the rerank call; otherwise the result is stored in the cache.
+    In adaptive mode the score distribution decides whether to rerank, widen
+    the search or drop the context altogether.
+
+    Args:
+        query (str): The user's question.
+        embedding (list): Query embedding.
+        cached (dict, optional): Exact-match cache entry for the query.
+        version (int, optional): Collection version for storing the result.
+        trace (Trace, optional): Trace receiving the retrieval and rerank timings.
+
+    Returns:
+        list: Context documents.
+    """
+    trace = trace or Trace("query")
+    if cached is not None and cached["chunk_ids"] is not None:
+        with trace.span("retrieval"):
+            return get_documents_by_ids(cached["chunk_ids"])
+
+    # Apply similarity search with the (possibly cached) query embedding
+    with trace.span("retrieval"):
+        if Config.ADAPTIVE_RETRIEVAL:
+            docs, needs_rerank = adaptive_search(embedding)
+        else:
+            docs = get_db().similarity_search_by_vector(embedding, k=Config.SEARCH_K)
+            needs_rerank = Config.RERANK_ENABLED
+    
+    # Apply reranking if enabled
+    if needs_rerank:
+        with trace.span("rerank"):
+            docs = rerank_documents(query, docs)
+
+    if Config.QUERY_CACHE_ENABLED and version is not None:
+        chunk_ids = [doc.id for doc in docs] if all(getattr(doc, "id", None) for doc in docs) else None
+        query_cache.put_query(query, embedding, chunk_ids, version)
+    return docs
+
+
+def record_admission(trace, admission):
+    """Attach the queue wait and degradation of an admitted generation request to a trace."""
+    trace.add_span("queue", admission.waited)
+    if admission.degraded:
+        trace.set(degraded=True)
+
+
+def run_rag_chain(query, session_id=None):
     """Processes a query using a Retrieval-Augmented Generation (RAG) chain.
 
     This function utilizes a RAG chain to answer a given query. It retrieves 
@@ -16,64 +173,65 @@ def run_rag_chain(query):
 
     Args:
         query (str): The user's question that needs to be answered.
+        session_id (str, optional): Session of the caller, the unit of fairness
+            when generation requests queue for the model.
 
     Returns:
         str: A response generated by the chat model, based on the retrieved context."""
-    # Create a Retriever Object and apply Similarity Search
-    retriever = get_retriever()
-    
-    # Get relevant documents
-    docs = retriever.invoke(query)
-    
-    # Apply reranking if enabled
-    if Config.RERANK_ENABLED:
-        docs = rerank_documents(query, docs)
-    
-    context = format_docs(docs)
+    trace = Trace("query", query)
 
-    # Initialize OpenAI client for vLLM
-    client = OpenAI(
-        base_url=Config.VLLM_API_BASE,
-        api_key=Config.VLLM_API_KEY
-    )
+    # Embed the query, reusing the cached embedding of a repeated question
+    with trace.span("embedding"):
+        version, cached = lookup_cached_query(query)
+        embedding = cached["embedding"] if cached else embed_query(query)
 
-    # Create prompt with context
-    prompt = f"""You are a highly knowledgeable assistant. 
-Answer the question based only on the following context:
-{context}
+    # Serve the stored answer of a semantically equivalent question
+    cached_answer = lookup_cached_answer(query, embedding, strict=True)
+    if cached_answer is not None:
+        trace.finish("cached")
+        return cached_answer
 
-Answer the question based on the above context:
-{query}
+    # Get relevant documents
+    docs = retrieve_documents(query, embedding, cached, version, trace)
 
-Use the provided context to answer the user's question accurately and concisely.
-Don't justify your answers.
-Don't give information not mentioned in the CONTEXT INFORMATION.
-Do not say "according to the context" or "mentioned in the context" or similar."""
+    # Shared OpenAI client for vLLM (pooled connections, timeouts and retries)
+    client = get_llm_client()
 
-    # Handle no-think mode
-    if Config.NO_THINK_MODE:
-        prompt = "/no_think\n" + prompt
+    # Stable instructions first, context and question last (prefix caching)
+    with trace.span("context"):
+        context = assemble_context(docs)
+        messages = build_messages(query, context, strict=True)
+        history_manager.record_turn(messages)
 
     try:
-        # Call vLLM API
-        response = client.chat.completions.create(
-            model=Config.VLLM_MODEL_NAME,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=Config.MAX_TOKENS,
-            temperature=Config.TEMPERATURE
-        )
+        # Wait for a generation slot (shared fairly by all sessions, degraded under load)
+        with admission_controller.admit(session_id) as admission:
+            record_admission(trace, admission)
+            if admission.no_think:
+                messages = with_no_think(messages)
+            # Call vLLM API
+            with trace.span("generation"):
+                response = client.chat.completions.create(
+                    model=Config.VLLM_MODEL_NAME,
+                    messages=messages,
+                    max_tokens=admission.max_tokens,
+                    temperature=Config.TEMPERATURE
+                )
+        record_generation(trace, response.usage, 0, trace.spans["generation"])
         
         # Remove thought blocks
-        assistant_response = response.choices[0].message.content or ""
-        assistant_response = re.sub(r'</think>.*?</think>', '', assistant_response, flags=re.S).strip()
-        return assistant_response
+        answer = clean_response(response.choices[0].message.content)
+        # Degraded (shortened) answers are not cached
+        if Config.SEMANTIC_CACHE_ENABLED and answer and not admission.degraded:
+            query_cache.put_answer(embedding, answer, version, answer_scope(query, strict=True))
+        trace.finish()
+        return answer
     except Exception as e:
+        trace.finish("error")
         return f"Error generating response: {str(e)}"
 
 
-def run_rag_chain_stream(query, chat_history=None):
+def run_rag_chain_stream(query, chat_history=None, session_id=None, queue_callback=None):
     """Processes a query using a Retrieval-Augmented Generation (RAG) chain with streaming output.
 
     This function utilizes a RAG chain to answer a given query. It retrieves 
@@ -83,81 +241,93 @@ def run_rag_chain_stream(query, chat_history=None):
     Args:
         query (str): The user's question that needs to be answered.
         chat_history (list, optional): List of previous messages in the conversation.
+        session_id (str, optional): Session of the caller, the unit of fairness
+            when generation requests queue for the model.
+        queue_callback (callable, optional): Called with ``(position, waited_seconds)``
+            while the request waits for a generation slot.
 
     Yields:
-        str: Chunks of response generated by the chat model."""
-    # Create a Retriever Object and apply Similarity Search
-    retriever = get_retriever()
-    
+        str: Chunks of response generated by the chat model, without think blocks."""
+    trace = Trace("query", query)
+    started = trace.started
+
+    # Embed the query, reusing the cached embedding of a repeated question
+    with trace.span("embedding"):
+        version, cached = lookup_cached_query(query)
+        embedding = cached["embedding"] if cached else embed_query(query)
+
+    # Replay the stored answer of a semantically equivalent question
+    cached_answer = lookup_cached_answer(query, embedding, chat_history)
+    if cached_answer is not None:
+        trace.finish("cached")
+        yield from replay_answer(cached_answer)
+        return
+
     # Get relevant documents
-    docs = retriever.invoke(query)
-    
-    # Apply reranking if enabled
-    if Config.RERANK_ENABLED:
-        docs = rerank_documents(query, docs)
-    
-    context = format_docs(docs)
+    docs = retrieve_documents(query, embedding, cached, version, trace)
 
-    # Initialize OpenAI client for vLLM
-    client = OpenAI(
-        base_url=Config.VLLM_API_BASE,
-        api_key=Config.VLLM_API_KEY
-    )
+    # Shared OpenAI client for vLLM (pooled connections, timeouts and retries)
+    client = get_llm_client()
 
     try:
-        # Build message list with chat history
-        messages = []
-        
-        # Add system message (role setting)
-        system_content = "You are a highly knowledgeable assistant."
-        messages.append({"role": "system", "content": system_content})
+        # Build message list: system message and chat history first, then
+        # the retrieved context and current query
+        with trace.span("context"):
+            context = assemble_context(docs)
+            messages = build_messages(query, context, chat_history, session_id=session_id)
+            history_manager.record_turn(messages)
         
-        # Add chat history
-        if chat_history:
-            for msg in chat_history:
-                if isinstance(msg, dict) and "role" in msg and "content" in msg:
-                    messages.append(msg)
-        
-        # Adjust user prompt based on whether there's context
-        if context and context.strip():
-            # If there's context, use RAG mode
-            user_prompt = f"""Answer the question based on the following context if relevant:
-{context}
-
-Question: {query}
+        # Wait for a generation slot; it is held until the stream is finished
+        with admission_controller.admit(session_id, on_wait=queue_callback) as admission:
+            record_admission(trace, admission)
+            if admission.no_think:
+                messages = with_no_think(messages)
 
-If the context provides relevant information, use it to answer accurately. If not, you can use your own knowledge."""
-        else:
-            # If there's no context, use normal conversation mode
-            user_prompt = query
-        
-        # Handle no-think mode
-        no_think_prefix = "/no_think\n" if Config.NO_THINK_MODE else ""
-        user_prompt = no_think_prefix + user_prompt
-        
-        # Add current query
-        messages.append({"role": "user", "content": user_prompt})
-        
-        # Call vLLM API with streaming
-        response = client.chat.completions.create(
-            model=Config.VLLM_MODEL_NAME,
-            messages=messages,
-            max_tokens=Config.MAX_TOKENS,
-            temperature=Config.TEMPERATURE,
-            stream=True
-        )
+            # Call vLLM API with streaming (the last chunk reports the token usage)
+            generation_started = time.perf_counter()
+            response = client.chat.completions.create(
+                model=Config.VLLM_MODEL_NAME,
+                messages=messages,
+                max_tokens=admission.max_tokens,
+                temperature=Config.TEMPERATURE,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
         
-        # Process streaming response - first collect full response, then clean and output
-        # This avoids garbled characters caused by backspace characters
-        full_response = ""
-        for chunk in response:
-            if chunk.choices[0].delta.content is not None:
-                delta_content = chunk.choices[0].delta.content
-                full_response += delta_content
-                # Stream output raw content in real-time
-                yield delta_content
+            # Drop think blocks as the deltas arrive, holding back partial tags
+            think_filter = ThinkFilter()
+            full_response = ""
+            first_token = first_visible = None
+            usage = None
+            generated_chunks = 0
+            for chunk in response:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    generated_chunks += 1
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                        trace.mark("first_token")
+                    visible = think_filter.feed(chunk.choices[0].delta.content)
+                    if visible:
+                        if first_visible is None:
+                            first_visible = time.perf_counter() - started
+                        full_response += visible
+                        yield visible
+            visible = think_filter.flush()
+            if visible:
+                full_response += visible
+                yield visible
+        stream_stats.record(first_token, first_visible)
+        finished = time.perf_counter()
+        trace.add_span("generation", finished - generation_started)
+        if first_token is not None:
+            record_generation(trace, usage, generated_chunks, finished - started - first_token)
         
-        # Note: If thought block cleaning is needed, it should be done after collecting full response
-        # But to maintain the continuity of streaming output, we choose to stream output raw content directly
+        # Only complete, non-degraded answers are cached
+        if Config.SEMANTIC_CACHE_ENABLED and full_response and not admission.degraded:
+            query_cache.put_answer(embedding, full_response, version, answer_scope(query, chat_history))
+        trace.finish()
     except Exception as e:
+        trace.finish("error")
         yield f"Error generating response: {str(e)}"
\ No newline at end of file
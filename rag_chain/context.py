@@ -0,0 +1,165 @@
+import threading
+from collections import deque
+from config import Config
+from utils.helpers import format_docs
+from utils.tokens import count_tokens
+
+
+class ContextStats:
+    """Records how many prompt tokens context compaction saved per query."""
+    def __init__(self, window=1000):
+        """Initialize the recorder.
+
+        Args:
+            window (int): Number of recent queries kept.
+        """
+        self.recent = deque(maxlen=window)
+        self.queries = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def record(self, original_tokens, compacted_tokens):
+        """Record the context size of one query before and after compaction."""
+        with self._lock:
+            self.queries += 1
+            self.tokens_saved += original_tokens - compacted_tokens
+            self.recent.append({
+                "original_tokens": original_tokens,
+                "compacted_tokens": compacted_tokens,
+                "tokens_saved": original_tokens - compacted_tokens
+            })
+
+    def snapshot(self):
+        """Return the totals and the numbers of the most recent query."""
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "tokens_saved": self.tokens_saved,
+                "avg_tokens_saved": self.tokens_saved / self.queries if self.queries else 0.0,
+                "last": self.recent[-1] if self.recent else None
+            }
+
+
+context_stats = ContextStats()
+
+# Characters per token of Latin text, as assumed by ``estimate_tokens``
+CHARS_PER_TOKEN = 4
+
+
+def _overlap_length(left, right, max_overlap):
+    """Return the length of the longest suffix of ``left`` that is a prefix of ``right``."""
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _max_overlap():
+    """Return the longest overlap in characters searched between unpositioned chunks."""
+    if Config.SPLIT_UNIT == "tokens":
+        return max(Config.CHUNK_OVERLAP_TOKENS * CHARS_PER_TOKEN * 2, 1)
+    return max(Config.CHUNK_OVERLAP * 2, 1)
+
+
+def merge_chunks(docs):
+    """Merge chunks from the same page into contiguous spans.
+
+    Chunks are grouped by file and page. Within a group, chunks whose text
+    positions (``start_index`` metadata) are contiguous or overlapping are joined
+    and the duplicated overlap is removed, provided the text confirms it. Chunks
+    without positions, or whose positions disagree with their text, are merged
+    when the end of one repeats the start of the next.
+
+    Args:
+        docs (list): Documents in relevance order.
+
+    Returns:
+        list: Merged text spans, ordered by the rank of their best chunk.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        metadata = doc.metadata or {}
+        key = (metadata.get("file_id", metadata.get("source")), metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    max_overlap = _max_overlap()
+    spans = []
+    for members in groups.values():
+        best_rank = members[0][0]
+        positioned = all("start_index" in (doc.metadata or {}) for _, doc in members)
+        if positioned:
+            members = sorted(members, key=lambda member: member[1].metadata["start_index"])
+        current_text, current_end = None, None
+        for _, doc in members:
+            text = doc.page_content
+            start = doc.metadata.get("start_index") if positioned else None
+            if current_text is None:
+                current_text, current_end = text, (start + len(text) if positioned else None)
+                continue
+            adjacent = positioned and start <= current_end + 1
+            if adjacent:
+                # Contiguous or overlapping: append only the part not already included
+                overlap = max(current_end - start, 0)
+                if overlap >= len(text) and text in current_text:
+                    continue
+                if overlap < len(text) and current_text.endswith(text[:overlap]):
+                    # A one-character gap is whitespace stripped by the splitter
+                    separator = " " if start > current_end else ""
+                    current_text += separator + text[overlap:]
+                    current_end = start + len(text)
+                    continue
+                # The positions do not match the text: merge on the text alone
+            if adjacent or not positioned:
+                if text in current_text:
+                    continue
+                overlap = _overlap_length(current_text, text, max_overlap)
+                if overlap >= min(8, len(text)):
+                    current_text += text[overlap:]
+                    if positioned:
+                        current_end = start + len(text)
+                    continue
+            spans.append((best_rank, current_text))
+            current_text, current_end = text, (start + len(text) if positioned else None)
+        spans.append((best_rank, current_text))
+    spans.sort(key=lambda span: span[0])
+    return [text for _, text in spans]
+
+
+def assemble_context(docs, token_budget=None):
+    """Build the prompt context from retrieved documents.
+
+    Overlapping and adjacent chunks of the same page are merged, duplicated
+    text is removed and spans are added in relevance order until the token
+    budget is used up (the first span is truncated if it alone exceeds it).
+    The number of tokens saved compared to ``format_docs`` is recorded in
+    ``context_stats``.
+
+    Args:
+        docs (list): Documents in relevance order.
+        token_budget (int, optional): Maximum context tokens, defaults to
+            ``Config.CONTEXT_TOKEN_BUDGET``.
+
+    Returns:
+        str: Context text with spans separated by double newlines.
+    """
+    if not Config.CONTEXT_COMPACTION:
+        return format_docs(docs)
+    token_budget = Config.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+
+    selected = []
+    used = 0
+    for span in merge_chunks(docs):
+        tokens = count_tokens(span)
+        if used + tokens > token_budget:
+            if not selected and token_budget > 0:
+                # Keep at least the most relevant span, cut to the budget
+                span = span[:max(1, len(span) * token_budget // tokens)]
+                selected.append(span)
+                used += count_tokens(span)
+            continue
+        selected.append(span)
+        used += tokens
+
+    context = "\n\n".join(selected)
+    context_stats.record(count_tokens(format_docs(docs)), count_tokens(context))
+    return context
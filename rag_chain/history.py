@@ -0,0 +1,218 @@
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+from config import Config, get_llm_client
+from utils.tokens import count_tokens
+from utils.admission import admission_controller
+from utils.stream_filter import strip_think
+
+# Approximate chat template overhead (role markers, separators) per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """Summarize the following conversation between a user and an assistant in a few sentences.
+Keep names, numbers, drugs and other facts the user may refer back to. Reply with the summary only.
+
+{conversation}"""
+
+
+@lru_cache(maxsize=4096)
+def _message_tokens(content, tokenizer_path):
+    return count_tokens(content, tokenizer_path) + MESSAGE_OVERHEAD_TOKENS
+
+
+def message_tokens(content):
+    """Return the token count of one chat message, including template overhead.
+
+    Counts are cached per tokenizer, so changing ``Config.TOKENIZER_PATH``
+    does not reuse counts of the previous one.
+
+    Args:
+        content (str): Message content.
+
+    Returns:
+        int: Number of tokens.
+    """
+    return _message_tokens(content, Config.TOKENIZER_PATH)
+
+
+def count_message_tokens(messages):
+    """Return the token count of a list of chat messages.
+
+    Args:
+        messages (list): Message dicts with ``role`` and ``content``.
+
+    Returns:
+        int: Number of tokens.
+    """
+    return sum(message_tokens(msg["content"]) for msg in messages)
+
+
+def summarize_messages(messages, previous_summary="", session_id=None):
+    """Fold conversation turns into a short summary with the chat model.
+
+    The call waits for a generation slot like any other request to the model.
+
+    Args:
+        messages (list): Message dicts to summarize, oldest first.
+        previous_summary (str): Summary of the turns before ``messages``.
+        session_id (str, optional): Session the summary is made for.
+
+    Returns:
+        str: The updated summary.
+    """
+    lines = []
+    if previous_summary:
+        lines.append(f"Earlier conversation: {previous_summary}")
+    lines.extend(f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages)
+    with admission_controller.admit(session_id):
+        response = get_llm_client().chat.completions.create(
+            model=Config.VLLM_MODEL_NAME,
+            messages=[
+                {"role": "user", "content": "/no_think\n" + SUMMARY_PROMPT.format(conversation="\n".join(lines))}
+            ],
+            max_tokens=Config.HISTORY_SUMMARY_MAX_TOKENS,
+            temperature=0
+        )
+    return strip_think(response.choices[0].message.content).strip()
+
+
+class ChatHistoryManager:
+    """Fit the chat history of a conversation into a token budget.
+
+    The most recent turns are kept verbatim as long as they fit into the budget.
+    Older turns are folded into a rolling summary, which is cached by the turns
+    it covers: it is only extended when further turns fall out of the window, so
+    the summarization call is not repeated on every question.
+    """
+    def __init__(self, max_summaries=1000, window=1000):
+        """Initialize the manager.
+
+        Args:
+            max_summaries (int): Maximum number of cached summaries.
+            window (int): Number of recent turns kept for statistics.
+        """
+        self.max_summaries = max_summaries
+        self._summaries = OrderedDict()
+        self._turns = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.summary_calls = 0
+        self.summary_hits = 0
+
+    @staticmethod
+    def _prefix_keys(messages):
+        # Rolling hashes identifying every prefix of the folded turns
+        digest = hashlib.sha256()
+        keys = []
+        for msg in messages:
+            digest.update(f"{msg['role']}\0{msg['content']}\0".encode("utf-8"))
+            keys.append(digest.copy().hexdigest())
+        return keys
+
+    def _get_summary(self, folded, session_id=None):
+        keys = self._prefix_keys(folded)
+        with self._lock:
+            # Longest already summarized prefix of the folded turns
+            covered, summary = 0, ""
+            for index in range(len(keys) - 1, -1, -1):
+                if keys[index] in self._summaries:
+                    covered, summary = index + 1, self._summaries[keys[index]]
+                    self._summaries.move_to_end(keys[index])
+                    break
+            if covered == len(folded):
+                self.summary_hits += 1
+                return summary
+            self.summary_calls += 1
+
+        summary = summarize_messages(folded[covered:], summary, session_id)
+        with self._lock:
+            self._summaries[keys[-1]] = summary
+            while len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def window(self, chat_history, query=None, token_budget=None, session_id=None):
+        """Select the history messages to send with the current question.
+
+        Args:
+            chat_history (list): Previous messages in the conversation.
+            query (str, optional): The current question. A trailing user message
+                with the same content is the current turn and is dropped.
+            token_budget (int, optional): Maximum history tokens, defaults to
+                ``Config.HISTORY_TOKEN_BUDGET``.
+            session_id (str, optional): Session of the caller, which waits for
+                a generation slot if older turns have to be summarized.
+
+        Returns:
+            tuple: Summary of the folded older turns (empty if none were folded)
+            and the recent message dicts kept verbatim.
+        """
+        token_budget = Config.HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+        messages = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in chat_history or []
+            if isinstance(msg, dict) and "role" in msg and "content" in msg
+        ]
+        if messages and messages[-1]["role"] == "user" and messages[-1]["content"] == query:
+            messages.pop()
+
+        if count_message_tokens(messages) <= token_budget:
+            return "", messages
+
+        # Reserve room for the summary, then keep the newest turns that fit
+        budget = token_budget
+        if Config.HISTORY_SUMMARY_ENABLED:
+            budget -= Config.HISTORY_SUMMARY_MAX_TOKENS + MESSAGE_OVERHEAD_TOKENS
+        start = len(messages)
+        used = 0
+        while start > 0 and used + message_tokens(messages[start - 1]["content"]) <= budget:
+            start -= 1
+            used += message_tokens(messages[start]["content"])
+        # Never start the window with an orphaned assistant reply
+        while start < len(messages) and messages[start]["role"] == "assistant":
+            start += 1
+
+        recent = messages[start:]
+        if not Config.HISTORY_SUMMARY_ENABLED or start == 0:
+            return "", recent
+        try:
+            return self._get_summary(messages[:start], session_id), recent
+        except Exception as e:
+            print(f"Error summarizing chat history, dropping older turns: {e}")
+            return "", recent
+
+    def record_turn(self, messages):
+        """Record the prompt size of one turn.
+
+        Args:
+            messages (list): Complete message list sent to the model.
+
+        Returns:
+            int: Prompt tokens of the turn.
+        """
+        prompt_tokens = count_message_tokens(messages)
+        with self._lock:
+            self._turns.append({"prompt_tokens": prompt_tokens, "messages": len(messages)})
+        return prompt_tokens
+
+    def stats(self):
+        """Return per-turn prompt sizes and summary cache counters.
+
+        Returns:
+            dict: Prompt tokens of the last turn, average and maximum prompt
+            tokens of the recent turns, and summary calls/hits.
+        """
+        with self._lock:
+            tokens = [turn["prompt_tokens"] for turn in self._turns]
+            return {
+                "turns": len(tokens),
+                "last_turn": self._turns[-1] if self._turns else None,
+                "avg_prompt_tokens": sum(tokens) / len(tokens) if tokens else 0.0,
+                "max_prompt_tokens": max(tokens) if tokens else 0,
+                "summary_calls": self.summary_calls,
+                "summary_hits": self.summary_hits,
+            }
+
+
+# Create global history manager instance
+history_manager = ChatHistoryManager()
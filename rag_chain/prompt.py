@@ -0,0 +1,122 @@
+from config import Config
+from rag_chain.history import history_manager
+
+# Message layout (vLLM automatic prefix caching reuses the KV cache of the
+# longest byte-identical prefix, so the most stable parts come first):
+#   1. system instructions          - identical for every request
+#   2. no-think directive           - identical for every request in the same mode
+#   3. summary of earlier turns     - stable until more turns are folded
+#   4. conversation history         - append-only within a conversation
+#   5. retrieved context + question - different for every request
+
+# System instructions of the streaming conversation
+SYSTEM_PROMPT = """You are a highly knowledgeable assistant.
+Questions may come with context retrieved from the user's documents.
+If the context provides relevant information, use it to answer accurately. If not, you can use your own knowledge."""
+
+# System instructions of the single-question chain
+RAG_SYSTEM_PROMPT = """You are a highly knowledgeable assistant.
+Answer the question based only on the context provided with it.
+Use the provided context to answer the user's question accurately and concisely.
+Don't justify your answers.
+Don't give information not mentioned in the CONTEXT INFORMATION.
+Do not say "according to the context" or "mentioned in the context" or similar."""
+
+NO_THINK_DIRECTIVE = "/no_think"
+
+
+def build_system_message(strict=False):
+    """Build the system message, which is identical across requests.
+
+    Args:
+        strict (bool): Use the instructions of the single-question chain, which
+            answers from the retrieved context only.
+
+    Returns:
+        dict: System message.
+    """
+    content = RAG_SYSTEM_PROMPT if strict else SYSTEM_PROMPT
+    # Handle no-think mode
+    if Config.NO_THINK_MODE:
+        content += "\n" + NO_THINK_DIRECTIVE
+    return {"role": "system", "content": content}
+
+
+def with_no_think(messages):
+    """Return the messages with the no-think directive added to the system message.
+
+    Used to switch a single request to no-think mode after its prompt was
+    built, e.g. when the admission controller degrades it under load.
+
+    Args:
+        messages (list): Messages built by ``build_messages``.
+
+    Returns:
+        list: A copy of the messages; unchanged if the directive is already present.
+    """
+    system = messages[0]
+    if system["role"] != "system" or system["content"].endswith(NO_THINK_DIRECTIVE):
+        return messages
+    return [{**system, "content": system["content"] + "\n" + NO_THINK_DIRECTIVE}] + messages[1:]
+
+
+def build_history_messages(chat_history=None, query=None, strict=False, session_id=None):
+    """Build the stable part of the conversation: system message and chat history.
+
+    The history is windowed by ``history_manager``: the newest turns that fit
+    into ``Config.HISTORY_TOKEN_BUDGET`` are sent verbatim and older turns are
+    replaced by a summary, which follows the system message.
+
+    Args:
+        chat_history (list, optional): List of previous messages in the conversation.
+        query (str, optional): The current question, dropped from the end of the history.
+        strict (bool): Use the instructions of the single-question chain.
+        session_id (str, optional): Session of the caller, the unit of fairness
+            if older turns have to be summarized.
+
+    Returns:
+        list: Message dicts, to which the current user message is appended.
+    """
+    messages = [build_system_message(strict)]
+    summary, recent = history_manager.window(chat_history, query, session_id=session_id)
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    messages.extend(recent)
+    return messages
+
+
+def build_user_message(query, context):
+    """Build the current user message, the only part that changes on every request.
+
+    Args:
+        query (str): The user's question.
+        context (str): Formatted retrieved context, may be empty.
+
+    Returns:
+        dict: User message with the context followed by the question.
+    """
+    if not (context and context.strip()):
+        # Nothing relevant was retrieved: plain chat with the bare question
+        return {"role": "user", "content": query}
+    return {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
+
+
+def build_messages(query, context, chat_history=None, strict=False, session_id=None):
+    """Build the complete message list for one request.
+
+    Args:
+        query (str): The user's question.
+        context (str): Formatted retrieved context, may be empty.
+        chat_history (list, optional): List of previous messages in the conversation.
+        strict (bool): Use the instructions of the single-question chain if
+            there is context to answer from.
+        session_id (str, optional): Session of the caller, the unit of fairness
+            if older turns have to be summarized.
+
+    Returns:
+        list: Message dicts in prefix-cache-friendly order.
+    """
+    strict = strict and bool(context and context.strip())
+    messages = build_history_messages(chat_history, query, strict, session_id)
+    messages.append(build_user_message(query, context))
+    return messages
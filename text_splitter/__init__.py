@@ -1,3 +1,3 @@
-from .splitter import create_recursive_splitter, split_documents
+from .splitter import create_recursive_splitter, split_documents, splitter_settings
 
-__all__ = ['create_recursive_splitter', 'split_documents']
\ No newline at end of file
+__all__ = ['create_recursive_splitter', 'split_documents', 'splitter_settings']
\ No newline at end of file
@@ -1,28 +1,92 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from config import Config
+from utils.tokens import get_tokenizer, estimate_tokens
 
+SEPARATORS = ["\n\n", "\n", "。", ". ", " ", ""]
 
-def create_recursive_splitter():
+
+def get_length_function(unit=None, tokenizer_path=None):
+    """Return the function measuring chunk length for a split unit.
+
+    Args:
+        unit (str, optional): ``"chars"`` or ``"tokens"``, defaults to ``Config.SPLIT_UNIT``.
+        tokenizer_path (str, optional): Tokenizer for ``"tokens"``, defaults to
+            ``Config.EMBEDDING_TOKENIZER_PATH`` (then ``Config.TOKENIZER_PATH``).
+
+    Returns:
+        callable: Maps a text to its length.
+    """
+    if (unit or Config.SPLIT_UNIT) != "tokens":
+        return len
+    # The tokenizer is loaded once per process and reused for every chunk
+    tokenizer = get_tokenizer(tokenizer_path or Config.EMBEDDING_TOKENIZER_PATH or Config.TOKENIZER_PATH)
+    if tokenizer is None:
+        return estimate_tokens
+
+    def count(text):
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return count
+
+
+def splitter_settings():
+    """Return the current splitter configuration as plain values.
+
+    Ingest worker processes do not see configuration changed at runtime, so the
+    settings are passed to them explicitly.
+
+    Returns:
+        dict: Keyword arguments for ``create_recursive_splitter``.
+    """
+    tokens = Config.SPLIT_UNIT == "tokens"
+    return {
+        "chunk_size": Config.CHUNK_TOKENS if tokens else Config.CHUNK_SIZE,
+        "chunk_overlap": Config.CHUNK_OVERLAP_TOKENS if tokens else Config.CHUNK_OVERLAP,
+        "unit": Config.SPLIT_UNIT,
+        "tokenizer_path": Config.EMBEDDING_TOKENIZER_PATH or Config.TOKENIZER_PATH,
+    }
+
+
+def create_recursive_splitter(chunk_size=None, chunk_overlap=None, unit=None, tokenizer_path=None):
     """Create a RecursiveCharacterTextSplitter with predefined settings.
-    
+
+    In ``"tokens"`` mode chunk sizes are measured with the embedding model's
+    tokenizer (estimated without one), so chunks of Chinese and English text
+    are packed close to the same token budget instead of the same length in
+    characters.
+
+    Args:
+        chunk_size (int, optional): Chunk size, defaults to ``Config.CHUNK_SIZE``
+            (``Config.CHUNK_TOKENS`` in ``"tokens"`` mode).
+        chunk_overlap (int, optional): Chunk overlap, defaults to ``Config.CHUNK_OVERLAP``
+            (``Config.CHUNK_OVERLAP_TOKENS`` in ``"tokens"`` mode).
+        unit (str, optional): ``"chars"`` or ``"tokens"``, defaults to ``Config.SPLIT_UNIT``.
+        tokenizer_path (str, optional): Tokenizer used in ``"tokens"`` mode.
+
     Returns:
         RecursiveCharacterTextSplitter: Configured text splitter.
     """
+    unit = unit or Config.SPLIT_UNIT
+    tokens = unit == "tokens"
+    if chunk_size is None:
+        chunk_size = Config.CHUNK_TOKENS if tokens else Config.CHUNK_SIZE
+    if chunk_overlap is None:
+        chunk_overlap = Config.CHUNK_OVERLAP_TOKENS if tokens else Config.CHUNK_OVERLAP
     return RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", "。", ". ", " ", ""],
-        chunk_size=Config.CHUNK_SIZE,
-        chunk_overlap=Config.CHUNK_OVERLAP,
-        length_function=len,
+        separators=SEPARATORS,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=get_length_function(unit, tokenizer_path),
+        add_start_index=True,  # Lets context compaction merge adjacent chunks
     )
 
 
 def split_documents(splitter, documents):
     """Split documents into smaller chunks.
-    
+
     Args:
         splitter: The text splitter to use.
         documents (list): List of document objects to split.
-        
+
     Returns:
         list: List of document chunks.
     """
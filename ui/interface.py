@@ -1,5 +1,7 @@
 import sys
 import os
+import time
+import uuid
 
 # Add project root directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -8,15 +10,24 @@ import streamlit as st
 from rag_chain.chain import run_rag_chain_stream
 from vector_db.add_documents import add_to_db
 from vector_db.chroma_db import delete_documents_by_file_id
-from config import Config
+from config import Config, get_catalog
+from utils.http_client import latency_stats
+from utils.batcher import embed_batcher
+from utils.reranker import reranker
+from rag_chain.adaptive import adaptive_stats
+from rag_chain.context import context_stats
+from rag_chain.history import history_manager
+from utils.stream_filter import stream_stats
+from utils.metrics import stage_averages
+from utils.admission import admission_controller
 
 # Initialize chat history
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 
-# Initialize uploaded files list
-if 'uploaded_files' not in st.session_state:
-    st.session_state.uploaded_files = []
+# Identify the browser session, the unit of fairness when queries queue for the model
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 
 def render_main_page():
@@ -46,14 +57,29 @@ def render_main_page():
         # Display assistant response
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
-                # Create placeholder for streaming output
+                # Create placeholders for the queue position and the streaming output
+                queue_placeholder = st.empty()
                 message_placeholder = st.empty()
                 full_response = ""
+
+                def show_queue(position, waited):
+                    queue_placeholder.caption(f"Waiting for the model: position {position + 1} in queue · "
+                                              f"{waited:.0f} s")
                 
-                # Get streaming response with chat history
-                for chunk in run_rag_chain_stream(query=prompt, chat_history=st.session_state.chat_history):
+                # Get streaming response with chat history. Tokens are coalesced
+                # and the message is repainted at most UI_REFRESH_RATE times per second
+                frame_interval = 1.0 / Config.UI_REFRESH_RATE
+                last_paint = 0.0
+                for chunk in run_rag_chain_stream(query=prompt, chat_history=st.session_state.chat_history,
+                                                  session_id=st.session_state.session_id,
+                                                  queue_callback=show_queue):
+                    if not full_response:
+                        queue_placeholder.empty()
                     full_response += chunk
-                    message_placeholder.markdown(full_response + "▌")
+                    now = time.monotonic()
+                    if now - last_paint >= frame_interval:
+                        message_placeholder.markdown(full_response + "▌")
+                        last_paint = now
                 
                 # Display final response
                 message_placeholder.markdown(full_response)
@@ -76,6 +102,57 @@ def render_sidebar():
             Config.NO_THINK_MODE = no_thought_mode
             st.success(f"No-Thought Mode {'enabled' if no_thought_mode else 'disabled'}")
         
+        # Per-endpoint latency of the shared HTTP clients
+        with st.expander("Endpoint latency"):
+            endpoint_stats = latency_stats.snapshot()
+            if endpoint_stats:
+                for endpoint, stats in endpoint_stats.items():
+                    st.caption(f"{endpoint}: {stats['count']} requests, {stats['errors']} errors · "
+                               f"p50 {stats['p50'] * 1000:.0f} ms · p95 {stats['p95'] * 1000:.0f} ms")
+            else:
+                st.caption("No requests yet.")
+            # Cross-session micro-batching of query embeddings and rerank calls
+            for name, batcher in (("embed", embed_batcher), ("rerank", reranker.batcher)):
+                stats = batcher.stats()
+                if stats["batches"]:
+                    st.caption(f"{name} batching: avg batch {stats['avg_batch_size']:.1f} · "
+                               f"p95 queue delay {stats['p95_queue_delay'] * 1000:.1f} ms")
+            # Adaptive retrieval decisions and the rerank time they saved
+            if Config.ADAPTIVE_RETRIEVAL:
+                adaptive = adaptive_stats.snapshot()
+                st.caption("Adaptive retrieval: " + ", ".join(
+                    f"{name} {count}" for name, count in adaptive["decisions"].items()
+                ) + f" · rerank time saved {adaptive['rerank_seconds_saved']:.2f} s")
+            # Prompt tokens saved by merging overlapping chunks
+            if Config.CONTEXT_COMPACTION:
+                compaction = context_stats.snapshot()
+                if compaction["queries"]:
+                    st.caption(f"Context compaction: {compaction['tokens_saved']} tokens saved · "
+                               f"avg {compaction['avg_tokens_saved']:.1f} per query")
+            # Time until the first token and the first visible (non-think) token
+            streaming = stream_stats.snapshot()
+            if streaming["first_visible"]["count"]:
+                st.caption(f"Time to first token: p50 {streaming['first_token']['p50'] * 1000:.0f} ms · "
+                           f"first visible token: p50 {streaming['first_visible']['p50'] * 1000:.0f} ms, "
+                           f"p95 {streaming['first_visible']['p95'] * 1000:.0f} ms")
+            # Generation requests in flight and waiting for a slot (also exported at /metrics)
+            generation = admission_controller.stats()
+            st.caption(f"LLM queue: {generation['in_flight']}/{generation['limit']} in flight · "
+                       f"{generation['queue_depth']} waiting · p95 wait {generation['p95_wait']:.1f} s · "
+                       f"{generation['degraded']} degraded · {generation['timeouts']} timed out")
+            # Average time per query stage (also exported at /metrics)
+            stages = stage_averages("query")
+            if stages:
+                st.caption("Query stages (avg): " + " · ".join(
+                    f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in stages.items()
+                ))
+            # Prompt size per turn after windowing the chat history
+            history = history_manager.stats()
+            if history["last_turn"]:
+                st.caption(f"Prompt tokens: last turn {history['last_turn']['prompt_tokens']} · "
+                           f"avg {history['avg_prompt_tokens']:.0f} · max {history['max_prompt_tokens']} · "
+                           f"{history['summary_calls']} history summaries")
+        
         # Chat history management
         if st.button("Clear Chat History"):
             st.session_state.chat_history = []
@@ -89,13 +166,24 @@ def render_sidebar():
                                     accept_multiple_files=True
         )
         
+        replace = st.checkbox("Replace files with the same name",
+                              help="Upload a revised version of a file that is already in the knowledge base")
         if st.button("Submit & Process"):
             if not pdf_docs:
                 st.warning("Please upload the file")
             else:
                 with st.spinner("Processing your documents..."):
-                    add_to_db(pdf_docs)
-                    st.success(":file_folder: Documents successfully added to the database!")
+                    # Show per-stage throughput while the ingestion pipeline runs
+                    progress_placeholder = st.empty()
+                    stats = add_to_db(pdf_docs, progress_callback=lambda s: progress_placeholder.caption(s.summary()),
+                                      replace=replace)
+                    progress_placeholder.caption(stats.summary())
+                    if stats.conflicts:
+                        st.warning(f"Skipped {', '.join(stats.conflicts)}: a different file with the same name is "
+                                   f"already in the knowledge base. Rename the file, or tick 'Replace files with "
+                                   f"the same name' to replace it.")
+                    if stats.total_files:
+                        st.success(":file_folder: Documents successfully added to the database!")
         
         # Uploaded files management
         st.markdown("---")
@@ -111,23 +199,20 @@ def render_sidebar():
             else:
                 return f"{size_bytes/1048576:.2f} MB"
         
-        # Display uploaded files with delete option
-        if st.session_state.uploaded_files:
-            for file in st.session_state.uploaded_files:
+        # Display uploaded files (persisted in the file catalog) with delete option
+        uploaded_files = get_catalog().list_files()
+        if uploaded_files:
+            for file in uploaded_files:
                 col1, col2 = st.columns([3, 1])
                 with col1:
                     st.markdown(f"**{file['name']}**")
-                    st.caption(f"Size: {format_size(file['size'])}")
+                    st.caption(f"Size: {format_size(file['size'])} · Pages: {file['page_count']}")
                     st.caption(f"Upload time: {file['upload_time']}")
                 with col2:
                     if st.button("Delete", key=f"delete_{file['id']}"):
                         # Delete documents from vector database
                         success = delete_documents_by_file_id(file['id'])
                         if success:
-                            # Remove file from session state
-                            st.session_state.uploaded_files = [
-                                f for f in st.session_state.uploaded_files if f['id'] != file['id']
-                            ]
                             st.success(f"Successfully deleted '{file['name']}' and its vectors")
                             # Refresh page to update list
                             st.rerun()
@@ -0,0 +1,277 @@
+import time
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from config import Config
+from utils.metrics import metrics
+
+metrics.define("pharmaquery_llm_in_flight", "gauge", "Generation requests sent to the LLM and not finished")
+metrics.define("pharmaquery_llm_queue_depth", "gauge", "Generation requests waiting for an LLM slot")
+metrics.define("pharmaquery_llm_queue_wait_seconds", "histogram", "Time generation requests waited for an LLM slot")
+metrics.define("pharmaquery_llm_admissions_total", "counter",
+               "Generation requests by admission outcome (admitted, degraded, timeout)")
+
+
+class QueueTimeout(Exception):
+    """Raised when a generation request gets no LLM slot within the queue timeout."""
+
+
+class Admission:
+    """A generation request's place in the admission queue and, once admitted, its slot.
+
+    After admission ``max_tokens`` and ``no_think`` hold the generation
+    settings to use: the configured ones, or the degraded ones if the queue was
+    deep when the request was admitted.
+    """
+    def __init__(self, session, sequence):
+        """Create a waiting request.
+
+        Args:
+            session (str): Session the request belongs to.
+            sequence (int): Arrival order.
+        """
+        self.session = session
+        self.sequence = sequence
+        self.enqueued = time.perf_counter()
+        self.state = "waiting"
+        self.waited = 0.0
+        self.degraded = False
+        self.max_tokens = Config.MAX_TOKENS
+        self.no_think = Config.NO_THINK_MODE
+        self._event = threading.Event()
+        self._loop = None
+        self._future = None
+
+    def _notify(self):
+        """Wake the waiting thread or coroutine (called with the controller lock held).
+
+        Returns:
+            bool: False if the event loop of a waiting coroutine is gone.
+        """
+        self._event.set()
+        if self._future is not None:
+            try:
+                self._loop.call_soon_threadsafe(lambda: self._future.done() or self._future.set_result(None))
+            except RuntimeError:
+                return False
+        return True
+
+
+class AdmissionController:
+    """Process-wide limit on concurrent LLM generation requests with a fair queue.
+
+    At most ``ADMISSION_MAX_IN_FLIGHT`` requests are sent to the model server at
+    once; the rest wait. A free slot goes to the waiting request whose session
+    has the fewest requests in flight, then to the session served least
+    recently (round robin), then to the oldest request, so one busy session or
+    batch run cannot starve the others. Requests that wait longer
+    than ``ADMISSION_QUEUE_TIMEOUT`` give up with :class:`QueueTimeout`. While
+    ``ADMISSION_DEGRADE_QUEUE_DEPTH`` or more requests are waiting, admitted
+    requests are degraded to ``ADMISSION_DEGRADED_MAX_TOKENS`` (and no-think
+    mode), which shortens their turn on the server and drains the queue.
+
+    Synchronous callers (Streamlit sessions, worker threads) and coroutines of
+    any event loop share the same slots.
+    """
+    def __init__(self):
+        """Initialize an empty controller."""
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._active = {}
+        self._in_flight = 0
+        self._sequence = itertools.count()
+        # Admission order of the sessions served most recently
+        self._served = OrderedDict()
+        self._served_count = itertools.count()
+        self.admitted = 0
+        self.degraded = 0
+        self.timeouts = 0
+        self._waits = []
+
+    def _rank(self, admission):
+        return (self._active.get(admission.session, 0), self._served.get(admission.session, -1),
+                admission.sequence)
+
+    def _update_gauges(self):
+        metrics.set("pharmaquery_llm_in_flight", self._in_flight)
+        metrics.set("pharmaquery_llm_queue_depth", len(self._waiting))
+
+    def _dispatch(self):
+        """Hand free slots to the waiting requests (called with the lock held)."""
+        limit = Config.ADMISSION_MAX_IN_FLIGHT
+        while self._waiting and (limit is None or self._in_flight < limit):
+            admission = min(self._waiting, key=self._rank)
+            self._waiting.remove(admission)
+            self._in_flight += 1
+            self._active[admission.session] = self._active.get(admission.session, 0) + 1
+            self._served[admission.session] = next(self._served_count)
+            self._served.move_to_end(admission.session)
+            if len(self._served) > 10000:
+                self._served.popitem(last=False)
+            admission.state = "admitted"
+            admission.waited = time.perf_counter() - admission.enqueued
+            depth = Config.ADMISSION_DEGRADE_QUEUE_DEPTH
+            if depth is not None and len(self._waiting) >= depth:
+                admission.degraded = True
+                admission.max_tokens = min(Config.MAX_TOKENS, Config.ADMISSION_DEGRADED_MAX_TOKENS)
+                admission.no_think = Config.NO_THINK_MODE or Config.ADMISSION_DEGRADE_NO_THINK
+            if not admission._notify():
+                admission.state = "abandoned"
+                self._in_flight -= 1
+                self._release_session(admission.session)
+                continue
+            metrics.observe("pharmaquery_llm_queue_wait_seconds", admission.waited)
+            metrics.inc("pharmaquery_llm_admissions_total", outcome="degraded" if admission.degraded else "admitted")
+            self.admitted += 1
+            self.degraded += admission.degraded
+            self._waits.append(admission.waited)
+            del self._waits[:-1000]
+        self._update_gauges()
+
+    def _release_session(self, session):
+        self._active[session] -= 1
+        if not self._active[session]:
+            del self._active[session]
+
+    def _enqueue(self, session):
+        with self._lock:
+            admission = Admission(session or "default", next(self._sequence))
+            self._waiting.append(admission)
+            self._dispatch()
+        return admission
+
+    def _abandon(self, admission):
+        """Drop a request that stopped waiting; returns True if it still held a slot."""
+        with self._lock:
+            if admission.state == "waiting":
+                self._waiting.remove(admission)
+                admission.state = "abandoned"
+                self._update_gauges()
+                return False
+        return admission.state == "admitted"
+
+    def _timeout(self, admission):
+        with self._lock:
+            self.timeouts += 1
+            waiting = len(self._waiting)
+        metrics.inc("pharmaquery_llm_admissions_total", outcome="timeout")
+        raise QueueTimeout(f"The model is busy: no free slot after {time.perf_counter() - admission.enqueued:.1f}s "
+                           f"({waiting} other requests waiting)")
+
+    def position(self, admission):
+        """Return how many waiting requests go before this one (0 once admitted)."""
+        with self._lock:
+            if admission.state != "waiting":
+                return 0
+            rank = self._rank(admission)
+            return sum(1 for other in self._waiting if self._rank(other) < rank)
+
+    def release(self, admission):
+        """Free the slot of an admitted request and admit the next waiting one."""
+        with self._lock:
+            if admission.state != "admitted":
+                return
+            admission.state = "released"
+            self._in_flight -= 1
+            self._release_session(admission.session)
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, session=None, timeout=None, on_wait=None, poll_interval=0.5):
+        """Wait for a generation slot in the calling thread.
+
+        Args:
+            session (str, optional): Session of the request, the unit of fairness.
+            timeout (float, optional): Seconds to wait, defaults to ``Config.ADMISSION_QUEUE_TIMEOUT``.
+            on_wait (callable, optional): Called with ``(position, waited_seconds)``
+                every ``poll_interval`` seconds while the request waits.
+            poll_interval (float): Seconds between ``on_wait`` calls.
+
+        Yields:
+            Admission: The admitted request with its generation settings.
+
+        Raises:
+            QueueTimeout: If no slot was free within the timeout.
+        """
+        timeout = Config.ADMISSION_QUEUE_TIMEOUT if timeout is None else timeout
+        admission = self._enqueue(session)
+        try:
+            deadline = admission.enqueued + timeout
+            while not admission._event.wait(max(0.0, min(poll_interval, deadline - time.perf_counter()))):
+                if time.perf_counter() >= deadline:
+                    if self._abandon(admission):
+                        break
+                    self._timeout(admission)
+                if on_wait:
+                    on_wait(self.position(admission), time.perf_counter() - admission.enqueued)
+        except BaseException:
+            if self._abandon(admission):
+                self.release(admission)
+            raise
+        try:
+            yield admission
+        finally:
+            self.release(admission)
+
+    @asynccontextmanager
+    async def aadmit(self, session=None, timeout=None):
+        """Wait for a generation slot without blocking the event loop.
+
+        Args:
+            session (str, optional): Session of the request, the unit of fairness.
+            timeout (float, optional): Seconds to wait, defaults to ``Config.ADMISSION_QUEUE_TIMEOUT``.
+
+        Yields:
+            Admission: The admitted request with its generation settings.
+
+        Raises:
+            QueueTimeout: If no slot was free within the timeout.
+        """
+        timeout = Config.ADMISSION_QUEUE_TIMEOUT if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            admission = Admission(session or "default", next(self._sequence))
+            admission._loop, admission._future = loop, future
+            self._waiting.append(admission)
+            self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(admission):
+                self._timeout(admission)
+        except BaseException:
+            if self._abandon(admission):
+                self.release(admission)
+            raise
+        try:
+            yield admission
+        finally:
+            self.release(admission)
+
+    def stats(self):
+        """Return the current load and the admission counters.
+
+        Returns:
+            dict: ``in_flight``, ``limit``, ``queue_depth``, ``admitted``,
+            ``degraded``, ``timeouts`` and the p50/p95 queue wait of recent requests.
+        """
+        with self._lock:
+            waits = sorted(self._waits)
+            result = {
+                "in_flight": self._in_flight,
+                "limit": Config.ADMISSION_MAX_IN_FLIGHT,
+                "queue_depth": len(self._waiting),
+                "admitted": self.admitted,
+                "degraded": self.degraded,
+                "timeouts": self.timeouts,
+            }
+        for name, fraction in (("p50_wait", 0.50), ("p95_wait", 0.95)):
+            result[name] = waits[min(len(waits) - 1, int(fraction * len(waits)))] if waits else 0.0
+        return result
+
+
+# Create global admission controller instance
+admission_controller = AdmissionController()
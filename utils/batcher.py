@@ -0,0 +1,173 @@
+import time
+import queue
+import threading
+from collections import deque, Counter
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from config import Config, get_embedding_model
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item requests into batched calls.
+
+    Callers submit one item and get a future back. A background thread collects
+    items until ``max_batch_size`` is reached or the oldest item has waited
+    ``max_wait_ms``, then hands the batch to ``handler`` (which must return one
+    result per item, in order) and fans the results back out to the futures.
+    """
+    def __init__(self, name, handler, max_batch_size=32, max_wait_ms=5, max_in_flight=4):
+        """Initialize the batcher. The dispatcher thread starts on first use.
+
+        Args:
+            name (str): Name used for threads and statistics.
+            handler (callable): Takes a list of items and returns a list of results.
+            max_batch_size (int): Maximum number of items per batched call.
+            max_wait_ms (float): Maximum time an item waits for others to join its batch.
+            max_in_flight (int): Maximum number of batched calls running at once.
+        """
+        self.name = name
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_in_flight = max_in_flight
+        self._queue = queue.Queue()
+        self._thread = None
+        self._executor = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_delays = deque(maxlen=1000)
+        self._items = 0
+        self._batches = 0
+        self._errors = 0
+
+    def submit(self, item):
+        """Queue an item for the next batch.
+
+        Args:
+            item: Item passed (within a list) to the handler.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the handler's result for this item.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def call(self, item, timeout=None):
+        """Submit an item and wait for its result in the calling thread.
+
+        Args:
+            item: Item passed (within a list) to the handler.
+            timeout (float, optional): Seconds to wait, defaults to ``Config.REQUEST_DEADLINE``.
+
+        Returns:
+            The handler's result for this item.
+
+        Raises:
+            TimeoutError: If the result is not ready within the timeout; the
+                item is dropped if its batch has not been dispatched yet.
+        """
+        future = self.submit(item)
+        try:
+            return future.result(timeout=Config.REQUEST_DEADLINE if timeout is None else timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"{self.name} batch did not finish within the deadline") from None
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                                    thread_name_prefix=f"{self.name}-batch")
+                self._thread = threading.Thread(target=self._collect, name=f"{self.name}-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            # The window starts when the oldest item was submitted, so a backlog
+            # is dispatched immediately
+            deadline = batch[0][2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        now = time.perf_counter()
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._queue_delays.extend(now - submitted for _, _, submitted in batch)
+        try:
+            results = list(self.handler([item for item, _, _ in batch]))
+        except Exception as e:
+            with self._stats_lock:
+                self._errors += 1
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+        # A short result list must not leave the remaining callers waiting
+        if len(results) < len(batch):
+            with self._stats_lock:
+                self._errors += 1
+            error = ValueError(f"{self.name} handler returned {len(results)} results for {len(batch)} items")
+            for _, future, _ in batch[len(results):]:
+                future.set_exception(error)
+
+    def stats(self):
+        """Return batching statistics.
+
+        Returns:
+            dict: Batch and item counts, average batch size, batch size histogram
+            and queue delay (time between submit and dispatch) in seconds.
+        """
+        with self._stats_lock:
+            delays = sorted(self._queue_delays)
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_delay": sum(delays) / len(delays) if delays else 0.0,
+                "p95_queue_delay": delays[min(len(delays) - 1, int(0.95 * len(delays)))] if delays else 0.0,
+                "max_queue_delay": delays[-1] if delays else 0.0,
+            }
+
+
+def _embed_batch(texts):
+    return get_embedding_model().embed_documents(texts)
+
+
+# Coalesces the single-query embedding requests of concurrent sessions
+embed_batcher = MicroBatcher(
+    "embed",
+    _embed_batch,
+    max_batch_size=Config.MICRO_BATCH_MAX_SIZE,
+    max_wait_ms=Config.MICRO_BATCH_WINDOW_MS
+)
+
+
+def embed_query(query):
+    """Embed a query, sharing the embedding request with concurrent queries.
+
+    Args:
+        query (str): Query text.
+
+    Returns:
+        list: Embedding vector.
+    """
+    if not Config.MICRO_BATCH_ENABLED:
+        return get_embedding_model().embed_query(query)
+    return embed_batcher.call(query)
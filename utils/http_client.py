@@ -0,0 +1,197 @@
+import time
+import threading
+from collections import deque
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class LatencyStats:
+    """Thread-safe per-endpoint request latency recorder.
+
+    Keeps a bounded window of recent latencies per endpoint so percentiles stay
+    cheap to compute, plus lifetime request and error counters.
+    """
+    def __init__(self, window=1000):
+        """Initialize the recorder.
+
+        Args:
+            window (int): Number of recent samples kept per endpoint.
+        """
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok=True):
+        """Record one request.
+
+        Args:
+            endpoint (str): Logical endpoint name, e.g. ``"vllm"``.
+            seconds (float): Request latency in seconds.
+            ok (bool): Whether the request succeeded.
+        """
+        with self._lock:
+            if endpoint not in self._samples:
+                self._samples[endpoint] = deque(maxlen=self.window)
+                self._counts[endpoint] = 0
+                self._errors[endpoint] = 0
+            self._samples[endpoint].append(seconds)
+            self._counts[endpoint] += 1
+            if not ok:
+                self._errors[endpoint] += 1
+
+    def reset(self):
+        """Forget all samples and counters."""
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._errors.clear()
+
+    def snapshot(self):
+        """Return latency statistics for every endpoint.
+
+        Returns:
+            dict: Mapping of endpoint to count, errors and latency percentiles in seconds.
+        """
+        with self._lock:
+            result = {}
+            for endpoint, samples in self._samples.items():
+                ordered = sorted(samples)
+
+                def percentile(p):
+                    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+                result[endpoint] = {
+                    "count": self._counts[endpoint],
+                    "errors": self._errors[endpoint],
+                    "avg": sum(ordered) / len(ordered) if ordered else 0.0,
+                    "p50": percentile(0.50),
+                    "p95": percentile(0.95),
+                    "p99": percentile(0.99),
+                    "max": ordered[-1] if ordered else 0.0,
+                }
+            return result
+
+
+# Process-wide latency statistics shared by every client created here
+latency_stats = LatencyStats()
+
+
+def create_http_client(endpoint, connect_timeout, read_timeout, pool_size):
+    """Create a keep-alive httpx client that records per-request latency.
+
+    The client is meant to be passed to the OpenAI SDK (``http_client=``), which
+    adds its own retry-with-backoff on top. For streaming responses the recorded
+    latency is the time until the response headers arrive.
+
+    Args:
+        endpoint (str): Logical endpoint name used in the latency statistics.
+        connect_timeout (float): Connect timeout in seconds.
+        read_timeout (float): Read timeout in seconds.
+        pool_size (int): Maximum number of pooled keep-alive connections.
+
+    Returns:
+        httpx.Client: Configured HTTP client.
+    """
+    def on_request(request):
+        request.extensions["start_time"] = time.perf_counter()
+
+    def on_response(response):
+        start = response.request.extensions.get("start_time")
+        if start is not None:
+            latency_stats.record(endpoint, time.perf_counter() - start, ok=response.status_code < 400)
+
+    return httpx.Client(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        event_hooks={"request": [on_request], "response": [on_response]}
+    )
+
+
+def create_async_http_client(endpoint, connect_timeout, read_timeout, pool_size):
+    """Create a keep-alive httpx AsyncClient that records per-request latency.
+
+    Connections of an async client are bound to the event loop that opened them,
+    so callers should keep one client per event loop.
+
+    Args:
+        endpoint (str): Logical endpoint name used in the latency statistics.
+        connect_timeout (float): Connect timeout in seconds.
+        read_timeout (float): Read timeout in seconds.
+        pool_size (int): Maximum number of pooled keep-alive connections.
+
+    Returns:
+        httpx.AsyncClient: Configured HTTP client.
+    """
+    async def on_request(request):
+        request.extensions["start_time"] = time.perf_counter()
+
+    async def on_response(response):
+        start = response.request.extensions.get("start_time")
+        if start is not None:
+            latency_stats.record(endpoint, time.perf_counter() - start, ok=response.status_code < 400)
+
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        event_hooks={"request": [on_request], "response": [on_response]}
+    )
+
+
+class TimedSession(requests.Session):
+    """requests Session with a default timeout and per-request latency recording."""
+    def __init__(self, endpoint, timeout):
+        """Initialize the session.
+
+        Args:
+            endpoint (str): Logical endpoint name used in the latency statistics.
+            timeout (tuple): Default ``(connect, read)`` timeout in seconds.
+        """
+        super().__init__()
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        """Send a request, applying the default timeout and recording its latency."""
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.RequestException:
+            latency_stats.record(self.endpoint, time.perf_counter() - start, ok=False)
+            raise
+        latency_stats.record(self.endpoint, time.perf_counter() - start, ok=response.status_code < 400)
+        return response
+
+
+def create_session(endpoint, connect_timeout, read_timeout, max_retries, backoff_factor, pool_size):
+    """Create a pooled requests Session with timeouts and retry-with-backoff.
+
+    Connection errors and 429/5xx responses are retried with exponential backoff.
+
+    Args:
+        endpoint (str): Logical endpoint name used in the latency statistics.
+        connect_timeout (float): Connect timeout in seconds.
+        read_timeout (float): Read timeout in seconds.
+        max_retries (int): Maximum number of retries per request.
+        backoff_factor (float): Base backoff in seconds, doubled on every retry.
+        pool_size (int): Maximum number of pooled keep-alive connections.
+
+    Returns:
+        TimedSession: Configured session.
+    """
+    session = TimedSession(endpoint, (connect_timeout, read_timeout))
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
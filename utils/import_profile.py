@@ -0,0 +1,67 @@
+import os
+import re
+import sys
+import subprocess
+
+# Modules imported by the application entry points
+DEFAULT_MODULES = ["config", "rag_chain.chain", "vector_db.add_documents", "api.server", "ui.interface"]
+
+_LINE_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(module):
+    """Import a module in a fresh interpreter with ``-X importtime``.
+
+    Args:
+        module (str): Dotted module name.
+
+    Returns:
+        list: ``(name, self_us, cumulative_us, depth)`` per imported module, in
+        the order reported by the interpreter.
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=project_root, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _LINE_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def profile_imports(modules=None, top=15):
+    """Print the import cost of the application modules.
+
+    For every module the total import time is shown, followed by the packages
+    (grouped by top-level name) that contribute most of it.
+
+    Args:
+        modules (list, optional): Modules to profile, defaults to the entry points.
+        top (int): Number of packages listed per module.
+    """
+    for module in modules or DEFAULT_MODULES:
+        try:
+            entries = measure_imports(module)
+        except RuntimeError as e:
+            print(e)
+            continue
+        # Only count the imports triggered by this module (site hooks run first)
+        end = next((index for index, entry in enumerate(entries) if entry[0] == module and entry[3] == 0),
+                   len(entries) - 1)
+        start = max((index + 1 for index in range(end) if entries[index][3] == 0), default=0)
+        entries = entries[start:end + 1]
+        total = entries[-1][2] if entries else 0
+        packages = {}
+        for name, self_us, _, _ in entries:
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + self_us
+        print(f"{module}: {total / 1000:.0f} ms")
+        for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            print(f"  {package:<32} {self_us / 1000:8.1f} ms  {self_us / max(total, 1):6.1%}")
+        print()
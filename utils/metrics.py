@@ -0,0 +1,385 @@
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import Config
+from utils.http_client import latency_stats
+
+# Histogram bucket upper bounds in seconds, covering cache hits up to slow generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Decode speed bucket upper bounds in tokens per second
+TOKENS_PER_SECOND_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 300, 500)
+
+
+def _format_labels(labels):
+    """Render a label tuple as a Prometheus label set."""
+    if not labels:
+        return ""
+    escaped = (
+        name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    """Render a sample value, using Prometheus' spelling of infinity."""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms rendered in the Prometheus text format.
+
+    Metrics are declared once with their type and help text; samples are keyed
+    by their label values. Upstream endpoint latencies recorded by the HTTP
+    clients are exported alongside as summaries.
+    """
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def define(self, name, kind, help_text, buckets=None):
+        """Declare a metric.
+
+        Args:
+            name (str): Metric name.
+            kind (str): ``"counter"``, ``"gauge"`` or ``"histogram"``.
+            help_text (str): Description shown in the exposition.
+            buckets (tuple, optional): Histogram bucket upper bounds.
+        """
+        with self._lock:
+            self._metrics.setdefault(name, {
+                "kind": kind,
+                "help": help_text,
+                "buckets": tuple(buckets or LATENCY_BUCKETS),
+                "samples": {},
+            })
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter.
+
+        Args:
+            name (str): Counter name.
+            value (float): Increment.
+            **labels: Label values of the sample.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._metrics[name]["samples"]
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set the current value of a gauge.
+
+        Args:
+            name (str): Gauge name.
+            value (float): Current value.
+            **labels: Label values of the sample.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._metrics[name]["samples"][key] = value
+
+    def observe(self, name, value, **labels):
+        """Record one observation of a histogram.
+
+        Args:
+            name (str): Histogram name.
+            value (float): Observed value.
+            **labels: Label values of the sample.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            metric = self._metrics[name]
+            sample = metric["samples"].get(key)
+            if sample is None:
+                sample = metric["samples"][key] = {"buckets": [0] * len(metric["buckets"]), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(metric["buckets"]):
+                if value <= bound:
+                    sample["buckets"][index] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    def snapshot(self, name):
+        """Return the samples of one metric.
+
+        Returns:
+            dict: Label tuple to counter or gauge value, or to ``{"sum", "count"}`` for histograms.
+        """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                return {}
+            if metric["kind"] != "histogram":
+                return dict(metric["samples"])
+            return {key: {"sum": sample["sum"], "count": sample["count"]}
+                    for key, sample in metric["samples"].items()}
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: Exposition text.
+        """
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} {metric['kind']}")
+                for key, sample in sorted(metric["samples"].items()):
+                    if metric["kind"] != "histogram":
+                        lines.append(f"{name}{_format_labels(key)} {_format_value(sample)}")
+                        continue
+                    for bound, count in zip(metric["buckets"] + (float("inf"),),
+                                            sample["buckets"] + [sample["count"]]):
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', _format_value(float(bound))),))} "
+                                     f"{count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(sample['sum'])}")
+                    lines.append(f"{name}_count{_format_labels(key)} {sample['count']}")
+
+        # Upstream request latencies (recent window) and lifetime counters
+        upstream = latency_stats.snapshot()
+        if upstream:
+            lines.append("# HELP pharmaquery_upstream_latency_seconds Latency of recent upstream requests")
+            lines.append("# TYPE pharmaquery_upstream_latency_seconds summary")
+            for endpoint, stats in sorted(upstream.items()):
+                for quantile in ("0.5", "0.95", "0.99"):
+                    value = stats["p" + str(int(float(quantile) * 100))]
+                    labels = (("endpoint", endpoint), ("quantile", quantile))
+                    lines.append(f"pharmaquery_upstream_latency_seconds{_format_labels(labels)} "
+                                 f"{_format_value(value)}")
+            for name, field, help_text in (
+                ("pharmaquery_upstream_requests_total", "count", "Upstream requests sent"),
+                ("pharmaquery_upstream_errors_total", "errors", "Upstream requests that failed"),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for endpoint, stats in sorted(upstream.items()):
+                    lines.append(f"{name}{_format_labels((('endpoint', endpoint),))} {stats[field]}")
+        return "\n".join(lines) + "\n"
+
+
+# Create global metrics registry instance
+metrics = MetricsRegistry()
+metrics.define("pharmaquery_requests_total", "counter", "Traced requests by pipeline and outcome")
+metrics.define("pharmaquery_request_seconds", "histogram", "End-to-end duration of traced requests")
+metrics.define("pharmaquery_stage_seconds", "histogram", "Duration of the stages of traced requests")
+metrics.define("pharmaquery_prompt_tokens_total", "counter", "Prompt tokens sent to the LLM")
+metrics.define("pharmaquery_completion_tokens_total", "counter", "Completion tokens generated by the LLM")
+metrics.define("pharmaquery_generation_tokens_per_second", "histogram", "Decode speed of generated answers",
+               buckets=TOKENS_PER_SECOND_BUCKETS)
+metrics.define("pharmaquery_ingest_chunks_total", "counter", "Chunks processed by ingestion, by result")
+metrics.define("pharmaquery_slow_queries_total", "counter", "Queries slower than SLOW_QUERY_THRESHOLD")
+
+
+def stage_averages(pipeline="query"):
+    """Return the average seconds per stage of a pipeline's finished traces.
+
+    Args:
+        pipeline (str): ``"query"`` or ``"ingest"``.
+
+    Returns:
+        dict: Stage name to average seconds, in first-recorded order.
+    """
+    averages = {}
+    for key, sample in metrics.snapshot("pharmaquery_stage_seconds").items():
+        labels = dict(key)
+        if labels.get("pipeline") == pipeline and sample["count"]:
+            averages[labels["stage"]] = sample["sum"] / sample["count"]
+    return averages
+
+
+class Trace:
+    """Timing spans and counters of one query or ingestion run.
+
+    Stages are timed with ``span`` (time spent in a stage is summed, so stages
+    run by several threads report their busy time) or ``mark`` (seconds since
+    the trace started, e.g. the first token). Nothing is recorded until
+    ``finish`` is called, so an abandoned trace costs nothing.
+    """
+    def __init__(self, pipeline, label=""):
+        """Start the trace clock.
+
+        Args:
+            pipeline (str): ``"query"``, ``"batch"`` or ``"ingest"``.
+            label (str): Query text or file names, used in the slow-query log.
+        """
+        self.pipeline = pipeline
+        self.label = label
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.values = {}
+        self.outcome = "ok"
+        self._finished = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage):
+        """Time the enclosed block as (part of) a stage.
+
+        Args:
+            stage (str): Stage name, e.g. ``"retrieval"``.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(stage, time.perf_counter() - start)
+
+    def add_span(self, stage, seconds):
+        """Add externally measured seconds to a stage."""
+        with self._lock:
+            self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def mark(self, stage):
+        """Record the seconds since the trace started as a stage (first mark wins)."""
+        with self._lock:
+            self.spans.setdefault(stage, time.perf_counter() - self.started)
+
+    def set(self, **values):
+        """Attach values such as token counts to the trace."""
+        with self._lock:
+            self.values.update(values)
+
+    def finish(self, outcome=None):
+        """Stop the clock and record the trace in the metrics and slow-query log.
+
+        Args:
+            outcome (str, optional): ``"ok"``, ``"cached"`` or ``"error"``, defaults
+                to the value of ``self.outcome``.
+
+        Returns:
+            float: Total seconds, or None if the trace was already finished.
+        """
+        with self._lock:
+            if self._finished:
+                return None
+            self._finished = True
+            if outcome is not None:
+                self.outcome = outcome
+            total = time.perf_counter() - self.started
+            spans, values = dict(self.spans), dict(self.values)
+
+        if not Config.METRICS_ENABLED:
+            return total
+        metrics.inc("pharmaquery_requests_total", pipeline=self.pipeline, outcome=self.outcome)
+        metrics.observe("pharmaquery_request_seconds", total, pipeline=self.pipeline)
+        for stage, seconds in spans.items():
+            metrics.observe("pharmaquery_stage_seconds", seconds, pipeline=self.pipeline, stage=stage)
+        if values.get("prompt_tokens"):
+            metrics.inc("pharmaquery_prompt_tokens_total", values["prompt_tokens"])
+        if values.get("completion_tokens"):
+            metrics.inc("pharmaquery_completion_tokens_total", values["completion_tokens"])
+        if values.get("tokens_per_second"):
+            metrics.observe("pharmaquery_generation_tokens_per_second", values["tokens_per_second"])
+        for result in ("written", "reused", "deleted"):
+            if values.get(f"chunks_{result}"):
+                metrics.inc("pharmaquery_ingest_chunks_total", values[f"chunks_{result}"], result=result)
+
+        if self.pipeline == "query" and Config.SLOW_QUERY_THRESHOLD is not None \
+                and total >= Config.SLOW_QUERY_THRESHOLD:
+            metrics.inc("pharmaquery_slow_queries_total")
+            slow_query_log.write(self, total, spans, values)
+        return total
+
+
+class SlowQueryLog:
+    """Appends queries slower than ``Config.SLOW_QUERY_THRESHOLD`` to a JSON Lines file."""
+    def __init__(self):
+        """Initialize the log."""
+        self._lock = threading.Lock()
+
+    def write(self, trace, total, spans, values):
+        """Append one slow query with its stage breakdown.
+
+        Args:
+            trace (Trace): The finished trace.
+            total (float): Total seconds.
+            spans (dict): Seconds per stage.
+            values (dict): Token counts and other trace values.
+        """
+        entry = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "query": trace.label[:Config.SLOW_QUERY_MAX_CHARS],
+            "outcome": trace.outcome,
+            "total": round(total, 4),
+            "stages": {stage: round(seconds, 4) for stage, seconds in spans.items()},
+            **values,
+        }
+        try:
+            with self._lock, open(Config.SLOW_QUERY_LOG_PATH, "a", encoding="utf-8") as log_file:
+                log_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Error writing slow query log: {str(e)}")
+
+    def read(self, limit=20):
+        """Return the most recent entries of the log, newest first.
+
+        Args:
+            limit (int): Maximum number of entries.
+
+        Returns:
+            list: Logged entries.
+        """
+        try:
+            with self._lock, open(Config.SLOW_QUERY_LOG_PATH, encoding="utf-8") as log_file:
+                lines = log_file.readlines()[-limit:]
+        except FileNotFoundError:
+            return []
+        return [json.loads(line) for line in reversed(lines) if line.strip()]
+
+
+# Create global slow query log instance
+slow_query_log = SlowQueryLog()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves ``GET /metrics`` for processes without the HTTP API (the Streamlit UI)."""
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host=None):
+    """Serve the Prometheus metrics on a background thread (once per process).
+
+    Args:
+        port (int, optional): Port, defaults to ``Config.METRICS_PORT``.
+        host (str, optional): Bind address, defaults to ``Config.METRICS_HOST``.
+
+    Returns:
+        bool: Whether the server is running.
+    """
+    global _metrics_server
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            port = port or Config.METRICS_PORT
+            if not port:
+                return False
+            try:
+                _metrics_server = ThreadingHTTPServer((host or Config.METRICS_HOST, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Error starting metrics server: {str(e)}")
+                return False
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+        return True
@@ -1,5 +1,6 @@
-from config import Config
-import requests
+from config import Config, get_rerank_session, get_async_rerank_client
+from utils.batcher import MicroBatcher
+import asyncio
 import json
 
 class DocumentReranker:
@@ -11,7 +12,79 @@ class DocumentReranker:
     """
     def __init__(self):
         """Initialize the reranker."""
-        self.rerank_api_url = f"{Config.RERANK_API_BASE}/rerank"
+        # Coalesces the rerank calls of concurrent sessions into one scoring request
+        self.batcher = MicroBatcher(
+            "rerank",
+            self._rerank_batch,
+            max_batch_size=Config.MICRO_BATCH_MAX_SIZE,
+            max_wait_ms=Config.MICRO_BATCH_WINDOW_MS
+        )
+
+    @property
+    def rerank_api_url(self):
+        """URL of the rerank endpoint (follows runtime changes of ``RERANK_API_BASE``)."""
+        return f"{Config.RERANK_API_BASE}/rerank"
+
+    @property
+    def score_api_url(self):
+        """URL of the pairwise scoring endpoint."""
+        return f"{Config.RERANK_API_BASE}{Config.RERANK_SCORE_PATH}"
+
+    def _build_request(self, query, docs):
+        """Build the rerank request body and headers.
+        
+        Args:
+            query (str): User query
+            docs (list): List of retrieved documents
+        
+        Returns:
+            tuple: Request body (str) and headers (dict)
+        """
+        # Prepare request data
+        request_data = {
+            "model": Config.RERANK_MODEL_NAME,
+            "query": query,
+            "documents": [doc.page_content for doc in docs],
+            "top_n": Config.RERANK_TOP_K
+        }
+        
+        # Send request to vllm rerank service
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {Config.RERANK_API_KEY}"
+        }
+        return json.dumps(request_data), headers
+
+    def _apply_results(self, rerank_results, docs):
+        """Reorder documents according to a rerank API response.
+        
+        Args:
+            rerank_results (dict): Parsed rerank API response
+            docs (list): List of retrieved documents
+        
+        Returns:
+            list: Reranked list of documents, or the original list if the response is unusable
+        """
+        # Get reranked document indices
+        if "results" in rerank_results and rerank_results["results"]:
+            # Create reranked document list
+            reranked_docs = []
+            for result in rerank_results["results"]:
+                # Ensure index is valid
+                if "index" in result and 0 <= result["index"] < len(docs):
+                    reranked_docs.append(docs[result["index"]])
+            
+            # If reranked documents were successfully obtained, return them
+            if reranked_docs:
+                return reranked_docs
+            else:
+                print("No valid reranked documents found in response")
+        else:
+            print("Invalid rerank API response format")
+            print(f"Response: {rerank_results}")
+            
+        # If there's an error in reranking process, return original document list
+        return docs
         
     def rerank_docs(self, query, docs):
         """Rerank documents based on the query.
@@ -27,25 +100,24 @@ class DocumentReranker:
             # If reranking is not enabled or there are not enough documents, return the original list directly
             return docs
         
+        if Config.MICRO_BATCH_ENABLED:
+            try:
+                return self.batcher.call((query, docs))
+            except TimeoutError as e:
+                print(f"Error during reranking: {e}")
+                return docs
+        return self._rerank_request(query, docs)
+
+    def _rerank_request(self, query, docs):
+        """Rerank documents for one query with a single ``/rerank`` request."""
         try:
-            # Prepare request data
-            request_data = {
-                "model": Config.RERANK_MODEL_NAME,
-                "query": query,
-                "documents": [doc.page_content for doc in docs],
-                "top_n": Config.RERANK_TOP_K
-            }
+            data, headers = self._build_request(query, docs)
             
-            # Send request to vllm rerank service
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {Config.RERANK_API_KEY}"
-            }
-            
-            response = requests.post(
+            # Shared session: keep-alive connections, timeouts and retry-with-backoff
+            response = get_rerank_session().post(
                 self.rerank_api_url,
                 headers=headers,
-                data=json.dumps(request_data)
+                data=data
             )
             
             # Check response status
@@ -54,31 +126,101 @@ class DocumentReranker:
                 return docs
             
             # Parse response
-            rerank_results = response.json()
-            
-            # Get reranked document indices
-            if "results" in rerank_results and rerank_results["results"]:
-                # Create reranked document list
-                reranked_docs = []
-                for result in rerank_results["results"]:
-                    # Ensure index is valid
-                    if "index" in result and 0 <= result["index"] < len(docs):
-                        reranked_docs.append(docs[result["index"]])
-                
-                # If reranked documents were successfully obtained, return them
-                if reranked_docs:
-                    return reranked_docs
-                else:
-                    print("No valid reranked documents found in response")
-            else:
-                print("Invalid rerank API response format")
-                print(f"Response: {rerank_results}")
-                
+            return self._apply_results(response.json(), docs)
+        except Exception as e:
+            print(f"Error during reranking: {e}")
             # If there's an error in reranking process, return original document list
             return docs
+
+    def _rerank_batch(self, requests):
+        """Rerank the documents of several queries with one pairwise scoring request.
+        
+        Every ``(query, document)`` pair of the batch is sent to the scoring
+        endpoint at once; each query then keeps its ``RERANK_TOP_K`` best documents.
+        Falls back to one ``/rerank`` request per query if batch scoring fails.
+        
+        Args:
+            requests (list): ``(query, docs)`` tuples
+        
+        Returns:
+            list: Reranked document list for each request
+        """
+        if len(requests) == 1:
+            return [self._rerank_request(*requests[0])]
+        
+        try:
+            pairs = [(index, query, doc) for index, (query, docs) in enumerate(requests) for doc in docs]
+            request_data = {
+                "model": Config.RERANK_MODEL_NAME,
+                "text_1": [query for _, query, _ in pairs],
+                "text_2": [doc.page_content for _, _, doc in pairs]
+            }
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {Config.RERANK_API_KEY}"
+            }
+            response = get_rerank_session().post(self.score_api_url, headers=headers, data=json.dumps(request_data))
+            if response.status_code != 200:
+                raise ValueError(f"status code {response.status_code}: {response.text}")
+            scores = {item["index"]: item["score"] for item in response.json()["data"]}
+            if len(scores) != len(pairs):
+                raise ValueError("score count does not match the number of pairs")
+            
+            scored = [[] for _ in requests]
+            for pair_index, (index, _, doc) in enumerate(pairs):
+                scored[index].append((scores[pair_index], doc))
+            return [
+                [doc for _, doc in sorted(items, key=lambda item: item[0], reverse=True)[:Config.RERANK_TOP_K]]
+                for items in scored
+            ]
+        except Exception as e:
+            print(f"Batched rerank failed, reranking queries one by one: {e}")
+            return [self._rerank_request(query, docs) for query, docs in requests]
+
+    async def arerank_docs(self, query, docs):
+        """Asynchronously rerank documents based on the query.
+        
+        Without micro-batching the request uses the async HTTP client: connection
+        errors and 429/5xx responses are retried with exponential backoff, and
+        cancelling the calling task cancels the in-flight request. With
+        micro-batching the request joins a batch sent from the batcher's threads;
+        cancelling the calling task drops it if its batch has not been sent yet,
+        otherwise the shared request runs to completion and its result is discarded.
+        
+        Args:
+            query (str): User query
+            docs (list): List of retrieved documents
+        
+        Returns:
+            list: Reranked list of documents
+        """
+        if not Config.RERANK_ENABLED or not docs or len(docs) <= 1:
+            return docs
+        
+        if Config.MICRO_BATCH_ENABLED:
+            return await asyncio.wrap_future(self.batcher.submit((query, docs)))
+        
+        try:
+            data, headers = self._build_request(query, docs)
+            client = get_async_rerank_client()
+            for attempt in range(Config.HTTP_MAX_RETRIES + 1):
+                try:
+                    response = await client.post(self.rerank_api_url, headers=headers, content=data)
+                    if response.status_code not in (429, 500, 502, 503, 504):
+                        break
+                except Exception:
+                    if attempt == Config.HTTP_MAX_RETRIES:
+                        raise
+                if attempt < Config.HTTP_MAX_RETRIES:
+                    await asyncio.sleep(Config.HTTP_BACKOFF_FACTOR * (2 ** attempt))
+            
+            if response.status_code != 200:
+                print(f"Rerank API request failed with status code {response.status_code}: {response.text}")
+                return docs
+            
+            return self._apply_results(response.json(), docs)
         except Exception as e:
             print(f"Error during reranking: {e}")
-            # If there's an error in reranking process, return original document list
             return docs
 
 # Create global reranker instance
@@ -94,4 +236,16 @@ def rerank_documents(query, docs):
     Returns:
         list: Reranked list of documents
     """
-    return reranker.rerank_docs(query, docs)
\ No newline at end of file
+    return reranker.rerank_docs(query, docs)
+
+async def arerank_documents(query, docs):
+    """Convenience function for asynchronously reranking retrieved documents.
+    
+    Args:
+        query (str): User query
+        docs (list): List of retrieved documents
+    
+    Returns:
+        list: Reranked list of documents
+    """
+    return await reranker.arerank_docs(query, docs)
\ No newline at end of file
@@ -0,0 +1,138 @@
+import threading
+from collections import deque
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_length(text, tag):
+    """Return the length of the longest suffix of ``text`` that starts ``tag``."""
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class ThinkFilter:
+    """Incrementally remove ``<think>...</think>`` blocks from streamed text.
+
+    Deltas are fed as they arrive and the visible text is returned right away.
+    Text that could be the start of a tag split across deltas is held back
+    until the next delta decides it. Whitespace the model emits right after a
+    think block is dropped as well.
+    """
+    def __init__(self):
+        """Initialize the filter outside of a think block."""
+        self.in_think = False
+        self._buffer = ""
+        self._strip_leading = False
+        self.hidden_chars = 0
+
+    def feed(self, delta):
+        """Filter the next delta.
+
+        Args:
+            delta (str): Raw text received from the model.
+
+        Returns:
+            str: Visible text, may be empty.
+        """
+        self._buffer += delta or ""
+        visible = []
+        while self._buffer:
+            if self.in_think:
+                end = self._buffer.find(THINK_CLOSE)
+                if end < 0:
+                    # Drop the thought, keeping only a possible partial closing tag
+                    keep = _partial_tag_length(self._buffer, THINK_CLOSE)
+                    self.hidden_chars += len(self._buffer) - keep
+                    self._buffer = self._buffer[len(self._buffer) - keep:]
+                    break
+                self.hidden_chars += end + len(THINK_CLOSE)
+                self._buffer = self._buffer[end + len(THINK_CLOSE):]
+                self.in_think = False
+                self._strip_leading = True
+            else:
+                if self._strip_leading:
+                    self._buffer = self._buffer.lstrip()
+                    if not self._buffer:
+                        break
+                    self._strip_leading = False
+                start = self._buffer.find(THINK_OPEN)
+                if start < 0:
+                    keep = _partial_tag_length(self._buffer, THINK_OPEN)
+                    visible.append(self._buffer[:len(self._buffer) - keep])
+                    self._buffer = self._buffer[len(self._buffer) - keep:]
+                    break
+                visible.append(self._buffer[:start])
+                self._buffer = self._buffer[start + len(THINK_OPEN):]
+                self.in_think = True
+        return "".join(visible)
+
+    def flush(self):
+        """Return the text held back at the end of the stream.
+
+        An unterminated think block (e.g. cut off by ``max_tokens``) is dropped.
+
+        Returns:
+            str: Remaining visible text.
+        """
+        remaining = "" if self.in_think else self._buffer
+        self._buffer = ""
+        return remaining
+
+
+def strip_think(text):
+    """Remove think blocks from a complete response.
+
+    Args:
+        text (str): Raw model response.
+
+    Returns:
+        str: Response without think blocks.
+    """
+    think_filter = ThinkFilter()
+    return think_filter.feed(text or "") + think_filter.flush()
+
+
+class StreamStats:
+    """Records time to first token and time to first visible token of streamed answers."""
+    def __init__(self, window=1000):
+        """Initialize the recorder.
+
+        Args:
+            window (int): Number of recent answers kept.
+        """
+        self._first_token = deque(maxlen=window)
+        self._first_visible = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, first_token, first_visible):
+        """Record the latencies of one streamed answer.
+
+        Args:
+            first_token (float): Seconds until the first raw token, None if none arrived.
+            first_visible (float): Seconds until the first visible token, None if none arrived.
+        """
+        with self._lock:
+            if first_token is not None:
+                self._first_token.append(first_token)
+            if first_visible is not None:
+                self._first_visible.append(first_visible)
+
+    def snapshot(self):
+        """Return p50/p95 of both latencies in seconds."""
+        with self._lock:
+            result = {}
+            for name, samples in (("first_token", self._first_token), ("first_visible", self._first_visible)):
+                ordered = sorted(samples)
+                result[name] = {
+                    "count": len(ordered),
+                    "p50": ordered[len(ordered) // 2] if ordered else 0.0,
+                    "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0,
+                }
+            return result
+
+
+# Create global streaming statistics instance
+stream_stats = StreamStats()
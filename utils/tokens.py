@@ -0,0 +1,62 @@
+import re
+from functools import lru_cache
+from config import Config
+
+# CJK characters are roughly one token each for Qwen-style tokenizers
+_CJK_PATTERN = re.compile("[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+@lru_cache(maxsize=4)
+def get_tokenizer(path):
+    """Load and cache a Hugging Face tokenizer.
+
+    Args:
+        path (str): Local path or hub name of the tokenizer.
+
+    Returns:
+        Tokenizer, or None if transformers is not installed or loading fails.
+    """
+    if not path:
+        return None
+    try:
+        # Imported on demand: transformers is optional and slow to import
+        from transformers import AutoTokenizer
+    except ImportError:
+        print("transformers is not installed, falling back to estimated token counts")
+        return None
+    try:
+        return AutoTokenizer.from_pretrained(path)
+    except Exception as e:
+        print(f"Error loading tokenizer '{path}', falling back to estimated token counts: {e}")
+        return None
+
+
+def estimate_tokens(text):
+    """Estimate the token count of mixed Chinese/English text without a tokenizer.
+
+    Args:
+        text (str): Text to measure.
+
+    Returns:
+        int: Estimated number of tokens.
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(text, tokenizer_path=None):
+    """Count tokens with the model tokenizer, or estimate them if it is unavailable.
+
+    Args:
+        text (str): Text to measure.
+        tokenizer_path (str, optional): Tokenizer to use, defaults to ``Config.TOKENIZER_PATH``.
+
+    Returns:
+        int: Number of tokens.
+    """
+    tokenizer = get_tokenizer(tokenizer_path or Config.TOKENIZER_PATH)
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, add_special_tokens=False))
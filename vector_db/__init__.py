@@ -1,4 +1,7 @@
 from .chroma_db import add_documents_to_db, get_retriever, delete_documents_by_file_id
 from .add_documents import add_to_db
+from .bulk_ingest import ingest_paths
+from .snapshot import export_snapshot, import_snapshot
 
-__all__ = ['add_documents_to_db', 'get_retriever', 'add_to_db', 'delete_documents_by_file_id']
\ No newline at end of file
+__all__ = ['add_documents_to_db', 'get_retriever', 'add_to_db', 'delete_documents_by_file_id', 'ingest_paths',
+           'export_snapshot', 'import_snapshot']
\ No newline at end of file
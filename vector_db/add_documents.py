@@ -1,66 +1,86 @@
-import streamlit as st
-import uuid
 import datetime
-from data_loader.pdf_loader import save_temp_file, remove_temp_file, load_pdf_document
-from text_splitter.splitter import create_recursive_splitter, split_documents
-from config import db
+from vector_db.pipeline import IngestStats, run_ingest_pipeline
+from config import get_catalog
+from vector_db.catalog import make_file_id, hash_bytes
+from utils.metrics import Trace
 
 
-def add_to_db(uploaded_files):
+def add_to_db(uploaded_files, progress_callback=None, replace=False):
     """Processes and adds uploaded PDF files to the database.
 
     This function checks if any files have been uploaded. If files are uploaded,
-    it saves each file to a temporary location, processes the content using a PDF loader,
-    and splits the content into smaller chunks. Each chunk, along with its metadata, 
-    is then added to the database. Temporary files are removed after processing.
+    it runs all of them through the ingestion pipeline straight from their
+    in-memory buffers: incremental PDF loading and splitting in a process pool,
+    batched concurrent embedding and batched database writes. Each chunk is
+    stamped with its file metadata.
+
+    Files are identified by name. A file whose name is already taken by a
+    different document is only ingested with ``replace``, as a revised version
+    of it: then only the chunks that changed are embedded and the ones that
+    vanished are removed. Otherwise the file is skipped and listed in the
+    ``conflicts`` of the statistics, so the caller can ask the user to confirm
+    the replacement or to rename the file. Files whose content is unchanged are
+    skipped entirely. Ingested files are recorded in the persistent file catalog.
 
     Args:
         uploaded_files (list): A list of uploaded file objects to be processed.
+        progress_callback (callable, optional): Receives the pipeline statistics
+            periodically while the files are being processed.
+        replace (bool): Replace ingested files that have the same name but a
+            different content.
 
     Returns:
-        None"""
+        IngestStats: Pipeline statistics, or None if no files were given."""
     # Check if files are uploaded
     if not uploaded_files:
         # In modular version, we'll let the UI handle error messaging
-        return
-
-    # Initialize uploaded_files list in session state if not exists
-    if 'uploaded_files' not in st.session_state:
-        st.session_state.uploaded_files = []
+        return None
 
+    trace = Trace("ingest", ", ".join(uploaded_file.name for uploaded_file in uploaded_files))
+    jobs = {}
+    conflicts = []
     for uploaded_file in uploaded_files:
-        # Generate unique ID for the file
-        file_id = str(uuid.uuid4())
-        file_name = uploaded_file.name
+        # Derive a stable ID for the file and skip it if its content is unchanged
+        with trace.span("hash"):
+            file_id = make_file_id(uploaded_file.name)
+            file_hash = hash_bytes(uploaded_file.getbuffer())
+            stored_hash = get_catalog().get_file_hash(file_id)
+        if file_id in jobs:
+            # The same name twice in one upload: only one of them can be kept
+            if jobs[file_id]["file_hash"] != file_hash:
+                conflicts.append(uploaded_file.name)
+            continue
+        if stored_hash == file_hash:
+            continue
+        if stored_hash is not None and not replace:
+            conflicts.append(uploaded_file.name)
+            continue
         upload_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        file_size = uploaded_file.size
-
-        # Save the uploaded file to a temporary path
-        temp_file_path = save_temp_file(uploaded_file)
-
-        # Load the file using PyPDFLoader
-        documents = load_pdf_document(temp_file_path)
-
-        # Create text splitter and split documents
-        splitter = create_recursive_splitter()
-        doc_chunks = split_documents(splitter, documents)
-
-        # Add file metadata to each chunk for later retrieval and deletion
-        for chunk in doc_chunks:
-            chunk.metadata["file_id"] = file_id
-            chunk.metadata["file_name"] = file_name
-            chunk.metadata["upload_time"] = upload_time
 
-        # Add chunks to database
-        db.add_documents(doc_chunks)
+        # The pipeline reads the PDF from the upload buffer, no temporary file
+        jobs[file_id] = {
+            "data": uploaded_file.getbuffer(),
+            "size": uploaded_file.size,
+            "file_id": file_id,
+            "file_name": uploaded_file.name,
+            "file_hash": file_hash,
+            # File metadata added to each chunk for later retrieval and deletion
+            "metadata": {
+                "file_id": file_id,
+                "file_name": uploaded_file.name,
+                "upload_time": upload_time
+            }
+        }
 
-        # Remove the temporary file after processing
-        remove_temp_file(temp_file_path)
+    stats = IngestStats(len(jobs))
+    stats.conflicts = conflicts
+    try:
+        run_ingest_pipeline(list(jobs.values()), progress_callback=progress_callback, trace=trace, stats=stats)
+    except Exception:
+        trace.finish("error")
+        raise
 
-        # Add file information to session state
-        st.session_state.uploaded_files.append({
-            "id": file_id,
-            "name": file_name,
-            "size": file_size,
-            "upload_time": upload_time
-        })
\ No newline at end of file
+    trace.set(chunks_written=stats.chunks_written, chunks_reused=stats.chunks_reused,
+              chunks_deleted=stats.chunks_deleted)
+    trace.finish()
+    return stats
\ No newline at end of file
@@ -0,0 +1,247 @@
+import os
+import glob
+import json
+import datetime
+from vector_db.pipeline import IngestStats, run_ingest_pipeline
+from vector_db.catalog import make_file_id, hash_file
+from config import Config, get_catalog
+from utils.metrics import Trace
+
+
+def find_pdfs(patterns):
+    """Expand directories, glob patterns and file paths into the PDFs to ingest.
+
+    Every PDF gets a name relative to the directory it was found under (the
+    directory argument, the fixed part of a glob or the file's own directory),
+    so ``docs/`` and ``docs/*.pdf`` name ``docs/a.pdf`` ``"a.pdf"``, like an
+    upload of that file, and files of different subdirectories stay distinct.
+
+    Args:
+        patterns (list): Directories (searched recursively), glob patterns
+            (``**`` matches subdirectories) or PDF paths.
+
+    Returns:
+        list: ``(path, name)`` pairs sorted by name, one per distinct name.
+    """
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = (os.path.join(directory, name) for directory, _, names in os.walk(pattern)
+                     for name in names if name.lower().endswith(".pdf"))
+        elif glob.has_magic(pattern):
+            parts = pattern.replace("\\", "/").split("/")
+            fixed = next(index for index, part in enumerate(parts) if glob.has_magic(part))
+            root = "/".join(parts[:fixed]) or "."
+            paths = (path for path in glob.glob(pattern, recursive=True)
+                     if os.path.isfile(path) and path.lower().endswith(".pdf"))
+        elif os.path.isfile(pattern):
+            root, paths = os.path.dirname(pattern) or ".", [pattern]
+        else:
+            print(f"No such file or directory: {pattern}")
+            continue
+        for path in paths:
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            if name in found and os.path.abspath(found[name]) != os.path.abspath(path):
+                print(f"Skipping {path}: {found[name]} is already ingested as {name}")
+                continue
+            found.setdefault(name, path)
+    return sorted(((path, name) for name, path in found.items()), key=lambda item: item[1])
+
+
+class IngestCheckpoint:
+    """JSON Lines record of the files a bulk ingestion has finished.
+
+    A file is recorded once its chunks are written and referenced in the
+    catalog, with the size and modification time it had, so a rerun skips it
+    without hashing it again unless it changed. Failed files are recorded with
+    their error and retried by the next run.
+    """
+    def __init__(self, path):
+        """Load the finished files of earlier runs.
+
+        Args:
+            path (str): Checkpoint file, created on the first record.
+        """
+        self.path = path
+        self.finished = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut off by a crash
+                        continue
+                    if entry.get("error"):
+                        self.finished.pop(entry["path"], None)
+                    else:
+                        self.finished[entry["path"]] = (entry["size"], entry["mtime"])
+
+    def is_finished(self, path):
+        """Return whether a file was ingested by an earlier run and has not changed since."""
+        stat = os.stat(path)
+        return self.finished.get(os.path.abspath(path)) == (stat.st_size, stat.st_mtime_ns)
+
+    def record(self, paths, error=None):
+        """Append finished (or failed) files and flush them to disk.
+
+        Args:
+            paths (list): File paths.
+            error (str, optional): Error of failed files.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as checkpoint_file:
+            for path in paths:
+                stat = os.stat(path)
+                entry = {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+                if error:
+                    entry["error"] = error
+                else:
+                    self.finished[entry["path"]] = (entry["size"], entry["mtime"])
+                checkpoint_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+
+
+def _make_job(path, name, replace=False):
+    """Return the pipeline job of a PDF on disk, or None if its content is already ingested.
+
+    Raises:
+        FileExistsError: If a different file with the same name is ingested and
+            ``replace`` is not set.
+    """
+    file_id = make_file_id(name)
+    file_hash = hash_file(path)
+    stored_hash = get_catalog().get_file_hash(file_id)
+    if stored_hash == file_hash:
+        return None
+    if stored_hash is not None and not replace:
+        raise FileExistsError(f"A different file named {name} is already ingested (use --replace to replace it)")
+    return {
+        # Workers read the PDF from disk, so the group is never held in memory
+        "data": path,
+        "size": os.path.getsize(path),
+        "file_id": file_id,
+        "file_name": name,
+        "file_hash": file_hash,
+        "metadata": {
+            "file_id": file_id,
+            "file_name": name,
+            "upload_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+    }
+
+
+def _run_group(jobs, stats, progress_callback):
+    """Ingest a group of files with one pipeline run.
+
+    Returns:
+        str: The error, or None if the group was ingested.
+    """
+    trace = Trace("ingest", ", ".join(job["file_name"] for job in jobs))
+    counters = (stats.chunks_written, stats.chunks_reused, stats.chunks_deleted)
+    try:
+        run_ingest_pipeline(jobs, progress_callback=progress_callback, trace=trace, stats=stats)
+    except Exception as e:
+        trace.finish("error")
+        return str(e) or type(e).__name__
+    trace.set(chunks_written=stats.chunks_written - counters[0], chunks_reused=stats.chunks_reused - counters[1],
+              chunks_deleted=stats.chunks_deleted - counters[2])
+    trace.finish()
+    return None
+
+
+def ingest_paths(patterns, checkpoint_path=None, progress_callback=None, replace=False):
+    """Ingest the PDFs of directories, globs or paths, resuming an interrupted run.
+
+    Files run through the same parse -> embed -> write pipeline as uploads,
+    with parsing and splitting spread over ``Config.INGEST_WORKERS`` processes
+    that read the PDFs from disk. Files are committed in groups of
+    ``BULK_INGEST_GROUP_FILES`` files (or ``BULK_INGEST_GROUP_MB``), each group
+    recorded in the checkpoint once its chunks are written; a crash loses at
+    most the group in flight, and its embeddings are served by the embedding
+    cache when it is redone. Files whose content is already in the catalog are
+    skipped like unchanged uploads. Files named like an ingested file with a
+    different content fail unless ``replace`` is set (see ``add_to_db``). A
+    group that fails is retried file by file, so one broken PDF does not stop
+    the run.
+
+    Args:
+        patterns (list): Directories, glob patterns or PDF paths (see :func:`find_pdfs`).
+        checkpoint_path (str, optional): Checkpoint file, defaults to
+            ``Config.BULK_INGEST_CHECKPOINT_PATH``.
+        progress_callback (callable, optional): Called with the :class:`IngestStats`
+            of the whole run while files are being processed.
+        replace (bool): Replace ingested files that have the same name but a
+            different content.
+
+    Returns:
+        dict: ``stats`` (IngestStats), counts of ``ingested``, ``unchanged`` and
+        ``resumed`` (skipped thanks to the checkpoint) files, and ``failed``
+        mapping paths to their error.
+    """
+    checkpoint = IngestCheckpoint(checkpoint_path or Config.BULK_INGEST_CHECKPOINT_PATH)
+    files = find_pdfs(patterns)
+    pending = [(path, name) for path, name in files if not checkpoint.is_finished(path)]
+    result = {"stats": IngestStats(len(pending)), "ingested": 0, "unchanged": 0,
+              "resumed": len(files) - len(pending), "failed": {}}
+    stats = result["stats"]
+    group, group_bytes = [], 0
+
+    def finished(jobs):
+        checkpoint.record([job["path"] for job in jobs])
+        result["ingested"] += len(jobs)
+
+    def failed(path, error):
+        print(f"Error ingesting {path}: {error}")
+        result["failed"][path] = error
+        checkpoint.record([path], error)
+
+    def flush():
+        nonlocal group, group_bytes
+        jobs, unchanged = [], []
+        for path, name in group:
+            try:
+                job = _make_job(path, name, replace)
+            except FileExistsError as e:
+                stats.conflicts.append(name)
+                failed(path, str(e))
+                continue
+            if job is None:
+                unchanged.append(path)
+            else:
+                job["path"] = path
+                jobs.append(job)
+        stats.add(files_parsed=len(unchanged))
+        result["unchanged"] += len(unchanged)
+        if unchanged:
+            checkpoint.record(unchanged)
+        if jobs:
+            error = _run_group(jobs, stats, progress_callback)
+            if error is None:
+                finished(jobs)
+            elif len(jobs) == 1:
+                failed(jobs[0]["path"], error)
+            else:
+                # Isolate the broken file(s) of the group
+                for job in jobs:
+                    error = _run_group([job], stats, progress_callback)
+                    if error is None:
+                        finished([job])
+                    else:
+                        failed(job["path"], error)
+        group, group_bytes = [], 0
+
+    for path, name in pending:
+        group.append((path, name))
+        group_bytes += os.path.getsize(path)
+        if len(group) >= Config.BULK_INGEST_GROUP_FILES or group_bytes >= Config.BULK_INGEST_GROUP_MB * 2 ** 20:
+            flush()
+    if group:
+        flush()
+    if progress_callback is not None:
+        progress_callback(stats)
+    return result
@@ -0,0 +1,326 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import uuid
+from embedding.embedder import normalize_text
+
+
+def make_file_id(file_name):
+    """Derive a stable file ID from the file name.
+
+    Uploading a revised version of a file under the same name maps to the same
+    ID, which is what allows re-ingestion to only touch the chunks that changed.
+
+    Args:
+        file_name (str): Name of the uploaded file.
+
+    Returns:
+        str: UUID string derived from the file name.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, file_name))
+
+
+def make_chunk_id(text):
+    """Derive a content-addressed record ID for a chunk.
+
+    Identical chunk text yields the same ID regardless of the file it came from,
+    so a chunk shared by several files is stored (and embedded) only once.
+
+    Args:
+        text (str): Chunk text.
+
+    Returns:
+        str: Hex digest of the normalized chunk text.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def hash_bytes(data):
+    """Return the SHA-256 hex digest of file contents."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, reading it in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileCatalog:
+    """SQLite catalog of ingested files and the chunks they reference.
+
+    Every file keeps one reference per ``(page, chunk_id)`` pair, with the
+    chunk's ``start_index`` in that page of that file. A chunk record
+    in the vector database may be referenced by several files and is only
+    deleted once no file references it any more. The catalog also persists the
+    file list (name, size, page count, hash and ingest time) across restarts.
+    """
+    def __init__(self, path):
+        """Open (or create) the catalog database.
+
+        Args:
+            path (str): Path to the SQLite database file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # Held while chunk references and the vector store records change together
+        # (ingestion commits, deletions, snapshot imports), so a chunk cannot be
+        # deleted between the check that it is stored and the reference to it
+        self.commit_lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_id TEXT PRIMARY KEY, file_name TEXT NOT NULL, file_hash TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_refs ("
+            "file_id TEXT NOT NULL, page INTEGER NOT NULL, chunk_id TEXT NOT NULL, "
+            "PRIMARY KEY (file_id, page, chunk_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_refs_chunk_id ON chunk_refs(chunk_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # Columns added after the first catalog version
+        for table, column, definition in (("files", "file_size", "INTEGER NOT NULL DEFAULT 0"),
+                                          ("files", "page_count", "INTEGER NOT NULL DEFAULT 0"),
+                                          ("files", "upload_time", "TEXT NOT NULL DEFAULT ''"),
+                                          ("chunk_refs", "start_index", "INTEGER")):
+            if column not in {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}:
+                try:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                except sqlite3.OperationalError:
+                    # Another process (e.g. an ingest worker) added it concurrently
+                    if column not in {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}:
+                        raise
+        self._conn.commit()
+
+    def list_files(self):
+        """Return every file in the catalog, most recently ingested first.
+
+        Returns:
+            list: One dict per file with ``id``, ``name``, ``size``, ``page_count``,
+            ``hash``, ``upload_time`` and ``chunk_count``.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT f.file_id, f.file_name, f.file_size, f.page_count, f.file_hash, f.upload_time, "
+                "(SELECT COUNT(DISTINCT chunk_id) FROM chunk_refs r WHERE r.file_id = f.file_id) "
+                "FROM files f ORDER BY f.upload_time DESC, f.file_name"
+            ).fetchall()
+        return [
+            {
+                "id": file_id,
+                "name": file_name,
+                "size": file_size,
+                "page_count": page_count,
+                "hash": file_hash,
+                "upload_time": upload_time,
+                "chunk_count": chunk_count
+            }
+            for file_id, file_name, file_size, page_count, file_hash, upload_time, chunk_count in rows
+        ]
+
+    def get_collection_version(self):
+        """Return the collection version, bumped whenever chunks are added or deleted.
+
+        The version lives in the catalog database, so every process sharing the
+        vector database sees the same value.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'collection_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def bump_collection_version(self):
+        """Increment the collection version and return the new value."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('collection_version', '1') "
+                    "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+                )
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'collection_version'").fetchone()
+        return int(row[0])
+
+    def get_file_hash(self, file_id):
+        """Return the content hash recorded for a file, or None if it is unknown."""
+        with self._lock:
+            row = self._conn.execute("SELECT file_hash FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_file_chunk_ids(self, file_id):
+        """Return the chunk IDs referenced by a file.
+
+        Args:
+            file_id (str): File identifier.
+
+        Returns:
+            list: Distinct chunk IDs, or None if the file is not in the catalog.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM files WHERE file_id = ?", (file_id,)).fetchone() is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT DISTINCT chunk_id FROM chunk_refs WHERE file_id = ?", (file_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def existing_chunk_ids(self, chunk_ids):
+        """Return the subset of chunk IDs that are already referenced by any file.
+
+        Args:
+            chunk_ids (iterable): Candidate chunk IDs.
+
+        Returns:
+            set: Chunk IDs that are already stored in the vector database.
+        """
+        chunk_ids = list(set(chunk_ids))
+        existing = set()
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT chunk_id FROM chunk_refs WHERE chunk_id IN ({placeholders})", batch
+                ).fetchall()
+                existing.update(row[0] for row in rows)
+        return existing
+
+    def chunk_owners(self, chunk_ids):
+        """Return the file each chunk is attributed to: the most recently ingested file referencing it.
+
+        Args:
+            chunk_ids (iterable): Chunk IDs.
+
+        Returns:
+            dict: Chunk ID to the ``file_id``, ``file_name``, ``source``, ``upload_time``,
+            ``page`` and (if recorded) ``start_index`` metadata of its file;
+            unreferenced chunks are left out.
+        """
+        chunk_ids = list(set(chunk_ids))
+        owners = {}
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                # The last row of a chunk wins: newest file, then its first page
+                rows = self._conn.execute(
+                    "SELECT r.chunk_id, r.page, r.start_index, f.file_id, f.file_name, f.upload_time "
+                    f"FROM chunk_refs r JOIN files f ON f.file_id = r.file_id WHERE r.chunk_id IN ({placeholders}) "
+                    "ORDER BY f.upload_time, f.file_name, r.page DESC", batch
+                ).fetchall()
+                for chunk_id, page, start_index, file_id, file_name, upload_time in rows:
+                    owners[chunk_id] = {"file_id": file_id, "file_name": file_name, "source": file_name,
+                                        "upload_time": upload_time, "page": page}
+                    if start_index is not None:
+                        owners[chunk_id]["start_index"] = start_index
+        return owners
+
+    def _unreferenced(self, chunk_ids):
+        orphaned = []
+        for chunk_id in set(chunk_ids):
+            if self._conn.execute("SELECT 1 FROM chunk_refs WHERE chunk_id = ? LIMIT 1", (chunk_id,)).fetchone() is None:
+                orphaned.append(chunk_id)
+        return orphaned
+
+    def replace_file(self, file_id, file_name, file_hash, refs, file_size=0, page_count=0, upload_time=""):
+        """Record a (re-)ingested file and replace its chunk references.
+
+        Args:
+            file_id (str): File identifier.
+            file_name (str): File name.
+            file_hash (str): Content hash of the file.
+            refs (iterable): ``(page, chunk_id)`` pairs or ``(page, chunk_id, start_index)``
+                triples referenced by the new version; the offsets of kept
+                references are updated.
+            file_size (int): Size of the file in bytes.
+            page_count (int): Number of pages in the file.
+            upload_time (str): Ingest time of this version.
+
+        Returns:
+            list: Chunk IDs that are no longer referenced by any file and should
+            be deleted from the vector database.
+        """
+        offsets = {}
+        for ref in refs:
+            offsets.setdefault((ref[0], ref[1]), ref[2] if len(ref) > 2 else None)
+        refs = set(offsets)
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT page, chunk_id FROM chunk_refs WHERE file_id = ?", (file_id,)
+            ).fetchall()
+            vanished = set(previous) - refs
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files "
+                    "(file_id, file_name, file_hash, file_size, page_count, upload_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_id, file_name, file_hash, file_size, page_count, upload_time)
+                )
+                self._conn.executemany(
+                    "DELETE FROM chunk_refs WHERE file_id = ? AND page = ? AND chunk_id = ?",
+                    [(file_id, page, chunk_id) for page, chunk_id in vanished]
+                )
+                self._conn.executemany(
+                    "INSERT INTO chunk_refs (file_id, page, chunk_id, start_index) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (file_id, page, chunk_id) DO UPDATE SET start_index = excluded.start_index",
+                    [(file_id, page, chunk_id, start_index) for (page, chunk_id), start_index in offsets.items()]
+                )
+            return self._unreferenced(chunk_id for _, chunk_id in vanished)
+
+    def iter_files(self, since=None):
+        """Yield the files of the catalog with their chunk references, one file at a time.
+
+        Args:
+            since (str, optional): Only files ingested at or after this time
+                (``"YYYY-MM-DD[ HH:MM:SS]"``, compared with ``upload_time``).
+
+        Yields:
+            dict: ``id``, ``name``, ``hash``, ``size``, ``page_count``, ``upload_time``
+            and ``refs``, the ``[page, chunk_id, start_index]`` references of the file.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_id, file_name, file_hash, file_size, page_count, upload_time FROM files "
+                "WHERE upload_time >= ? ORDER BY upload_time, file_name", (since or "",)
+            ).fetchall()
+        for file_id, file_name, file_hash, file_size, page_count, upload_time in rows:
+            with self._lock:
+                refs = self._conn.execute(
+                    "SELECT page, chunk_id, start_index FROM chunk_refs WHERE file_id = ?", (file_id,)
+                ).fetchall()
+            yield {
+                "id": file_id,
+                "name": file_name,
+                "hash": file_hash,
+                "size": file_size,
+                "page_count": page_count,
+                "upload_time": upload_time,
+                "refs": [list(ref) for ref in refs]
+            }
+
+    def remove_file(self, file_id):
+        """Remove a file and its references from the catalog.
+
+        Args:
+            file_id (str): File identifier.
+
+        Returns:
+            list: Chunk IDs that are no longer referenced by any file and should
+            be deleted from the vector database.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT chunk_id FROM chunk_refs WHERE file_id = ?", (file_id,)
+            ).fetchall()
+            with self._conn:
+                self._conn.execute("DELETE FROM chunk_refs WHERE file_id = ?", (file_id,))
+                self._conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            return self._unreferenced(row[0] for row in rows)
@@ -1,4 +1,19 @@
-from config import db, Config
+import uuid
+from langchain_core.documents import Document
+from config import get_db, get_catalog, Config
+
+
+def get_collection():
+    """Return the record-level collection of the vector database.
+
+    This is the ``chromadb`` collection behind the LangChain wrapper, or the
+    ``NumpyVectorStore`` itself, which offers the same ``upsert``/``get`` calls.
+
+    Returns:
+        The collection used for writes and lookups by ID or metadata.
+    """
+    db = get_db()
+    return db if Config.VECTOR_BACKEND == "numpy" else db._collection
 
 
 def add_documents_to_db(documents):
@@ -7,21 +22,146 @@ def add_documents_to_db(documents):
     Args:
         documents (list): List of document chunks to add to the database.
     """
-    db.add_documents(documents)
+    get_db().add_documents(documents)
+
+
+def add_embeddings_to_db(texts, embeddings, metadatas, ids=None):
+    """Add pre-computed embeddings and their texts to the vector database.
+
+    Unlike ``add_documents_to_db`` this does not call the embedding model, so the
+    caller can embed in its own batches and write in larger ones.
+
+    Args:
+        texts (list): Chunk texts.
+        embeddings (list): Embedding vector for each text.
+        metadatas (list): Metadata dict for each text.
+        ids (list, optional): Record IDs. Random IDs are generated if omitted.
+
+    Returns:
+        list: The IDs of the written records.
+    """
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in texts]
+    get_collection().upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+    return ids
+
+
+def delete_chunks_from_db(ids):
+    """Delete chunk records from the vector database by ID.
+    
+    Args:
+        ids (list): Record IDs to delete.
+    """
+    for start in range(0, len(ids), Config.DB_WRITE_BATCH_SIZE):
+        get_db().delete(ids=ids[start:start + Config.DB_WRITE_BATCH_SIZE])
+
+
+def get_stored_ids(ids):
+    """Return the subset of record IDs that are stored in the vector database.
+
+    Args:
+        ids (list): Record IDs.
+
+    Returns:
+        set: The IDs that exist.
+    """
+    collection = get_collection()
+    stored = set()
+    for start in range(0, len(ids), Config.DB_WRITE_BATCH_SIZE):
+        stored.update(collection.get(ids=ids[start:start + Config.DB_WRITE_BATCH_SIZE], include=[])["ids"])
+    return stored
 
 
-def get_retriever():
+def relabel_chunks(ids):
+    """Attribute chunks to the newest file that references them.
+
+    A chunk is written with the metadata of the file that first added it.
+    Once other files reference it too, or that file is revised or deleted,
+    its ``file_id``, ``file_name``, ``source``, ``upload_time``, ``page`` and
+    ``start_index`` are updated to those of the most recently ingested file
+    still referencing it, so answers cite an existing file, delta snapshots see
+    the chunk and context compaction merges it at its position in that page.
+
+    Args:
+        ids (iterable): Chunk IDs whose references changed; unreferenced ones are skipped.
+    """
+    owners = get_catalog().chunk_owners(ids)
+    ids = list(owners)
+    collection = get_collection()
+    for start in range(0, len(ids), Config.DB_WRITE_BATCH_SIZE):
+        result = collection.get(ids=ids[start:start + Config.DB_WRITE_BATCH_SIZE], include=["metadatas"])
+        changed = {}
+        for record_id, metadata in zip(result["ids"], result["metadatas"]):
+            labelled = {**(metadata or {}), **owners[record_id]}
+            if labelled != metadata:
+                changed[record_id] = labelled
+        if changed:
+            collection.update(ids=list(changed), metadatas=list(changed.values()))
+
+
+def get_documents_by_ids(ids):
+    """Fetch documents from the vector database by record ID, preserving order.
+    
+    Args:
+        ids (list): Record IDs.
+    
+    Returns:
+        list: Documents for the IDs that still exist, in the order of ``ids``.
+    """
+    if not ids:
+        return []
+    result = get_collection().get(ids=ids, include=["documents", "metadatas"])
+    found = {
+        record_id: Document(id=record_id, page_content=text, metadata=metadata or {})
+        for record_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+    return [found[record_id] for record_id in ids if record_id in found]
+
+
+def search_by_vectors(embeddings, k):
+    """Run one similarity search for several query embeddings.
+    
+    Args:
+        embeddings (list): Query embeddings.
+        k (int): Documents per query.
+    
+    Returns:
+        list: For every embedding, ``(Document, distance)`` pairs, closest first.
+    """
+    if not len(embeddings):
+        return []
+    if Config.VECTOR_BACKEND == "numpy":
+        return get_db().search_by_vectors(embeddings, k)
+    result = get_collection().query(query_embeddings=embeddings, n_results=k,
+                                    include=["documents", "metadatas", "distances"])
+    return [
+        [(Document(id=record_id, page_content=text, metadata=metadata or {}), distance)
+         for record_id, text, metadata, distance in zip(*columns)]
+        for columns in zip(result["ids"], result["documents"], result["metadatas"], result["distances"])
+    ]
+
+
+def get_retriever(k=None):
     """Get a retriever object for similarity search.
     
+    The distance space and ``search_ef`` are those of the collection's index
+    (see ``get_index_settings`` in ``config.py``).
+    
+    Args:
+        k (int, optional): Documents retrieved per query, defaults to ``Config.SEARCH_K``.
+    
     Returns:
         Retriever: A retriever object configured for similarity search.
     """
-    return db.as_retriever(search_type="similarity", search_kwargs={'k': Config.SEARCH_K})
+    return get_db().as_retriever(search_type="similarity", search_kwargs={'k': k or Config.SEARCH_K})
 
 
 def delete_documents_by_file_id(file_id):
     """Delete documents from the vector database based on file_id.
     
+    Chunks shared with other files stay in the database until the last file
+    referencing them is deleted.
+    
     Args:
         file_id (str): The unique identifier of the file to delete documents for.
     
@@ -29,20 +169,25 @@ def delete_documents_by_file_id(file_id):
         bool: True if deletion was successful, False otherwise.
     """
     try:
-        # Get all documents with the specified file_id
-        all_docs = db.get()
-        ids_to_delete = []
-        
-        # Check if 'metadatas' exists and has entries
-        if 'metadatas' in all_docs and all_docs['metadatas']:
-            for i, metadata in enumerate(all_docs['metadatas']):
-                if metadata and "file_id" in metadata and metadata["file_id"] == file_id:
-                    if 'ids' in all_docs and i < len(all_docs['ids']):
-                        ids_to_delete.append(all_docs['ids'][i])
+        catalog = get_catalog()
+        # Files ingested with reference tracking know their chunks
+        with catalog.commit_lock:
+            chunk_ids = catalog.get_file_chunk_ids(file_id)
+            if chunk_ids is not None:
+                orphaned = catalog.remove_file(file_id)
+                if orphaned:
+                    delete_chunks_from_db(orphaned)
+                    catalog.bump_collection_version()
+                # Shared chunks that named the deleted file now name another one
+                relabel_chunks(set(chunk_ids) - set(orphaned))
+                return True
         
-        # Delete the matched documents
-        if ids_to_delete:
-            db.delete(ids=ids_to_delete)
+        # Files ingested before the catalog existed: filter on metadata in the
+        # database instead of pulling the whole collection into Python
+        matched = get_collection().get(where={"file_id": file_id}, include=[])
+        if matched["ids"]:
+            delete_chunks_from_db(matched["ids"])
+            catalog.bump_collection_version()
             return True
         return False
     except Exception as e:
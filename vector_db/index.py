@@ -0,0 +1,316 @@
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from config import Config, get_catalog, get_db, get_index_settings, get_numpy_store_path, reset_db
+from vector_db.chroma_db import get_collection
+from vector_db.numpy_store import NumpyVectorStore
+
+# Chroma's defaults, for collections created without explicit settings
+DEFAULT_INDEX_SETTINGS = {"space": "l2", "M": 16, "construction_ef": 100, "search_ef": 10}
+# Settings fixed when an index is built: changing them requires a reindex
+BUILD_SETTINGS = ("space", "M", "construction_ef")
+# search_ef values calibrated unless others are given
+SEARCH_EF_GRID = (10, 20, 40, 80, 160)
+
+
+def hnsw_metadata(settings):
+    """Return index settings as Chroma collection metadata (``hnsw:space``, ``hnsw:M``, ...)."""
+    return {f"hnsw:{name}": value for name, value in settings.items()}
+
+
+def read_index_settings(db):
+    """Return the index settings an open vector store was built with.
+
+    Args:
+        db: The LangChain Chroma store or a ``NumpyVectorStore``.
+
+    Returns:
+        dict: The settings of the store (only ``space`` for the numpy backend).
+    """
+    if isinstance(db, NumpyVectorStore):
+        return {"space": db.space}
+    collection = db._collection
+    hnsw = (getattr(collection, "configuration", None) or {}).get("hnsw") or {}
+    if hnsw:
+        # chromadb >= 1.0 reports the effective configuration
+        return {"space": getattr(hnsw["space"], "value", hnsw["space"]), "M": hnsw["max_neighbors"],
+                "construction_ef": hnsw["ef_construction"], "search_ef": hnsw["ef_search"]}
+    metadata = collection.metadata or {}
+    return {name: metadata.get(f"hnsw:{name}", default) for name, default in DEFAULT_INDEX_SETTINGS.items()}
+
+
+def set_search_ef(collection, search_ef):
+    """Change the search candidate list of a Chroma collection in place.
+
+    Args:
+        collection: The ``chromadb`` collection.
+        search_ef (int): Candidates kept while searching.
+    """
+    try:
+        collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+    except TypeError:
+        # chromadb < 1.0 only has the metadata form
+        collection.modify(metadata={**(collection.metadata or {}), "hnsw:search_ef": search_ef})
+
+
+def sync_index_settings(db, settings):
+    """Apply the configured search settings to an opened store.
+
+    ``search_ef`` is changed in place. The build settings of an existing
+    collection cannot change, so differences are reported with a hint to
+    reindex.
+
+    Args:
+        db: The LangChain Chroma store or a ``NumpyVectorStore``.
+        settings (dict): The configured settings (``get_index_settings``).
+
+    Returns:
+        list: Names of the settings that differ and need a reindex.
+    """
+    current = read_index_settings(db)
+    if current.get("search_ef", settings["search_ef"]) != settings["search_ef"]:
+        try:
+            set_search_ef(db._collection, settings["search_ef"])
+        except Exception as e:
+            print(f"Error applying search_ef: {e}")
+    stale = [name for name in BUILD_SETTINGS if name in current and current[name] != settings[name]]
+    if stale:
+        print(f"Collection {Config.COLLECTION_NAME} was built with different {', '.join(stale)} "
+              f"({', '.join(f'{name}={current[name]}' for name in stale)}); "
+              f"run 'python main.py reindex' to apply the configured settings")
+    return stale
+
+
+def iter_records(collection, batch_size, include=("embeddings", "documents", "metadatas")):
+    """Page through all records of a collection.
+
+    Args:
+        collection: A ``chromadb`` collection or a ``NumpyVectorStore``.
+        batch_size (int): Records per page.
+        include (tuple): Fields to fetch besides the IDs.
+
+    Yields:
+        dict: ``ids`` and the included fields of one page.
+    """
+    offset = 0
+    while True:
+        batch = collection.get(limit=batch_size, offset=offset, include=list(include))
+        if not len(batch["ids"]):
+            return
+        yield batch
+        offset += len(batch["ids"])
+
+
+def _copy_records(source, target, progress_callback=None):
+    """Copy every record of one collection into another.
+
+    Returns:
+        int: The number of copied records.
+    """
+    total, copied = source.count(), 0
+    for batch in iter_records(source, Config.DB_WRITE_BATCH_SIZE):
+        target.upsert(ids=batch["ids"], embeddings=batch["embeddings"], documents=batch["documents"],
+                      metadatas=batch["metadatas"])
+        copied += len(batch["ids"])
+        if progress_callback:
+            progress_callback(copied, total)
+    return copied
+
+
+def _reindex_chroma(settings, progress_callback):
+    client = get_db()._client
+    name, temp_name = Config.COLLECTION_NAME, f"{Config.COLLECTION_NAME}-reindex"
+    source = client.get_collection(name)
+    try:
+        leftover = client.get_collection(temp_name)
+    except Exception:
+        leftover = None
+    if leftover is not None:
+        if not source.count() and leftover.count():
+            # A previous reindex stopped between dropping the old collection and renaming the new one
+            client.delete_collection(name)
+            leftover.modify(name=name)
+            return leftover.count()
+        client.delete_collection(temp_name)
+
+    # The old collection serves until the new one is complete
+    target = client.create_collection(temp_name, metadata=hnsw_metadata(settings))
+    copied = _copy_records(source, target, progress_callback)
+    client.delete_collection(name)
+    target.modify(name=name)
+    return copied
+
+
+def _reindex_numpy(settings, progress_callback):
+    path = get_numpy_store_path()
+    temp_path, old_path = path + ".reindex", path + ".old"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+    target = NumpyVectorStore(temp_path, dtype=Config.NUMPY_STORE_DTYPE, space=settings["space"],
+                              search_block=Config.NUMPY_SEARCH_BLOCK)
+    copied = _copy_records(get_db(), target, progress_callback)
+    os.replace(path, old_path)
+    os.replace(temp_path, path)
+    shutil.rmtree(old_path)
+    return copied
+
+
+def reindex(settings=None, progress_callback=None):
+    """Rebuild the vector index of ``Config.COLLECTION_NAME`` with new settings.
+
+    Records (IDs, embeddings, texts and metadata) are copied into a new
+    collection built with the settings, which then replaces the old one, so
+    nothing is re-embedded and the file catalog stays valid. With the numpy
+    backend this also converts the store to ``NUMPY_STORE_DTYPE``. Nothing
+    else should write to the store while it runs.
+
+    Args:
+        settings (dict, optional): Index settings, defaults to ``get_index_settings()``.
+        progress_callback (callable, optional): Called with ``(copied, total)`` after every batch.
+
+    Returns:
+        int: The number of copied records.
+    """
+    settings = settings or get_index_settings()
+    if Config.VECTOR_BACKEND == "numpy":
+        copied = _reindex_numpy(settings, progress_callback)
+    else:
+        copied = _reindex_chroma(settings, progress_callback)
+    reset_db()
+    # Distances change with the index, so cached retrievals are stale
+    get_catalog().bump_collection_version()
+    return copied
+
+
+def sample_vectors(count, sample_size, seed):
+    """Read a uniform random sample of the stored embeddings.
+
+    All records are paged through, but only the sampled rows are kept.
+
+    Returns:
+        np.ndarray: ``(sample_size, dimensions)`` float32 matrix (fewer rows if the store is smaller).
+    """
+    rng = np.random.default_rng(seed)
+    chosen = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+    rows, offset = [], 0
+    for batch in iter_records(get_collection(), 1000, include=("embeddings",)):
+        stop = offset + len(batch["ids"])
+        selected = chosen[(chosen >= offset) & (chosen < stop)] - offset
+        if len(selected):
+            rows.append(np.asarray(batch["embeddings"], dtype=np.float32)[selected])
+        offset = stop
+    return np.concatenate(rows) if rows else np.empty((0, 0), dtype=np.float32)
+
+
+def exact_neighbors(vectors, queries, k, space):
+    """Return the row indices of the ``k`` nearest vectors of every query by brute force.
+
+    Args:
+        vectors (np.ndarray): Indexed vectors.
+        queries (np.ndarray): Query vectors.
+        k (int): Neighbors per query.
+        space (str): ``"l2"``, ``"cosine"`` or ``"ip"``.
+
+    Returns:
+        np.ndarray: ``(queries, k)`` row indices, closest first.
+    """
+    if space == "cosine":
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    # Ranking by -q·v (ip, cosine) or |v|² - 2q·v (l2, |q|² is constant per query)
+    scores = -(queries @ vectors.T)
+    if space == "l2":
+        scores = 2.0 * scores + np.einsum("ij,ij->i", vectors, vectors)
+    top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def calibrate_index(spaces=None, m_values=None, construction_efs=None, search_efs=None, queries=200, k=None,
+                    max_vectors=20000, seed=0):
+    """Report recall@k against search latency for a grid of HNSW settings.
+
+    A sample of the stored embeddings is drawn; ``queries`` of them are held
+    out as queries and the rest is indexed in a temporary Chroma collection
+    per ``(space, M, construction_ef)``. Every ``search_ef`` is then measured
+    against the exact (brute-force) neighbors of the held-out queries.
+
+    Chroma reads ``search_ef`` when it loads an index, so the temporary
+    collection is reopened for every value, which resets the process's Chroma
+    clients: run it as a command, not inside the serving application.
+
+    Args:
+        spaces (list, optional): Distance spaces, defaults to the configured one.
+        m_values (list, optional): ``M`` values, defaults to the configured one.
+        construction_efs (list, optional): ``construction_ef`` values, defaults to the configured one.
+        search_efs (list, optional): ``search_ef`` values, defaults to ``SEARCH_EF_GRID`` and the configured one.
+        queries (int): Held-out queries.
+        k (int, optional): Neighbors per query, defaults to ``Config.SEARCH_K``.
+        max_vectors (int): Stored vectors sampled (including the queries).
+        seed (int): Seed of the sample.
+
+    Returns:
+        list: One dict of settings, build time, recall and latency percentiles per grid point.
+    """
+    import chromadb
+    from chromadb.api.client import SharedSystemClient
+
+    settings = get_index_settings()
+    k = k or Config.SEARCH_K
+    count = get_collection().count()
+    if count < queries + k:
+        print(f"Calibration needs at least {queries + k} stored chunks, the collection has {count}")
+        return []
+    sample = sample_vectors(count, max_vectors, seed)
+    held_out, indexed = sample[:queries], sample[queries:]
+    ids = [str(row) for row in range(len(indexed))]
+    print(f"Calibrating on {len(indexed)} of {count} stored vectors with {queries} held-out queries, k={k}")
+
+    workdir = tempfile.mkdtemp(prefix="pharmaquery-calibrate-")
+    client = chromadb.PersistentClient(path=workdir)
+    results = []
+    for space in spaces or [settings["space"]]:
+        truth = exact_neighbors(indexed, held_out, k, space)
+        for m in m_values or [settings["M"]]:
+            for construction_ef in construction_efs or [settings["construction_ef"]]:
+                name = f"calibrate-{space}-{m}-{construction_ef}"
+                collection = client.create_collection(name, metadata=hnsw_metadata(
+                    {"space": space, "M": m, "construction_ef": construction_ef}))
+                started = time.perf_counter()
+                batch_size = client.get_max_batch_size()
+                for start in range(0, len(indexed), batch_size):
+                    collection.add(ids=ids[start:start + batch_size], embeddings=indexed[start:start + batch_size])
+                build_seconds = time.perf_counter() - started
+
+                for search_ef in search_efs or sorted({*SEARCH_EF_GRID, settings["search_ef"]}):
+                    set_search_ef(collection, search_ef)
+                    SharedSystemClient.clear_system_cache()
+                    client = chromadb.PersistentClient(path=workdir)
+                    collection = client.get_collection(name)
+                    collection.query(query_embeddings=held_out[:1], n_results=k)
+                    latencies, recalls = [], []
+                    for query, expected in zip(held_out, truth):
+                        started = time.perf_counter()
+                        found = collection.query(query_embeddings=query[None, :], n_results=k, include=[])["ids"][0]
+                        latencies.append(time.perf_counter() - started)
+                        recalls.append(len({int(record_id) for record_id in found} & set(expected.tolist())) / k)
+                    results.append({
+                        "space": space, "M": m, "construction_ef": construction_ef, "search_ef": search_ef,
+                        "build_seconds": build_seconds, "recall": float(np.mean(recalls)),
+                        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+                        "p99_ms": float(np.percentile(latencies, 99)) * 1000,
+                    })
+                client.delete_collection(name)
+    SharedSystemClient.clear_system_cache()
+    reset_db()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'space':<7} {'M':>4} {'constr.ef':>9} {'search_ef':>9} {'build':>8} "
+          f"{'recall@' + str(k):>9} {'p50':>8} {'p99':>8}")
+    for result in results:
+        current = all(result[name] == settings[name] for name in DEFAULT_INDEX_SETTINGS)
+        print(f"{result['space']:<7} {result['M']:4d} {result['construction_ef']:9d} {result['search_ef']:9d} "
+              f"{result['build_seconds']:7.1f}s {result['recall']:9.1%} {result['p50_ms']:6.2f}ms "
+              f"{result['p99_ms']:6.2f}ms{'  (configured)' if current else ''}")
+    return results
@@ -0,0 +1,511 @@
+import os
+import json
+import uuid
+import threading
+from collections import namedtuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+# Distance spaces of Chroma, so both backends return comparable scores
+SPACES = ("l2", "cosine", "ip")
+DTYPES = {"float16": np.float16, "int8": np.int8}
+
+# Per-row values next to the matrix: dequantization scale, squared norm and live flag
+ROW_DTYPE = np.dtype([("scale", "<f4"), ("norm", "<f4"), ("live", "u1")])
+
+# Deleted rows are dropped by rewriting the store once they exceed this share of all rows
+COMPACT_RATIO = 0.5
+MIN_CAPACITY = 1024
+
+_View = namedtuple("_View", "count vectors rows spans ids columns rows_by_id documents_path")
+
+
+def _read_jsonl(path, size):
+    """Read the first ``size`` bytes of a JSON Lines file as a list of values."""
+    if not size:
+        return []
+    with open(path, "rb") as jsonl_file:
+        return [json.loads(line) for line in jsonl_file.read(size).splitlines()]
+
+
+def _append(path, size, data):
+    """Append bytes to a file after cutting it back to its committed size.
+
+    Bytes beyond ``size`` belong to a write that never committed its header.
+
+    Returns:
+        int: The new committed size.
+    """
+    with open(path, "ab") as output_file:
+        output_file.truncate(size)
+        output_file.write(data)
+    return size + len(data)
+
+
+def _jsonl(values):
+    """Encode values as JSON Lines."""
+    return "".join(json.dumps(value, ensure_ascii=False) + "\n" for value in values).encode("utf-8")
+
+
+class NumpyVectorStore(VectorStore):
+    """Vector store keeping embeddings in a memory-mapped NumPy matrix.
+
+    Embeddings are stored as float16, or as int8 with one scale per row, and
+    searched with a blocked matrix product over the memory-mapped rows, so the
+    matrix lives in the page cache (shared by every process serving the store)
+    instead of in each process's heap. Chunk texts are appended to one file
+    and read only for the hits; metadata is kept column by column, one JSON
+    Lines file per key. Distances follow Chroma's spaces (squared L2 by
+    default), so both backends can be swapped without retuning thresholds.
+
+    Files of the store directory (``<n>`` is the generation, bumped by compaction):
+
+    - ``vectors.<n>.bin``: ``(capacity, dimensions)`` matrix
+    - ``rows.<n>.bin``: scale, squared norm and live flag per row
+    - ``spans.<n>.bin`` / ``documents.<n>.bin``: byte offset and length of each text / UTF-8 texts
+    - ``ids.<n>.jsonl`` / ``column-<i>.<n>.jsonl``: record IDs / values of the ``i``-th metadata key
+    - ``header.json``: dimensions, storage type, space, row count and the committed size of every file
+
+    The header is replaced atomically after the data files are written, so an
+    interrupted write leaves the previous state. Deletes only clear the live
+    flag; the rows are dropped when the store is compacted.
+    """
+    def __init__(self, path, embedding_function=None, dtype="float16", space="l2", search_block=1024):
+        """Open (or prepare) the store in a directory.
+
+        Args:
+            path (str): Directory of the store.
+            embedding_function (Embeddings, optional): Model used by ``add_texts`` and text queries.
+            dtype (str): Storage type of new stores, ``"float16"`` or ``"int8"``.
+            space (str): Distance space of new stores, ``"l2"``, ``"cosine"`` or ``"ip"``.
+            search_block (int): Rows scored per matrix product.
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype!r}, expected one of {sorted(DTYPES)}")
+        if space not in SPACES:
+            raise ValueError(f"Unsupported space {space!r}, expected one of {list(SPACES)}")
+        self.path = path
+        self._embedding_function = embedding_function
+        self.search_block = search_block
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._header = {"version": 1, "generation": 0, "dimensions": None, "dtype": dtype, "space": space,
+                        "count": 0, "capacity": 0, "deleted": 0, "columns": [], "sizes": {}}
+        self._header_stat = None
+        self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    @property
+    def dtype(self):
+        """Return the storage type of the matrix."""
+        return self._header["dtype"]
+
+    @property
+    def space(self):
+        """Return the distance space."""
+        return self._header["space"]
+
+    def _file(self, name, generation=None):
+        generation = self._header["generation"] if generation is None else generation
+        return os.path.join(self.path, name.format(n=generation))
+
+    def _stat_header(self):
+        try:
+            stat = os.stat(os.path.join(self.path, "header.json"))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _map(self, name, dtype, shape):
+        """Memory-map a data file, growing it to ``shape`` first."""
+        path = self._file(name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) < size:
+            with open(path, "ab") as data_file:
+                data_file.truncate(size)
+        if not size:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _open_arrays(self):
+        header = self._header
+        capacity, dimensions = header["capacity"], header["dimensions"] or 0
+        self._vectors = self._map("vectors.{n}.bin", DTYPES[header["dtype"]], (capacity, dimensions))
+        self._rows = self._map("rows.{n}.bin", ROW_DTYPE, (capacity,))
+        self._spans = self._map("spans.{n}.bin", np.int64, (capacity, 2))
+
+    def _publish(self):
+        """Make the committed rows visible to searches."""
+        self._view = _View(self._header["count"], self._vectors, self._rows, self._spans, self._ids,
+                           self._columns, self._rows_by_id, self._file("documents.{n}.bin"))
+
+    def _load(self):
+        """Read the committed state of the store from disk."""
+        with self._lock:
+            stat = self._stat_header()
+            if stat is not None:
+                with open(os.path.join(self.path, "header.json"), encoding="utf-8") as header_file:
+                    self._header = json.load(header_file)
+            header, sizes = self._header, self._header["sizes"]
+            count = header["count"]
+            self._open_arrays()
+            self._ids = _read_jsonl(self._file("ids.{n}.jsonl"), sizes.get("ids", 0))
+            self._columns = {
+                key: _read_jsonl(self._file(f"column-{index}.{{n}}.jsonl"), sizes.get(f"column-{index}", 0))
+                for index, key in enumerate(header["columns"])
+            }
+            # The newest live row wins if an interrupted upsert left two rows with one ID
+            self._rows_by_id = {}
+            live = self._rows["live"][:count]
+            for row in np.flatnonzero(live):
+                previous = self._rows_by_id.get(self._ids[row])
+                if previous is not None:
+                    self._rows["live"][previous] = 0
+                self._rows_by_id[self._ids[row]] = int(row)
+            self._header_stat = stat
+            self._publish()
+
+    def _refresh(self):
+        """Reload the store if another process committed a write."""
+        if self._stat_header() != self._header_stat:
+            with self._lock:
+                if self._stat_header() != self._header_stat:
+                    self._load()
+
+    def _commit(self):
+        """Atomically replace the header with the in-memory one."""
+        path = os.path.join(self.path, "header.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as header_file:
+            json.dump(self._header, header_file)
+        os.replace(path + ".tmp", path)
+        self._header_stat = self._stat_header()
+
+    def _ensure_capacity(self, rows):
+        header = self._header
+        if rows <= header["capacity"]:
+            return
+        header["capacity"] = max(rows, 2 * header["capacity"], MIN_CAPACITY)
+        # Searches still holding the previous maps keep reading valid memory
+        self._open_arrays()
+
+    def _encode(self, vectors):
+        """Convert float32 rows to the storage type.
+
+        Returns:
+            tuple: Stored rows and the scale of every row.
+        """
+        if self._header["dtype"] == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+
+    def _append_rows(self, stored, scales, norms, ids, texts, metadatas, commit=True):
+        """Append already encoded rows and (unless ``commit`` is false) commit them."""
+        header, sizes = self._header, self._header["sizes"]
+        start = header["count"]
+        stop = start + len(ids)
+        self._ensure_capacity(stop)
+        self._vectors[start:stop] = stored
+        self._rows["scale"][start:stop] = scales
+        self._rows["norm"][start:stop] = norms
+        self._rows["live"][start:stop] = 1
+
+        encoded = [(text or "").encode("utf-8") for text in texts]
+        lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+        offset = sizes.get("documents", 0)
+        self._spans[start:stop, 0] = offset + np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        self._spans[start:stop, 1] = lengths
+        sizes["documents"] = _append(self._file("documents.{n}.bin"), offset, b"".join(encoded))
+        sizes["ids"] = _append(self._file("ids.{n}.jsonl"), sizes.get("ids", 0), _jsonl(ids))
+
+        metadatas = [metadata or {} for metadata in metadatas]
+        columns = dict(self._columns)
+        for key in {key for metadata in metadatas for key in metadata}:
+            if key not in columns:
+                # New keys are backfilled so every column stays aligned with the rows
+                header["columns"].append(key)
+                columns[key] = [None] * start
+                name = f"column-{len(header['columns']) - 1}"
+                sizes[name] = _append(self._file(name + ".{n}.jsonl"), 0, _jsonl(columns[key]))
+        for index, key in enumerate(header["columns"]):
+            name = f"column-{index}"
+            values = [metadata.get(key) for metadata in metadatas]
+            sizes[name] = _append(self._file(name + ".{n}.jsonl"), sizes[name], _jsonl(values))
+            columns[key].extend(values)
+        self._ids.extend(ids)
+        self._columns = columns
+
+        for array in (self._vectors, self._rows, self._spans):
+            if isinstance(array, np.memmap):
+                array.flush()
+        header["count"] = stop
+        if commit:
+            self._commit()
+        for row, record_id in enumerate(ids, start):
+            self._rows_by_id[record_id] = row
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        """Insert records, replacing those whose ID already exists.
+
+        Args:
+            ids (list): Record IDs.
+            embeddings (list): Embedding vector of each record.
+            documents (list, optional): Text of each record.
+            metadatas (list, optional): Metadata dict of each record.
+        """
+        if not ids:
+            return
+        documents = documents or [""] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        # Within one call the last record of an ID wins
+        last = {record_id: index for index, record_id in enumerate(ids)}
+        keep = sorted(last.values())
+        vectors = np.asarray(embeddings, dtype=np.float32)[keep]
+        with self._lock:
+            self._refresh()
+            header = self._header
+            if header["dimensions"] is None:
+                header["dimensions"] = int(vectors.shape[1])
+                self._open_arrays()
+            elif vectors.shape[1] != header["dimensions"]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store "
+                                 f"dimension {header['dimensions']}")
+            ids = [ids[index] for index in keep]
+            replaced = [self._rows_by_id[record_id] for record_id in ids if record_id in self._rows_by_id]
+            stored, scales = self._encode(vectors)
+            dequantized = stored.astype(np.float32) * scales[:, None]
+            self._append_rows(stored, scales, np.einsum("ij,ij->i", dequantized, dequantized), ids,
+                              [documents[index] for index in keep], [metadatas[index] for index in keep])
+            # Old rows are retired only after the new ones are committed
+            self._retire(replaced)
+            self._publish()
+
+    def update(self, ids, metadatas):
+        """Replace the metadata of existing records, like ``chromadb.Collection.update``.
+
+        Metadata columns are append-only, so the records are rewritten with
+        their stored vectors and texts; unknown IDs are ignored.
+
+        Args:
+            ids (list): Record IDs.
+            metadatas (list): New metadata dict of each record.
+        """
+        metadatas = dict(zip(ids, metadatas))
+        with self._lock:
+            records = self.get(ids=list(ids), include=["documents", "embeddings"])
+            self.upsert(records["ids"], records["embeddings"], records["documents"],
+                        [metadatas[record_id] for record_id in records["ids"]])
+
+    def _retire(self, rows):
+        if not rows:
+            return
+        self._rows["live"][rows] = 0
+        if isinstance(self._rows, np.memmap):
+            self._rows.flush()
+        self._header["deleted"] += len(rows)
+        self._commit()
+        if self._header["deleted"] > COMPACT_RATIO * self._header["count"]:
+            self.compact()
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """Embed texts with the embedding function and add them.
+
+        Args:
+            texts (Iterable[str]): Texts to add.
+            metadatas (list, optional): Metadata dict of each text.
+            ids (list, optional): Record IDs. Random IDs are generated if omitted.
+
+        Returns:
+            list: The IDs of the added records.
+        """
+        texts = list(texts)
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in texts]
+        self.upsert(ids, self._embedding_function.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        """Delete records by ID.
+
+        Args:
+            ids (list): Record IDs; unknown IDs are ignored.
+        """
+        with self._lock:
+            self._refresh()
+            rows = [self._rows_by_id.pop(record_id) for record_id in ids or [] if record_id in self._rows_by_id]
+            self._retire(rows)
+
+    def compact(self):
+        """Rewrite the store without its deleted rows into a new generation of files."""
+        with self._lock:
+            self._publish()
+            view, old_generation = self._view, self._header["generation"]
+            live = np.flatnonzero(view.rows["live"][:view.count])
+            header = self._header
+            header.update(generation=old_generation + 1, count=0, capacity=0, deleted=0, columns=[], sizes={})
+            self._ids, self._columns, self._rows_by_id = [], {}, {}
+            self._open_arrays()
+            for start in range(0, len(live), self.search_block):
+                rows = live[start:start + self.search_block]
+                records = self._records(view, rows, include_embeddings=False)
+                self._append_rows(view.vectors[rows], view.rows["scale"][rows], view.rows["norm"][rows],
+                                  [view.ids[row] for row in rows], records["documents"], records["metadatas"],
+                                  commit=False)
+            # The new generation becomes current only once it is complete
+            self._commit()
+            self._publish()
+            for name in os.listdir(self.path):
+                if name.endswith(f".{old_generation}.bin") or name.endswith(f".{old_generation}.jsonl"):
+                    os.remove(os.path.join(self.path, name))
+
+    def count(self):
+        """Return the number of live records."""
+        self._refresh()
+        return len(self._rows_by_id)
+
+    def _records(self, view, rows, include_embeddings=False):
+        """Read IDs, texts, metadata and optionally embeddings of rows."""
+        texts = []
+        if len(rows):
+            with open(view.documents_path, "rb") as documents_file:
+                for row in rows:
+                    offset, length = view.spans[row]
+                    texts.append(os.pread(documents_file.fileno(), int(length), int(offset)).decode("utf-8"))
+        metadatas = [{key: column[row] for key, column in view.columns.items() if column[row] is not None}
+                     for row in rows]
+        records = {"ids": [view.ids[row] for row in rows], "documents": texts, "metadatas": metadatas}
+        if include_embeddings:
+            records["embeddings"] = (view.vectors[rows].astype(np.float32)
+                                     * view.rows["scale"][rows][:, None]) if len(rows) else []
+        return records
+
+    def get(self, ids=None, where=None, limit=None, offset=0, include=("documents", "metadatas")):
+        """Fetch records like ``chromadb.Collection.get``.
+
+        Args:
+            ids (list, optional): Record IDs to fetch; all records if omitted.
+            where (dict, optional): Metadata values the records must equal, e.g. ``{"file_id": ...}``.
+            limit (int, optional): Maximum number of records.
+            offset (int): Matching records to skip, for paging.
+            include (list): Any of ``"documents"``, ``"metadatas"`` and ``"embeddings"``.
+
+        Returns:
+            dict: ``ids`` and the included fields, aligned.
+        """
+        self._refresh()
+        view = self._view
+        if ids is not None:
+            rows = [view.rows_by_id.get(record_id, view.count) for record_id in ids]
+            rows = [row for row in rows if row < view.count]
+        else:
+            rows = np.flatnonzero(view.rows["live"][:view.count]).tolist()
+        for key, value in (where or {}).items():
+            column = view.columns.get(key, [])
+            rows = [row for row in rows if row < len(column) and column[row] == value]
+        rows = np.array(rows[offset:offset + limit if limit is not None else None], dtype=np.int64)
+        records = self._records(view, rows, include_embeddings="embeddings" in include)
+        result = {"ids": records["ids"]}
+        for field in ("documents", "metadatas", "embeddings"):
+            result[field] = records[field] if field in include else None
+        return result
+
+    def get_by_ids(self, ids):
+        """Return the documents of the given IDs that exist."""
+        records = self.get(ids=list(ids))
+        return [Document(id=record_id, page_content=text, metadata=metadata)
+                for record_id, text, metadata in zip(records["ids"], records["documents"], records["metadatas"])]
+
+    def _distances(self, dots, query_norms, row_norms):
+        if self.space == "ip":
+            return 1.0 - dots
+        if self.space == "cosine":
+            return 1.0 - dots / np.maximum(np.sqrt(query_norms)[:, None] * np.sqrt(row_norms)[None, :], 1e-12)
+        return np.maximum(query_norms[:, None] + row_norms[None, :] - 2.0 * dots, 0.0)
+
+    def search_by_vectors(self, embeddings, k=4):
+        """Find the ``k`` closest records of several query vectors at once.
+
+        The matrix is scanned once for all queries, one block of
+        ``search_block`` rows per matrix product, keeping the running top
+        ``k`` per query, so memory stays bounded by the block size.
+
+        Args:
+            embeddings (list): Query vectors.
+            k (int): Records per query.
+
+        Returns:
+            list: For every query, ``(Document, distance)`` pairs, closest first.
+        """
+        self._refresh()
+        view = self._view
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if not view.count or not len(queries):
+            return [[] for _ in queries]
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, view.count, self.search_block):
+            stop = min(start + self.search_block, view.count)
+            rows = view.rows[start:stop]
+            dots = queries @ view.vectors[start:stop].astype(np.float32).T
+            if self.dtype == "int8":
+                dots *= rows["scale"]
+            distances = self._distances(dots, query_norms, rows["norm"])
+            distances[:, rows["live"] == 0] = np.inf
+            candidates = np.concatenate((best_distances, distances), axis=1)
+            candidate_rows = np.concatenate((best_rows, np.broadcast_to(np.arange(start, stop), distances.shape)),
+                                            axis=1)
+            if candidates.shape[1] > k:
+                keep = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+                candidates = np.take_along_axis(candidates, keep, axis=1)
+                candidate_rows = np.take_along_axis(candidate_rows, keep, axis=1)
+            best_distances, best_rows = candidates, candidate_rows
+
+        order = np.argsort(best_distances, axis=1, kind="stable")
+        best_distances = np.take_along_axis(best_distances, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        results = []
+        for distances, rows in zip(best_distances, best_rows):
+            found = np.isfinite(distances)
+            records = self._records(view, rows[found])
+            results.append([
+                (Document(id=record_id, page_content=text, metadata=metadata), float(distance))
+                for record_id, text, metadata, distance in zip(records["ids"], records["documents"],
+                                                               records["metadatas"], distances[found])
+            ])
+        return results
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, **kwargs):
+        """Return the ``k`` closest documents with their distance (lower is closer), like Chroma."""
+        return self.search_by_vectors([embedding], k)[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        """Return the ``k`` documents closest to an embedding."""
+        return [doc for doc, _ in self.search_by_vectors([embedding], k)[0]]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        """Embed a query and return the ``k`` closest documents with their distance."""
+        return self.search_by_vectors([self._embedding_function.embed_query(query)], k)[0]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        """Embed a query and return the ``k`` closest documents."""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        if self.space == "cosine":
+            return self._cosine_relevance_score_fn
+        if self.space == "ip":
+            return self._max_inner_product_relevance_score_fn
+        return self._euclidean_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path="./pharma_db/numpy", **kwargs):
+        """Create a store in ``path`` and add texts to it."""
+        store = cls(path, embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
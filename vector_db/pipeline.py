@@ -0,0 +1,459 @@
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from data_loader.pdf_loader import iter_pdf_pages, count_pdf_pages
+from text_splitter.splitter import create_recursive_splitter, split_documents, splitter_settings
+from vector_db.chroma_db import add_embeddings_to_db, delete_chunks_from_db, relabel_chunks, get_stored_ids
+from vector_db.catalog import make_chunk_id
+from config import get_catalog, get_embedding_model, Config
+from utils.metrics import Trace
+
+# Marks the end of the stream of batches flowing between stages
+_STOP = object()
+
+_process_pool = None
+_process_manager = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """Return the shared process pool used for PDF parsing and splitting.
+
+    The pool is created on first use and reused across uploads so that worker
+    start-up is only paid once per server process.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=Config.INGEST_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def _get_process_manager():
+    """Return the shared manager whose queues carry page batches back from the process pool."""
+    global _process_manager
+    with _process_pool_lock:
+        if _process_manager is None:
+            _process_manager = multiprocessing.get_context("spawn").Manager()
+        return _process_manager
+
+
+def load_and_split(source, file_name, key, results, cancel, splitter_options, page_batch_size, page_range=None):
+    """Parse a PDF (or a range of its pages) incrementally and stream its chunks into a queue.
+
+    Pages are read lazily from the in-memory PDF and split ``page_batch_size``
+    pages at a time, so the embedder can start on the first pages while later
+    ones are still being parsed and memory use does not grow with the page
+    count. Runs inside a worker process (or thread), so only plain data is put
+    on the queue: ``(key, page_count, [(text, metadata), ...], timings, done)``
+    per batch, with ``done`` set on the last one.
+
+    Args:
+        source: PDF content (bytes or buffer) or path.
+        file_name (str): File name stored as the ``source`` metadata.
+        key: Identifies the file in the queued results.
+        results: Queue receiving the page batches (bounded for backpressure).
+        cancel: Event set when the pipeline fails; parsing stops early.
+        splitter_options (dict): Keyword arguments for ``create_recursive_splitter``.
+        page_batch_size (int): Pages split and queued together.
+        page_range (tuple, optional): ``(start, stop)`` page indices to process,
+            defaults to the whole file.
+    """
+    splitter = create_recursive_splitter(**splitter_options)
+
+    def emit(pages, load_seconds, done):
+        start = time.perf_counter()
+        chunks = [(chunk.page_content, chunk.metadata) for chunk in split_documents(splitter, pages)]
+        item = (key, len(pages), chunks, {"load": load_seconds, "split": time.perf_counter() - start}, done)
+        # Block while the pipeline is behind, but give up once it has failed
+        while not cancel.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    pages = []
+    start = time.perf_counter()
+    start_page, stop_page = page_range or (0, None)
+    for page in iter_pdf_pages(source, file_name, start_page, stop_page):
+        pages.append(page)
+        if len(pages) >= page_batch_size:
+            if not emit(pages, time.perf_counter() - start, False):
+                return
+            pages = []
+            start = time.perf_counter()
+    emit(pages, time.perf_counter() - start, True)
+
+
+class IngestStats:
+    """Thread-safe per-stage counters for a running ingestion pipeline."""
+    def __init__(self, total_files):
+        """Initialize the counters.
+
+        Args:
+            total_files (int): Number of files submitted to the pipeline.
+        """
+        self.total_files = total_files
+        self.started = time.perf_counter()
+        self.files_parsed = 0
+        self.pages_parsed = 0
+        self.chunks_split = 0
+        self.chunks_reused = 0
+        self.chunks_deleted = 0
+        self.chunks_embedded = 0
+        self.chunks_written = 0
+        self.embed_requests = 0
+        self.embed_seconds = 0.0
+        # Files skipped because a different file with the same name is ingested
+        self.conflicts = []
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        """Increment one or more counters atomically."""
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def elapsed(self):
+        """Seconds since the pipeline started."""
+        return max(time.perf_counter() - self.started, 1e-9)
+
+    def as_dict(self):
+        """Return a snapshot of the counters and derived throughput.
+
+        Returns:
+            dict: Counters plus per-stage throughput in items per second.
+        """
+        with self._lock:
+            elapsed = self.elapsed()
+            return {
+                "total_files": self.total_files,
+                "files_parsed": self.files_parsed,
+                "pages_parsed": self.pages_parsed,
+                "chunks_split": self.chunks_split,
+                "chunks_reused": self.chunks_reused,
+                "chunks_deleted": self.chunks_deleted,
+                "chunks_embedded": self.chunks_embedded,
+                "chunks_written": self.chunks_written,
+                "elapsed": elapsed,
+                "files_per_second": self.files_parsed / elapsed,
+                "pages_per_second": self.pages_parsed / elapsed,
+                "embed_chunks_per_second": self.chunks_embedded / elapsed,
+                "write_chunks_per_second": self.chunks_written / elapsed,
+                "avg_embed_latency": self.embed_seconds / self.embed_requests if self.embed_requests else 0.0,
+                "conflicts": list(self.conflicts),
+            }
+
+    def summary(self):
+        """Return a one-line human readable progress summary."""
+        stats = self.as_dict()
+        return (
+            f"Parsed {stats['files_parsed']}/{stats['total_files']} files "
+            f"({stats['pages_per_second']:.1f} pages/s) · "
+            f"Embedded {stats['chunks_embedded']}/{stats['chunks_split'] - stats['chunks_reused']} new chunks "
+            f"({stats['embed_chunks_per_second']:.1f} chunks/s, {stats['chunks_reused']} reused) · "
+            f"Written {stats['chunks_written']} chunks "
+            f"({stats['write_chunks_per_second']:.1f} chunks/s)"
+        )
+
+
+def run_ingest_pipeline(jobs, progress_callback=None, progress_interval=0.5, trace=None, stats=None):
+    """Run files through a staged parse -> embed -> write pipeline.
+
+    PDF parsing and splitting run in a process pool, streaming batches of pages
+    from the in-memory files so embedding starts on the first pages of a file
+    while later ones are still being parsed. Embedding requests are sent as
+    concurrent batches and vector store writes are batched. Stages are connected
+    by bounded queues so a fast stage cannot run far ahead of a slow one, which
+    keeps memory flat regardless of document size.
+
+    Chunks get content-addressed IDs: chunks already stored (by an earlier
+    version of the file or by another file) are only referenced, not embedded
+    again. A reused chunk deleted while the files were processed (because the
+    file it came from was deleted or revised meanwhile) is embedded and
+    written again before it is referenced. Once everything is written the
+    catalog references are replaced,
+    chunks no file references any more are deleted and the reused chunks are
+    attributed to the newest file referencing them, at their position in it.
+
+    Args:
+        jobs (list): One dict per file with ``data`` (PDF bytes, buffer or path), ``file_id``, ``file_name``,
+            ``file_hash`` and the ``metadata`` to stamp on every chunk of that file.
+        progress_callback (callable, optional): Called from the calling thread with
+            the :class:`IngestStats` every ``progress_interval`` seconds and once at the end.
+        progress_interval (float): Seconds between progress callbacks.
+        trace (Trace, optional): Trace receiving the busy time of every stage
+            (summed over files, batches and threads).
+        stats (IngestStats, optional): Counters to add to, so throughput can be
+            reported across several pipeline runs.
+
+    Returns:
+        IngestStats: Final pipeline counters.
+    """
+    trace = trace or Trace("ingest")
+    stats = stats or IngestStats(len(jobs))
+    if not jobs:
+        return stats
+    for job in jobs:
+        # (page, chunk ID) -> start index of the chunk in that page
+        job["refs"] = {}
+        # Reused chunk ID -> (text, metadata), kept in case the chunk must be stored again
+        job["reused"] = {}
+
+    embed_queue = queue.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+    errors = []
+    failed = threading.Event()
+    # Chunk IDs queued for embedding by this run, shared across files
+    scheduled = set()
+    embedding_model = get_embedding_model()
+
+    def put(target_queue, item):
+        # Block on a full queue but give up once another stage has failed
+        while not failed.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fail(error):
+        errors.append(error)
+        failed.set()
+
+    def plan_segments():
+        # Large files are split into page ranges parsed by several processes;
+        # everything else is parsed whole, one file per task
+        segments = []
+        for index, job in enumerate(jobs):
+            page_count = count_pdf_pages(job["data"]) if Config.INGEST_WORKERS > 1 else 0
+            if page_count > Config.INGEST_SEGMENT_PAGES:
+                size = max(Config.INGEST_SEGMENT_PAGES, -(-page_count // Config.INGEST_WORKERS))
+                segments += [(index, (start, start + size)) for start in range(0, page_count, size)]
+            else:
+                segments.append((index, None))
+        for index, job in enumerate(jobs):
+            job["segments"] = sum(1 for key, _ in segments if key == index)
+        return segments
+
+    def parse_stage():
+        try:
+            with trace.span("plan"):
+                segments = plan_segments()
+            if len(segments) > 1 and Config.INGEST_WORKERS > 1:
+                executor, owned, in_flight = _get_process_pool(), False, Config.INGEST_WORKERS
+                manager = _get_process_manager()
+                results = manager.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+                cancel = manager.Event()
+            else:
+                # A single small file is not worth the cost of shipping work to another process
+                executor, owned, in_flight = ThreadPoolExecutor(max_workers=1), True, 1
+                results = queue.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+                cancel = threading.Event()
+            options = splitter_settings()
+            futures = []
+
+            def submit(segment):
+                index, page_range = segments[segment]
+                job = jobs[index]
+                # Buffers cannot be sent to another process; copies are made
+                # only for the segments in flight (paths are read by the worker)
+                source = job["data"] if owned or isinstance(job["data"], str) else bytes(job["data"])
+                futures.append(executor.submit(
+                    load_and_split, source, job["file_name"], index, results, cancel,
+                    options, Config.INGEST_PAGE_BATCH, page_range
+                ))
+
+            try:
+                next_segment = min(in_flight, len(segments))
+                for segment in range(next_segment):
+                    submit(segment)
+                remaining = len(segments)
+                batch = []
+                while remaining and not failed.is_set():
+                    try:
+                        key, page_count, chunks, timings, done = results.get(timeout=0.1)
+                    except queue.Empty:
+                        # Surface worker errors (including a broken process pool)
+                        for future in futures:
+                            if future.done() and future.exception() is not None:
+                                raise future.exception()
+                        continue
+                    job = jobs[key]
+                    for stage, seconds in timings.items():
+                        trace.add_span(stage, seconds)
+                    job["page_count"] = job.get("page_count", 0) + page_count
+                    with trace.span("dedup"):
+                        chunk_ids = [make_chunk_id(text) for text, _ in chunks]
+                        existing = get_catalog().existing_chunk_ids(chunk_ids)
+                    reused = 0
+                    for chunk_id, (text, metadata) in zip(chunk_ids, chunks):
+                        job["refs"].setdefault((metadata.get("page", 0), chunk_id), metadata.get("start_index"))
+                        if chunk_id in existing or chunk_id in scheduled:
+                            job["reused"][chunk_id] = (text, metadata)
+                            reused += 1
+                            continue
+                        scheduled.add(chunk_id)
+                        metadata.update(job["metadata"])
+                        batch.append((chunk_id, text, metadata))
+                        if len(batch) >= Config.EMBED_BATCH_SIZE:
+                            if not put(embed_queue, batch):
+                                return
+                            batch = []
+                    stats.add(pages_parsed=page_count, chunks_split=len(chunks), chunks_reused=reused)
+                    if done:
+                        remaining -= 1
+                        job["segments"] -= 1
+                        if not job["segments"]:
+                            stats.add(files_parsed=1)
+                        if next_segment < len(segments):
+                            submit(next_segment)
+                            next_segment += 1
+                if batch:
+                    put(embed_queue, batch)
+            finally:
+                cancel.set()
+                if owned:
+                    executor.shutdown(wait=False)
+        except Exception as e:
+            fail(e)
+        finally:
+            for _ in range(Config.EMBED_CONCURRENCY):
+                put(embed_queue, _STOP)
+
+    def embed_stage():
+        try:
+            while not failed.is_set():
+                try:
+                    batch = embed_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if batch is _STOP:
+                    return
+                texts = [text for _, text, _ in batch]
+                start = time.perf_counter()
+                vectors = embedding_model.embed_documents(texts)
+                seconds = time.perf_counter() - start
+                stats.add(chunks_embedded=len(batch), embed_requests=1, embed_seconds=seconds)
+                trace.add_span("embed", seconds)
+                put(write_queue, (batch, vectors))
+        except Exception as e:
+            fail(e)
+
+    def write_stage():
+        pending_ids, pending_texts, pending_vectors, pending_metadatas = [], [], [], []
+
+        def flush():
+            with trace.span("write"):
+                add_embeddings_to_db(pending_texts, pending_vectors, pending_metadatas, ids=pending_ids)
+            stats.add(chunks_written=len(pending_texts))
+            pending_ids.clear()
+            pending_texts.clear()
+            pending_vectors.clear()
+            pending_metadatas.clear()
+
+        try:
+            finished_embedders = 0
+            while not failed.is_set():
+                try:
+                    item = write_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _STOP:
+                    finished_embedders += 1
+                    if finished_embedders == Config.EMBED_CONCURRENCY:
+                        break
+                    continue
+                batch, vectors = item
+                for (chunk_id, text, metadata), vector in zip(batch, vectors):
+                    pending_ids.append(chunk_id)
+                    pending_texts.append(text)
+                    pending_metadatas.append(metadata)
+                    pending_vectors.append(vector)
+                if len(pending_texts) >= Config.DB_WRITE_BATCH_SIZE:
+                    flush()
+            if pending_texts and not failed.is_set():
+                flush()
+        except Exception as e:
+            fail(e)
+
+    def embed_worker():
+        embed_stage()
+        put(write_queue, _STOP)
+
+    threads = [threading.Thread(target=parse_stage, name="ingest-parse", daemon=True)]
+    threads += [
+        threading.Thread(target=embed_worker, name=f"ingest-embed-{i}", daemon=True)
+        for i in range(Config.EMBED_CONCURRENCY)
+    ]
+    writer = threading.Thread(target=write_stage, name="ingest-write", daemon=True)
+    threads.append(writer)
+    for thread in threads:
+        thread.start()
+
+    # Report progress from the calling thread (Streamlit elements can only be
+    # updated from the script thread)
+    while writer.is_alive():
+        writer.join(timeout=progress_interval)
+        if progress_callback is not None:
+            progress_callback(stats)
+    failed.set()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    def restore_missing():
+        reused = {}
+        for job in jobs:
+            for chunk_id, (text, metadata) in job["reused"].items():
+                reused.setdefault(chunk_id, (text, {**metadata, **job["metadata"]}))
+        stored = get_stored_ids(list(reused))
+        missing = [chunk_id for chunk_id in reused if chunk_id not in stored]
+        for start in range(0, len(missing), Config.EMBED_BATCH_SIZE):
+            batch = missing[start:start + Config.EMBED_BATCH_SIZE]
+            texts = [reused[chunk_id][0] for chunk_id in batch]
+            with trace.span("embed"):
+                vectors = embedding_model.embed_documents(texts)
+            with trace.span("write"):
+                add_embeddings_to_db(texts, vectors, [reused[chunk_id][1] for chunk_id in batch], ids=batch)
+            stats.add(chunks_reused=-len(batch), chunks_embedded=len(batch), chunks_written=len(batch))
+
+    catalog = get_catalog()
+    # Record the new references only after all chunks are written, then drop the
+    # chunks no file references any more (checked across all files of this run).
+    # Reused chunks are checked again under the commit lock: a file deleted or
+    # revised since they were looked up may have deleted them
+    with trace.span("catalog"), catalog.commit_lock:
+        restore_missing()
+        candidates, relabel = set(), set()
+        for job in jobs:
+            # Reused chunks and the dropped chunks other files keep may name another file
+            previous = catalog.get_file_chunk_ids(job["file_id"]) or []
+            relabel.update(job["reused"], set(previous) - {chunk_id for _, chunk_id in job["refs"]})
+            candidates.update(catalog.replace_file(
+                job["file_id"], job["file_name"], job["file_hash"],
+                [(page, chunk_id, start_index) for (page, chunk_id), start_index in job["refs"].items()],
+                file_size=job.get("size", 0),
+                page_count=job["page_count"],
+                upload_time=job["metadata"].get("upload_time", "")
+            ))
+        orphaned = list(candidates - catalog.existing_chunk_ids(candidates))
+        if orphaned:
+            delete_chunks_from_db(orphaned)
+            stats.add(chunks_deleted=len(orphaned))
+        relabel_chunks(relabel - set(orphaned))
+
+    # Invalidate query caches if the collection content changed
+    if stats.chunks_written or stats.chunks_deleted:
+        catalog.bump_collection_version()
+    return stats
@@ -0,0 +1,259 @@
+import os
+import json
+import zlib
+import struct
+import datetime
+import numpy as np
+from config import Config, get_catalog, get_index_settings
+from vector_db.chroma_db import get_collection, delete_chunks_from_db, relabel_chunks
+from vector_db.index import iter_records
+
+MAGIC = b"PQSNAP1\n"
+# Files per catalog block
+_FILES_PER_BLOCK = 256
+
+
+def _pack_columns(rows):
+    """Compress a list of dicts as JSON columns (similar values compress better side by side)."""
+    keys = sorted({key for row in rows for key in row})
+    columns = {key: [row.get(key) for row in rows] for key in keys}
+    return zlib.compress(json.dumps(columns, ensure_ascii=False).encode("utf-8"))
+
+
+def _unpack_columns(data, count):
+    """Inverse of :func:`_pack_columns`; missing values are left out of the dicts."""
+    columns = json.loads(zlib.decompress(data))
+    rows = [{} for _ in range(count)]
+    for key, values in columns.items():
+        for row, value in zip(rows, values):
+            if value is not None:
+                row[key] = value
+    return rows
+
+
+def _pack_texts(texts):
+    return zlib.compress(json.dumps(texts, ensure_ascii=False).encode("utf-8"))
+
+
+def _unpack_texts(data):
+    return json.loads(zlib.decompress(data))
+
+
+class SnapshotWriter:
+    """Writes a snapshot file block by block.
+
+    A snapshot is a sequence of length-prefixed blocks after the ``MAGIC``
+    bytes: a JSON header describing the block followed by its sections. Record
+    blocks are columnar (IDs, one raw embedding matrix, documents and metadata
+    columns, the text sections zlib-compressed); catalog blocks carry the
+    files and their chunk references; an end block marks a complete file.
+    """
+    def __init__(self, path, info):
+        """Create the file (as ``path + ".tmp"`` until it is closed) and write its header.
+
+        Args:
+            path (str): Snapshot file.
+            info (dict): Snapshot description stored in the header block.
+        """
+        self.path = path
+        self._file = open(path + ".tmp", "wb")
+        self._file.write(MAGIC)
+        self.write_block({"kind": "header", **info}, [])
+
+    def write_block(self, header, sections):
+        """Append one block.
+
+        Args:
+            header (dict): Block description; the section lengths are added.
+            sections (list): Byte strings of the block.
+        """
+        header = json.dumps({**header, "sections": [len(section) for section in sections]}).encode("utf-8")
+        self._file.write(struct.pack("<I", len(header)))
+        self._file.write(header)
+        for section in sections:
+            self._file.write(section)
+
+    def close(self):
+        """Write the end block and move the finished file into place."""
+        self.write_block({"kind": "end"}, [])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def abort(self):
+        """Close and remove the unfinished file."""
+        self._file.close()
+        os.remove(self.path + ".tmp")
+
+
+def read_blocks(path, load=True):
+    """Yield the blocks of a snapshot file.
+
+    Args:
+        path (str): Snapshot file.
+        load (bool): Read the sections; otherwise they are skipped and only
+            the block headers are checked.
+
+    Yields:
+        tuple: ``(header, sections)`` of each block, the end block excluded.
+
+    Raises:
+        ValueError: If the file is not a snapshot or is truncated.
+    """
+    with open(path, "rb") as snapshot_file:
+        if snapshot_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        while True:
+            length = snapshot_file.read(4)
+            if len(length) < 4:
+                raise ValueError(f"Snapshot {path} is truncated")
+            header = json.loads(snapshot_file.read(struct.unpack("<I", length)[0]))
+            if header["kind"] == "end":
+                return
+            if load:
+                sections = [snapshot_file.read(size) for size in header["sections"]]
+                if sum(map(len, sections)) != sum(header["sections"]):
+                    raise ValueError(f"Snapshot {path} is truncated")
+            else:
+                sections = []
+                snapshot_file.seek(sum(header["sections"]), os.SEEK_CUR)
+            yield header, sections
+
+
+def export_snapshot(path, since=None, dtype=None, progress_callback=None):
+    """Write the collection and its file catalog to a snapshot file.
+
+    Records are streamed ``SNAPSHOT_BATCH_SIZE`` at a time, so memory use does
+    not depend on the collection size. With ``since``, the snapshot is a delta
+    holding the records and catalog files ingested at or after that time
+    (their ``upload_time``); chunks shared with older files are expected to be
+    on the importing node already. Deletions are not carried by deltas.
+
+    Args:
+        path (str): Snapshot file to write.
+        since (str, optional): ``"YYYY-MM-DD[ HH:MM:SS]"`` lower bound of the
+            ingest time; everything is exported if omitted.
+        dtype (str, optional): ``"float32"`` (exact) or ``"float16"`` (half the
+            size), defaults to ``Config.SNAPSHOT_DTYPE``.
+        progress_callback (callable, optional): Called with ``(scanned, total)``
+            records after every batch.
+
+    Returns:
+        dict: ``records`` and ``files`` written.
+    """
+    dtype = np.dtype(dtype or Config.SNAPSHOT_DTYPE)
+    if dtype not in (np.float32, np.float16):
+        raise ValueError(f"Unsupported snapshot dtype: {dtype}")
+    collection = get_collection()
+    total, scanned = collection.count(), 0
+    written = {"records": 0, "files": 0}
+    writer = SnapshotWriter(path, {
+        "collection": Config.COLLECTION_NAME,
+        "dtype": dtype.name,
+        "since": since,
+        "index": get_index_settings(),
+        "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
+    try:
+        for batch in iter_records(collection, Config.SNAPSHOT_BATCH_SIZE):
+            scanned += len(batch["ids"])
+            keep = [index for index, metadata in enumerate(batch["metadatas"])
+                    if since is None or (metadata or {}).get("upload_time", "") >= since]
+            if keep:
+                vectors = np.ascontiguousarray(np.asarray(batch["embeddings"])[keep], dtype=dtype)
+                writer.write_block({"kind": "records", "rows": len(keep), "dimensions": vectors.shape[1]}, [
+                    _pack_texts([batch["ids"][index] for index in keep]),
+                    vectors.tobytes(),
+                    _pack_texts([batch["documents"][index] for index in keep]),
+                    _pack_columns([batch["metadatas"][index] or {} for index in keep])
+                ])
+                written["records"] += len(keep)
+            if progress_callback:
+                progress_callback(scanned, total)
+
+        files = []
+        for file in get_catalog().iter_files(since):
+            files.append(file)
+            if len(files) == _FILES_PER_BLOCK:
+                writer.write_block({"kind": "files", "rows": len(files)}, [_pack_texts(files)])
+                written["files"] += len(files)
+                files = []
+        if files:
+            writer.write_block({"kind": "files", "rows": len(files)}, [_pack_texts(files)])
+            written["files"] += len(files)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return written
+
+
+def import_snapshot(path, progress_callback=None):
+    """Load a snapshot (full or delta) into the collection and the file catalog.
+
+    Records are upserted in batches of ``SNAPSHOT_BATCH_SIZE`` without calling
+    the embedding server, so a new node is warm in the time it takes to write
+    the index. The catalog files replace the local versions of the same files;
+    chunks that no file references any more afterwards are deleted, as after
+    re-ingesting those files.
+
+    Args:
+        path (str): Snapshot file.
+        progress_callback (callable, optional): Called with the number of
+            records loaded after every batch.
+
+    Returns:
+        dict: ``records`` and ``files`` loaded, ``deleted`` chunks and the snapshot ``info``.
+
+    Raises:
+        ValueError: If the file is not a complete snapshot.
+    """
+    # Check that the file is complete before changing anything
+    for _ in read_blocks(path, load=False):
+        pass
+    with get_catalog().commit_lock:
+        return _import_blocks(path, progress_callback)
+
+
+def _import_blocks(path, progress_callback):
+    """Load the blocks of a validated snapshot (called with the catalog commit lock held)."""
+    catalog = get_catalog()
+    collection = get_collection()
+    loaded = {"records": 0, "files": 0, "deleted": 0, "info": None}
+    candidates, relabel = set(), set()
+    for header, sections in read_blocks(path):
+        if header["kind"] == "header":
+            loaded["info"] = header
+        elif header["kind"] == "records":
+            rows = header["rows"]
+            ids = _unpack_texts(sections[0])
+            vectors = np.frombuffer(sections[1], dtype=loaded["info"]["dtype"]).reshape(rows, header["dimensions"])
+            documents = _unpack_texts(sections[2])
+            metadatas = _unpack_columns(sections[3], rows)
+            for start in range(0, rows, Config.SNAPSHOT_BATCH_SIZE):
+                stop = start + Config.SNAPSHOT_BATCH_SIZE
+                collection.upsert(ids=ids[start:stop], embeddings=vectors[start:stop].astype(np.float32),
+                                  documents=documents[start:stop], metadatas=metadatas[start:stop])
+            loaded["records"] += rows
+            if progress_callback:
+                progress_callback(loaded["records"])
+        elif header["kind"] == "files":
+            for file in _unpack_texts(sections[0]):
+                previous = catalog.get_file_chunk_ids(file["id"]) or []
+                relabel.update(set(previous) - {ref[1] for ref in file["refs"]})
+                candidates.update(catalog.replace_file(
+                    file["id"], file["name"], file["hash"], [tuple(ref) for ref in file["refs"]],
+                    file_size=file["size"], page_count=file["page_count"], upload_time=file["upload_time"]
+                ))
+            loaded["files"] += header["rows"]
+
+    orphaned = list(candidates - catalog.existing_chunk_ids(candidates))
+    if orphaned:
+        delete_chunks_from_db(orphaned)
+        loaded["deleted"] = len(orphaned)
+    # Local chunks dropped by the imported files may still be referenced by others
+    relabel_chunks(relabel - set(orphaned))
+    if loaded["records"] or loaded["deleted"]:
+        catalog.bump_collection_version()
+    return loaded